@@ -0,0 +1,210 @@
+"""
+micro-benchmark توابع پرتکرار (به ازای هر ردیف) در endpointهای لیستی
+
+    python benchmarks.py                                  # اجرا و چاپ ops/sec
+    python benchmarks.py --output bench-$(git rev-parse --short HEAD).json
+    python benchmarks.py --compare bench-abc123.json --threshold 10
+
+خروجی JSON شامل commit جاری است تا نتایج commitهای مختلف قابل مقایسه باشند؛ با --compare
+تغییر هر benchmark نسبت به اجرای قبلی چاپ می‌شود و اگر افتی بیشتر از threshold درصد
+وجود داشته باشد، exit code برابر 1 است.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import timeit
+from datetime import date, datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+import main  # noqa: E402
+
+# ==================== Fixtures ====================
+
+CITY = "تهران"
+
+LONG_ADDRESS = (
+    "تهران، محله سعادت آباد، بلوار دریا، خیابان مطهری شمالی، نبش کوچه شهید حسین علی‌پور، "
+    "مجتمع تجاری ستاره غرب، طبقه همکف، واحد ۱۲، روبروی بانک ملت، پلاک ۲۴۲"
+)
+SHORT_ADDRESS = "تهران، خیابان ولیعصر"
+
+SEO_DETAILS = {
+    "name": "آجیل و شیرینی سرای آفاق",
+    "url_title": "آجیل-و-شیرینی-سرای-آفاق-tehran-nei-iran-shahr_nuts-store",
+    "schemas": [
+        {
+            "@type": "LocalBusiness",
+            "name": "آجیل و شیرینی سرای آفاق",
+            "telephone": "02188776655",
+            "address": {
+                "@type": "PostalAddress",
+                "addressLocality": "محله ایرانشهر",
+                "addressRegion": CITY,
+                "streetAddress": LONG_ADDRESS,
+            },
+            "geo": {"@type": "GeoCoordinates", "latitude": 35.7219, "longitude": 51.4215, "addressLocality": CITY},
+            "aggregateRating": {"@type": "AggregateRating", "ratingValue": 4.6, "reviewCount": 312},
+            "openingHoursSpecification": [
+                {"@type": "OpeningHoursSpecification", "dayOfWeek": d, "opens": "08:00", "closes": "23:00"}
+                for d in ["Saturday", "Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+            ],
+        },
+        {"@type": "BreadcrumbList", "itemListElement": [{"position": i, "name": f"سطح {i}"} for i in range(1, 5)]},
+    ],
+}
+SEO_DETAILS_JSON = json.dumps(SEO_DETAILS, ensure_ascii=False)
+# seo_details بدون محله (محله باید از آدرس استخراج شود)
+SEO_DETAILS_CITY_ONLY = {"schemas": [{"address": {"addressLocality": CITY}}]}
+
+FULL_DATA = {
+    "token": "bench0001",
+    "name": SEO_DETAILS["name"],
+    "category": "آجیل و خشکبار",
+    "geometry": {"type": "Point", "coordinates": [51.4215, 35.7219]},
+    "fields": [
+        {"type": "phone", "title": "تلفن", "value": "02188776655"},
+        {"type": "link", "title": "وب‌سایت", "value": "https://example.ir"},
+        {"type": "text", "title": "آدرس", "value": LONG_ADDRESS},
+    ],
+    "phone_link": "tel:02188776655",
+    "rating": 4.6,
+    "reviews": {"total": 312, "items": [{"author": f"کاربر {i}", "text": "کیفیت عالی و برخورد خوب " * 3, "rating": 5} for i in range(10)]},
+    "description": "عرضه انواع آجیل، خشکبار و شیرینی تازه",
+    "price_range": "$$",
+    "working_hours": [{"day": d, "open": "08:00", "close": "23:00"} for d in range(7)],
+    "seo_details": SEO_DETAILS,
+}
+
+ASSIGNED_ROW_BASE = {
+    "id": 1042,
+    "user_id": 17,
+    "store_token": "bench0001",
+    "assigned_date": date(2024, 3, 12),
+    "visit_date": date(2024, 3, 14),
+    "status": "completed",
+    "notes": "بازدید هفتگی",
+    "created_at": datetime(2024, 3, 12, 9, 15, 42),
+    "storeName": SEO_DETAILS["name"],
+    "storeAddress": LONG_ADDRESS,
+    "storeLat": 35.7219,
+    "storeLng": 51.4215,
+    "category": "آجیل و خشکبار",
+    "category_slug": "nuts-store",
+    "city": CITY,
+    "place_phone": "02188776655",
+    "place_rating": 4.6,
+    "place_rating_count": 312,
+    "place_description": None,
+    "place_website": None,
+    "place_email": None,
+    "place_price_range": None,
+    "username": "rep17",
+    "full_name": "نماینده ۱۷",
+}
+# psycopg2 ستون JSONB را به dict تبدیل می‌کند؛ ردیف‌های قدیمی ممکن است رشته JSON داشته باشند
+ASSIGNED_ROW_JSONB = dict(ASSIGNED_ROW_BASE, place_full_data=FULL_DATA)
+ASSIGNED_ROW_TEXT = dict(ASSIGNED_ROW_BASE, place_full_data=json.dumps(FULL_DATA, ensure_ascii=False))
+ASSIGNED_ROW_NO_FULL_DATA = dict(ASSIGNED_ROW_BASE, place_full_data=None)
+
+# ==================== Benchmarks ====================
+
+BENCHMARKS = [
+    ("extract_neighborhood.seo_dict", lambda: main.extract_neighborhood(LONG_ADDRESS, CITY, SEO_DETAILS)),
+    ("extract_neighborhood.seo_json", lambda: main.extract_neighborhood(LONG_ADDRESS, CITY, SEO_DETAILS_JSON)),
+    ("extract_neighborhood.address_fallback", lambda: main.extract_neighborhood(LONG_ADDRESS, CITY, SEO_DETAILS_CITY_ONLY)),
+    ("extract_neighborhood.short_address", lambda: main.extract_neighborhood(SHORT_ADDRESS, CITY, None)),
+    ("calculate_distance", lambda: main.calculate_distance(35.7219, 51.4215, 35.7575, 51.4100)),
+    ("to_jalali_date.date", lambda: main.to_jalali_date(date(2024, 3, 12))),
+    ("to_jalali_date.str", lambda: main.to_jalali_date("2024-03-12")),
+    ("to_jalali_datetime.datetime", lambda: main.to_jalali_datetime(datetime(2024, 3, 12, 9, 15, 42))),
+    ("to_jalali_datetime.iso_str", lambda: main.to_jalali_datetime("2024-03-12T09:15:42Z")),
+    ("build_assigned_store_info.jsonb", lambda: main.build_assigned_store_info(ASSIGNED_ROW_JSONB)),
+    ("build_assigned_store_info.text", lambda: main.build_assigned_store_info(ASSIGNED_ROW_TEXT)),
+    ("build_assigned_store_info.no_full_data", lambda: main.build_assigned_store_info(ASSIGNED_ROW_NO_FULL_DATA)),
+]
+
+def measure(func, repeat: int, min_time: float) -> dict:
+    """بهترین نتیجه از repeat اجرا؛ تعداد تکرار هر اجرا طوری انتخاب می‌شود که حداقل min_time ثانیه طول بکشد"""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1))
+    timings = [elapsed / number] + [t / number for t in timer.repeat(repeat=repeat - 1, number=number)]
+    best = min(timings)
+    return {
+        "opsPerSec": round(1 / best, 1),
+        "bestUs": round(best * 1e6, 3),
+        "medianUs": round(sorted(timings)[len(timings) // 2] * 1e6, 3),
+        "loops": number,
+        "repeat": repeat,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results: dict, baseline_path: str, threshold: float) -> int:
+    """چاپ تغییر ops/sec نسبت به baseline؛ تعداد benchmarkهایی که بیش از threshold درصد کند شده‌اند"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print()
+    print(f"Compared with {baseline.get('commit', '?')} ({baseline_path}):")
+    regressions = 0
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            print(f"  {name:<42} (new)")
+            continue
+        change = (result["opsPerSec"] / previous["opsPerSec"] - 1) * 100
+        marker = ""
+        if change < -threshold:
+            marker = "  REGRESSION"
+            regressions += 1
+        print(f"  {name:<42}{previous['opsPerSec']:>14,.0f} -> {result['opsPerSec']:>14,.0f}  {change:+7.1f}%{marker}")
+    return regressions
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for per-row helpers in main.py")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per repeat")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON file from a previous run")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    selected = [(name, func) for name, func in BENCHMARKS if not args.filter or args.filter in name]
+    results = {}
+    print(f"{'benchmark':<44}{'ops/sec':>14}{'best us':>12}{'median us':>12}")
+    for name, func in selected:
+        result = measure(func, args.repeat, args.min_time)
+        results[name] = result
+        print(f"{name:<44}{result['opsPerSec']:>14,.0f}{result['bestUs']:>12}{result['medianUs']:>12}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "runAt": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,519 @@
+"""
+ابزار load test برای API
+
+دو مرحله:
+    python loadtest.py seed --stores 1000000 --users 200
+        ساخت داده مصنوعی در Postgres محلی (مغازه‌ها با پراکندگی واقعی تهران، کاربران،
+        sessionها، اختصاص‌ها و بازدیدها). تنظیمات اتصال همان متغیرهای DB_* برنامه (main.DB_CONFIG) است.
+
+    python loadtest.py run --base-url http://localhost:8000 --scenario all --duration 30 --concurrency 16
+        اجرای سناریوها (نقشه نزدیک، لیست محله، لیست اختصاص‌ها، ثبت بازدید) و گزارش
+        throughput و latency (p50/p95/p99).
+
+همه داده‌های مصنوعی با پیشوند lt_ / loadtest_ ساخته می‌شوند و با --reset پاک می‌شوند.
+اجرای دوباره seed بدون --reset (با همان --seed و در همان روز) ردیف تکراری نمی‌سازد.
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import random
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import psycopg2
+import requests
+from psycopg2.extras import execute_values
+
+LOADTEST_TOKEN_PREFIX = "lt_"
+LOADTEST_USER_PREFIX = "loadtest_"
+LOADTEST_PASSWORD = "loadtest"
+LOADTEST_CITY = "تهران"
+LOADTEST_PROVINCE = "استان تهران"
+
+# مراکز پرتراکم تهران: (نام محله، عرض، طول، وزن، انحراف معیار به درجه)
+TEHRAN_HOTSPOTS = [
+    ("ونک", 35.7575, 51.4100, 8, 0.008),
+    ("تجریش", 35.8040, 51.4330, 6, 0.007),
+    ("پاسداران", 35.7700, 51.4650, 6, 0.009),
+    ("سعادت آباد", 35.7800, 51.3750, 7, 0.010),
+    ("جنت آباد", 35.7500, 51.3050, 6, 0.010),
+    ("نارمک", 35.7450, 51.5050, 6, 0.009),
+    ("تهرانپارس", 35.7350, 51.5400, 7, 0.010),
+    ("بازار", 35.6750, 51.4200, 9, 0.006),
+    ("انقلاب", 35.7010, 51.3950, 8, 0.006),
+    ("یوسف آباد", 35.7300, 51.4050, 5, 0.006),
+    ("شهرک غرب", 35.7600, 51.3600, 5, 0.008),
+    ("نازی آباد", 35.6400, 51.4100, 6, 0.008),
+    ("شهر ری", 35.5950, 51.4400, 5, 0.012),
+    ("پیروزی", 35.6950, 51.4750, 6, 0.008),
+    ("صادقیه", 35.7200, 51.3400, 7, 0.007),
+    ("مرزداران", 35.7400, 51.3550, 4, 0.006),
+]
+# بقیه مغازه‌ها به صورت یکنواخت در محدوده شهر
+TEHRAN_BBOX = (35.58, 51.22, 35.82, 51.58)
+UNIFORM_SHARE = 0.15
+
+CATEGORIES = [
+    ("سوپرمارکت", "supermarket"),
+    ("آجیل و خشکبار", "nuts-store"),
+    ("شیرینی فروشی", "confectionery"),
+    ("نانوایی", "bakery"),
+    ("میوه فروشی", "fruit-store"),
+    ("لبنیات", "dairy-store"),
+    ("قصابی", "butcher"),
+    ("داروخانه", "pharmacy"),
+    ("کافه", "cafe"),
+    ("رستوران", "restaurant"),
+]
+STREET_WORDS = ["ولیعصر", "شریعتی", "آزادی", "انقلاب", "دماوند", "پیروزی", "ستارخان", "مطهری", "بهشتی", "کارگر", "جمهوری", "نواب"]
+NAME_WORDS = ["آفاق", "ستاره", "بهار", "نگین", "پارس", "ایران", "مهر", "سپیده", "گلستان", "البرز", "نیکان", "آرمان"]
+
+CITY_CATEGORIES_COLUMNS = [
+    "city_name", "province_name", "category_slug", "category_display", "page_number",
+    "place_name", "place_address", "place_coordinates_lat", "place_coordinates_lng",
+    "place_phone", "place_token", "place_rating", "place_rating_count",
+    "place_seo_details", "place_full_data", "is_active", "has_workshop",
+]
+
+# ==================== Seed ====================
+
+def session_token(n: int) -> str:
+    """token ثابت session کاربر n ام load test"""
+    return f"loadtest-session-{n}"
+
+def ensure_city_categories(cur):
+    """ساخت جدول city_categories (در محیط واقعی توسط اسکریپت جمع‌آوری داده ساخته می‌شود)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS city_categories (
+            id SERIAL PRIMARY KEY,
+            city_name VARCHAR(255),
+            city_lat FLOAT,
+            city_lng FLOAT,
+            province_name VARCHAR(255),
+            category_slug VARCHAR(255),
+            category_display VARCHAR(255),
+            page_number INTEGER,
+            place_name TEXT,
+            place_address TEXT,
+            place_coordinates_lat FLOAT,
+            place_coordinates_lng FLOAT,
+            place_phone VARCHAR(100),
+            place_token VARCHAR(255),
+            place_rating FLOAT,
+            place_rating_count INTEGER,
+            place_description TEXT,
+            place_website TEXT,
+            place_email TEXT,
+            place_price_range TEXT,
+            place_seo_details JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def random_point(rng: random.Random) -> tuple:
+    """(محله، عرض، طول) با تراکم مشابه تهران"""
+    if rng.random() < UNIFORM_SHARE:
+        lat = rng.uniform(TEHRAN_BBOX[0], TEHRAN_BBOX[2])
+        lng = rng.uniform(TEHRAN_BBOX[1], TEHRAN_BBOX[3])
+        nearest = min(TEHRAN_HOTSPOTS, key=lambda h: (h[1] - lat) ** 2 + (h[2] - lng) ** 2)
+        return nearest[0], lat, lng
+    name, lat, lng, _, sigma = rng.choices(TEHRAN_HOTSPOTS, weights=[h[3] for h in TEHRAN_HOTSPOTS])[0]
+    return name, rng.gauss(lat, sigma), rng.gauss(lng, sigma)
+
+def synthetic_store(index: int, rng: random.Random) -> list:
+    """یک ردیف city_categories با seo_details و full_data به شکل پاسخ بلد"""
+    neighborhood, lat, lng = random_point(rng)
+    category_display, category_slug = rng.choice(CATEGORIES)
+    name = f"{category_display} {rng.choice(NAME_WORDS)} {index}"
+    street = rng.choice(STREET_WORDS)
+    address = (
+        f"{LOADTEST_CITY}، محله {neighborhood}، خیابان {street}، کوچه {rng.randint(1, 40)}، "
+        f"پلاک {rng.randint(1, 300)}، طبقه همکف"
+    )
+    token = f"{LOADTEST_TOKEN_PREFIX}{index:09d}"
+    rating = round(rng.uniform(2.5, 5.0), 1)
+    rating_count = rng.randint(0, 800)
+    phone = f"021{rng.randint(20000000, 99999999)}"
+    url_title = f"{name.replace(' ', '-')}-tehran-{neighborhood.replace(' ', '-')}_{category_slug}"
+    seo_details = {
+        "name": name,
+        "url_title": url_title,
+        "schemas": [{
+            "@type": "LocalBusiness",
+            "name": name,
+            "telephone": phone,
+            "address": {
+                "@type": "PostalAddress",
+                "addressLocality": f"محله {neighborhood}",
+                "addressRegion": LOADTEST_CITY,
+                "streetAddress": address,
+            },
+            "geo": {"@type": "GeoCoordinates", "latitude": lat, "longitude": lng, "addressLocality": LOADTEST_CITY},
+            "aggregateRating": {"@type": "AggregateRating", "ratingValue": rating, "reviewCount": rating_count},
+        }],
+    }
+    full_data = {
+        "token": token,
+        "name": name,
+        "category": category_display,
+        "geometry": {"type": "Point", "coordinates": [lng, lat]},
+        "fields": [
+            {"type": "text", "title": "آدرس", "value": address},
+            {"type": "phone", "title": "تلفن", "value": phone},
+        ],
+        "phone_link": f"tel:{phone}",
+        "rating": rating,
+        "reviews": {"total": rating_count, "items": []},
+        "description": f"{category_display} در محله {neighborhood}",
+        "price_range": rng.choice(["$", "$$", "$$$"]),
+        "working_hours": [{"day": d, "open": "08:00", "close": "22:00"} for d in range(7)],
+        "seo_details": seo_details,
+    }
+    return [
+        LOADTEST_CITY, LOADTEST_PROVINCE, category_slug, category_display, 1,
+        name, address, lat, lng, phone, token, rating, rating_count,
+        json.dumps(seo_details, ensure_ascii=False), json.dumps(full_data, ensure_ascii=False),
+        "t", "t" if rng.random() < 0.1 else "f",
+    ]
+
+def copy_stores(conn, count: int, batch_size: int, rng: random.Random):
+    """درج مغازه‌ها با COPY در دسته‌های batch_size
+
+    COPY به یک جدول موقت انجام می‌شود و از آنجا با ON CONFLICT (place_token) DO NOTHING درج می‌شود،
+    پس اجرای دوباره seed (بدون --reset) مغازه‌های موجود را تکرار نمی‌کند.
+    """
+    started = time.time()
+    processed = 0
+    inserted = 0
+    columns = ", ".join(CITY_CATEGORIES_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TEMP TABLE loadtest_stores_staging ON COMMIT DELETE ROWS AS "
+            f"SELECT {columns} FROM city_categories WITH NO DATA"
+        )
+        while processed < count:
+            size = min(batch_size, count - processed)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for i in range(processed, processed + size):
+                writer.writerow(synthetic_store(i, rng))
+            buffer.seek(0)
+            cur.copy_expert(f"COPY loadtest_stores_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cur.execute(
+                f"INSERT INTO city_categories ({columns}) SELECT {columns} FROM loadtest_stores_staging "
+                f"ON CONFLICT (place_token) DO NOTHING"
+            )
+            inserted += cur.rowcount
+            conn.commit()
+            processed += size
+            rate = processed / max(time.time() - started, 1e-6)
+            print(f"  stores: {processed}/{count} ({inserted} new, {rate:,.0f} rows/s)", end="\r", flush=True)
+        cur.execute("DROP TABLE loadtest_stores_staging")
+    conn.commit()
+    print()
+
+def seed(args):
+    """ساخت داده مصنوعی"""
+    # تنظیمات اتصال (متغیرهای DB_*) و migrationها از خود برنامه خوانده می‌شوند
+    sys.path.insert(0, str(Path(__file__).parent))
+    import main
+
+    rng = random.Random(args.seed)
+    conn = psycopg2.connect(**main.DB_CONFIG)
+    try:
+        with conn.cursor() as cur:
+            ensure_city_categories(cur)
+        conn.commit()
+        main.run_migrations()
+
+        if args.reset:
+            print("Removing previous load-test data...")
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM users WHERE username LIKE %s", (LOADTEST_USER_PREFIX + "%",))
+                cur.execute("DELETE FROM city_categories WHERE place_token LIKE %s", (LOADTEST_TOKEN_PREFIX + "%",))
+            conn.commit()
+
+        print(f"Seeding {args.stores:,} stores...")
+        copy_stores(conn, args.stores, args.batch_size, rng)
+
+        with conn.cursor() as cur:
+            print(f"Seeding {args.users} users with sessions...")
+            users = execute_values(
+                cur,
+                """INSERT INTO users (username, password_hash, full_name) VALUES %s
+                   ON CONFLICT (username) DO UPDATE SET password_hash = EXCLUDED.password_hash
+                   RETURNING id, username""",
+                [(f"{LOADTEST_USER_PREFIX}{i}", main.hash_password(LOADTEST_PASSWORD), f"Load Test {i}") for i in range(args.users)],
+                fetch=True,
+            )
+            user_ids = sorted(row[0] for row in users)
+            expires_at = datetime.now() + timedelta(days=30)
+            execute_values(
+                cur,
+                """INSERT INTO user_sessions (user_id, session_token, expires_at) VALUES %s
+                   ON CONFLICT (session_token) DO UPDATE SET expires_at = EXCLUDED.expires_at""",
+                [(user_id, session_token(n), expires_at) for n, user_id in enumerate(user_ids)],
+            )
+
+            print(f"Assigning {args.assignments_per_user} stores per user...")
+            # انتخاب قطعی (وابسته به --seed) تا اجرای دوباره همان اختصاص‌ها را بسازد، نه اختصاص‌های جدید
+            sample_size = min(args.stores, args.users * args.assignments_per_user)
+            tokens = [f"{LOADTEST_TOKEN_PREFIX}{i:09d}" for i in rng.sample(range(args.stores), sample_size)]
+            today = date.today()
+            assignment_rows = []
+            for n, user_id in enumerate(user_ids):
+                for token in tokens[n * args.assignments_per_user:(n + 1) * args.assignments_per_user]:
+                    assigned_date = today - timedelta(days=rng.randint(0, 6))
+                    assignment_rows.append((user_id, token, assigned_date, "loadtest"))
+            assignments = execute_values(
+                cur,
+                """INSERT INTO assigned_stores (user_id, store_token, assigned_date, notes) VALUES %s
+                   ON CONFLICT (user_id, store_token, assigned_date) DO UPDATE SET notes = EXCLUDED.notes
+                   RETURNING id, user_id, store_token, assigned_date""",
+                assignment_rows,
+                fetch=True,
+                page_size=1000,
+            )
+
+            # اختصاص‌هایی که از اجرای قبلی بازدید دارند دوباره بازدید نمی‌گیرند
+            cur.execute(
+                "SELECT DISTINCT assignment_id FROM store_visit_data WHERE assignment_id = ANY(%s)",
+                ([row[0] for row in assignments],),
+            )
+            already_visited = {row[0] for row in cur.fetchall()}
+            visited = [row for row in assignments if rng.random() < args.visit_ratio and row[0] not in already_visited]
+            print(f"Seeding {len(visited)} visits...")
+            execute_values(
+                cur,
+                """INSERT INTO store_visit_data
+                   (assignment_id, store_token, user_id, visit_date, visit_time, image_urls, additional_info, latitude, longitude)
+                   VALUES %s""",
+                [
+                    (row[0], row[2], row[1], row[3], "10:30:00", [],
+                     json.dumps({"source": "loadtest", "shelfCount": rng.randint(1, 20)}),
+                     None, None)
+                    for row in visited
+                ],
+                page_size=1000,
+            )
+            cur.execute(
+                "UPDATE assigned_stores SET status = 'completed', visit_date = assigned_date WHERE id = ANY(%s)",
+                ([row[0] for row in visited],),
+            )
+        conn.commit()
+
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE city_categories")
+            cur.execute("ANALYZE assigned_stores")
+            cur.execute("ANALYZE store_visit_data")
+        conn.commit()
+        print("Seed completed.")
+    finally:
+        conn.close()
+
+# ==================== Scenarios ====================
+
+class ScenarioContext:
+    """اطلاعات مشترک سناریوها (sessionهای کاربران و اختصاص‌های آن‌ها)"""
+
+    def __init__(self, base_url: str, users: int, rng_seed: int):
+        self.base_url = base_url.rstrip("/")
+        self.rng_seed = rng_seed
+        self.tokens = []
+        self.assignments = {}
+        self.discover_sessions(users)
+
+    def discover_sessions(self, users: int):
+        """بررسی sessionهای load test و دریافت اختصاص‌های هر کاربر"""
+        session = requests.Session()
+        for n in range(users):
+            token = session_token(n)
+            response = session.get(f"{self.base_url}/api/assigned-stores", headers={"Authorization": f"Bearer {token}"}, timeout=60)
+            if response.status_code != 200:
+                continue
+            self.tokens.append(token)
+            self.assignments[token] = [item["id"] for item in response.json().get("assignedStores", [])]
+        # کاربرانی که حداقل یک اختصاص دارند (سناریوی ثبت بازدید فقط از این‌ها استفاده می‌کند)
+        self.visit_tokens = [token for token in self.tokens if self.assignments[token]]
+        if not self.tokens:
+            print("Warning: no load-test sessions found; authenticated scenarios will fail (run seed first)")
+
+    def auth_headers(self, rng: random.Random) -> tuple:
+        token = rng.choice(self.tokens) if self.tokens else session_token(0)
+        return token, {"Authorization": f"Bearer {token}"}
+
+def scenario_nearby(ctx: ScenarioContext, session: requests.Session, rng: random.Random):
+    _, lat, lng = random_point(rng)
+    return session.get(f"{ctx.base_url}/api/nearby-stores", params={"lat": lat, "lng": lng, "maxDistance": rng.choice([200, 500, 1000])}, timeout=30)
+
+def scenario_neighborhood(ctx: ScenarioContext, session: requests.Session, rng: random.Random):
+    neighborhood, lat, lng = random_point(rng)
+    return session.get(
+        f"{ctx.base_url}/api/stores-by-neighborhood",
+        params={"neighborhood": neighborhood, "city": LOADTEST_CITY, "lat": lat, "lng": lng},
+        timeout=30,
+    )
+
+def scenario_assigned(ctx: ScenarioContext, session: requests.Session, rng: random.Random):
+    _, headers = ctx.auth_headers(rng)
+    return session.get(f"{ctx.base_url}/api/assigned-stores", headers=headers, timeout=30)
+
+def scenario_visit(ctx: ScenarioContext, session: requests.Session, rng: random.Random):
+    # فقط کاربرانی که اختصاص دارند؛ assignmentId نامعتبر فقط مسیر 404 را اندازه می‌گیرد
+    token = rng.choice(ctx.visit_tokens)
+    headers = {"Authorization": f"Bearer {token}"}
+    assignment_ids = ctx.assignments[token]
+    _, lat, lng = random_point(rng)
+    return session.post(
+        f"{ctx.base_url}/api/store-visit-data",
+        headers=headers,
+        json={
+            "assignmentId": rng.choice(assignment_ids),
+            "visitDate": date.today().isoformat(),
+            "visitTime": datetime.now().strftime("%H:%M:%S"),
+            "additionalInfo": {"source": "loadtest"},
+            "latitude": lat,
+            "longitude": lng,
+        },
+        timeout=30,
+    )
+
+SCENARIOS = {
+    "nearby": scenario_nearby,
+    "neighborhood": scenario_neighborhood,
+    "assigned": scenario_assigned,
+    "visit": scenario_visit,
+}
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run_scenario(ctx: ScenarioContext, name: str, duration: float, concurrency: int) -> dict:
+    """اجرای یک سناریو با concurrency ثابت به مدت duration ثانیه"""
+    func = SCENARIOS[name]
+    latencies = []
+    statuses = {}
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker(worker_id: int):
+        rng = random.Random(ctx.rng_seed * 1000 + worker_id)
+        session = requests.Session()
+        local_latencies = []
+        local_statuses = {}
+        local_errors = {}
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                response = func(ctx, session, rng)
+                key = str(response.status_code)
+            except requests.exceptions.RequestException as e:
+                key = type(e).__name__
+                local_errors[key] = local_errors.get(key, 0) + 1
+            local_latencies.append((time.perf_counter() - started) * 1000)
+            local_statuses[key] = local_statuses.get(key, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for key, value in local_statuses.items():
+                statuses[key] = statuses.get(key, 0) + value
+            for key, value in local_errors.items():
+                errors[key] = errors.get(key, 0) + value
+
+    started = time.time()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.isdigit() and int(status) < 400)
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "ok": ok,
+        "statuses": statuses,
+        "errors": errors,
+        "throughputRps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50Ms": round(percentile(latencies, 50), 2),
+        "p95Ms": round(percentile(latencies, 95), 2),
+        "p99Ms": round(percentile(latencies, 99), 2),
+        "maxMs": round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+def run(args):
+    """اجرای سناریوها و چاپ گزارش"""
+    names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    ctx = ScenarioContext(args.base_url, args.users, args.seed)
+    results = []
+    for name in names:
+        if name == "visit" and not ctx.visit_tokens:
+            print("Skipping visit: no load-test user has assignments (run seed with --assignments-per-user > 0)")
+            continue
+        print(f"Running {name} for {args.duration}s with concurrency {args.concurrency}...")
+        result = run_scenario(ctx, name, args.duration, args.concurrency)
+        results.append(result)
+
+    print()
+    print(f"{'scenario':<14}{'requests':>10}{'ok':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for r in results:
+        print(f"{r['scenario']:<14}{r['requests']:>10}{r['ok']:>8}{r['throughputRps']:>10}{r['p50Ms']:>10}{r['p95Ms']:>10}{r['p99Ms']:>10}{r['maxMs']:>10}")
+        if r["errors"] or len(r["statuses"]) > 1:
+            print(f"{'':<14}statuses={r['statuses']} errors={r['errors']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "runAt": datetime.now().isoformat(),
+                "baseUrl": args.base_url,
+                "duration": args.duration,
+                "concurrency": args.concurrency,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load-test harness for the store API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="seed a local database with synthetic data")
+    seed_parser.add_argument("--stores", type=int, default=100_000)
+    seed_parser.add_argument("--users", type=int, default=50)
+    seed_parser.add_argument("--assignments-per-user", type=int, default=40)
+    seed_parser.add_argument("--visit-ratio", type=float, default=0.5)
+    seed_parser.add_argument("--batch-size", type=int, default=20_000)
+    seed_parser.add_argument("--seed", type=int, default=42)
+    seed_parser.add_argument("--reset", action="store_true", help="delete previous load-test rows first")
+
+    run_parser = subparsers.add_parser("run", help="run load scenarios against a running API")
+    run_parser.add_argument("--base-url", default="http://localhost:8000")
+    run_parser.add_argument("--scenario", default="all", help="all or comma-separated: " + ",".join(SCENARIOS))
+    run_parser.add_argument("--duration", type=float, default=30)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--users", type=int, default=50)
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--output", help="write JSON results to this file")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(args)
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main_cli()
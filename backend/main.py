@@ -1,23 +1,43 @@
-from fastapi import FastAPI, HTTPException, Depends, Cookie, Header, UploadFile, File, Request
+from fastapi import FastAPI, HTTPException, Depends, Cookie, Header, UploadFile, File, Form, Request
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List, Union
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import hashlib
+import hmac
 import secrets
 import os
+import sys
 from datetime import datetime, timedelta, date
 import json
 import math
 import time
+import random
+import string
+import base64
+import asyncio
+import threading
+import contextvars
+import tempfile
+import marshal
+import pstats
+import cProfile
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait as wait_futures
+from pathlib import Path
+from urllib.parse import quote
 from dotenv import load_dotenv
 import jdatetime
 import requests
 import traceback
+import uuid
+from contextlib import contextmanager
 
 # بارگذاری متغیرهای محیطی از فایل .env
 load_dotenv()
@@ -55,83 +75,259 @@ def to_jalali_datetime(datetime_obj):
 
 app = FastAPI(title="Store Management API", version="1.0.0")
 
-# Middleware برای لاگ کردن تمام درخواست‌ها
-@app.middleware("http")
-async def log_requests_middleware(request: Request, call_next):
-    """Middleware برای لاگ کردن تمام درخواست‌های API"""
-    start_time = time.time()
+# ==================== Metrics ====================
+
+# ثبت متریک‌ها در حافظه process و خروجی با فرمت متنی Prometheus در /metrics
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricCounter:
+    """شمارنده با برچسب"""
     
-    # دریافت اطلاعات درخواست
-    method = request.method
-    path = request.url.path
-    ip_address = request.client.host if request.client else None
-    user_agent = request.headers.get("user-agent")
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
     
-    # خواندن body درخواست (اگر وجود داشته باشد) - فقط برای logging
-    # توجه: نمی‌توانیم body را بخوانیم چون بعد FastAPI نمی‌تواند آن را بخواند
-    # پس فقط path و method را log می‌کنیم
-    request_body = None
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
     
-    # اجرای درخواست
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        
-        # خواندن body پاسخ (اگر امکان‌پذیر باشد)
-        response_body = None
-        try:
-            if hasattr(response, 'body'):
-                response_body = response.body.decode()[:1000]  # محدود کردن به 1000 کاراکتر
-        except:
-            pass
-        
-        # محاسبه مدت زمان اجرا
-        duration_ms = (time.time() - start_time) * 1000
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_metric_labels(self.label_names, labels)} {value}")
+        return lines
+
+class MetricHistogram:
+    """هیستوگرام با bucketهای ثابت و برچسب"""
+    
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple = METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, seconds: float, *labels):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += seconds
+            entry[2] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = format_metric_labels(self.label_names + ("le",), labels + (repr(bound),))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                inf_labels = format_metric_labels(self.label_names + ("le",), labels + ("+Inf",))
+                lines.append(f"{self.name}_bucket{inf_labels} {count}")
+                lines.append(f"{self.name}_sum{format_metric_labels(self.label_names, labels)} {round(total, 6)}")
+                lines.append(f"{self.name}_count{format_metric_labels(self.label_names, labels)} {count}")
+        return lines
+
+def format_metric_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+HTTP_REQUESTS_TOTAL = MetricCounter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = MetricHistogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+DB_QUERY_SECONDS = MetricHistogram("db_query_duration_seconds", "Database query latency by query name", ("query",))
+DB_QUERY_ERRORS = MetricCounter("db_query_errors_total", "Database query errors by query name", ("query",))
+DB_CONNECT_SECONDS = MetricHistogram("db_connection_acquire_seconds", "Time to acquire a database connection", ())
+RAAH_REQUEST_SECONDS = MetricHistogram("raah_request_duration_seconds", "Outbound raah.ir request latency", ("service",))
+RAAH_REQUEST_ERRORS = MetricCounter("raah_request_errors_total", "Outbound raah.ir request errors", ("service", "kind"))
+
+# مسیر درخواست جاری (برای نام‌گذاری پیش‌فرض کوئری‌ها)
+CURRENT_ROUTE = contextvars.ContextVar("current_route", default="background")
+
+def metrics_route_label(path: str) -> str:
+    """برچسب مسیر با cardinality محدود: الگوی route (مثلاً /api/profiles/{profile_id})؛ مسیرهای ناشناخته یک برچسب مشترک دارند"""
+    if path.startswith("/uploads/"):
+        return "/uploads"
+    routes = getattr(app.state, "metric_routes", None)
+    if routes is None:
+        # مسیرهای ثابت با یک lookup و مسیرهای پارامتردار با path_regex تطبیق داده می‌شوند
+        static, templated = set(), []
+        for route in app.routes:
+            route_path = getattr(route, "path", None)
+            if route_path is None:
+                continue
+            if "{" in route_path:
+                templated.append((route.path_regex, route_path))
+            else:
+                static.add(route_path)
+        routes = app.state.metric_routes = (static, templated)
+    static, templated = routes
+    if path in static:
+        return path
+    for regex, route_path in templated:
+        if regex.match(path):
+            return route_path
+    return "unmatched"
+
+# ==================== Request Profiling ====================
+
+# پروفایل یک درخواست مشخص با هدر X-Profile: 1 به همراه X-Admin-Token معتبر (همان دسترسی require_admin)
+# درخواست‌های بدون هدر فقط یک بررسی هدر هزینه دارند؛ cursor و raah_get زمان‌ها را فقط وقتی ثبت می‌کنند
+# که REQUEST_PROFILE مقدار داشته باشد.
+# cProfile کل thread حلقه رویداد را پروفایل می‌کند: coroutineهای درخواست‌های همزمان دیگر هم در گزارش
+# می‌آیند (تعداد آن‌ها در concurrentRequests گزارش می‌شود) و در مدت پروفایل با سربار cProfile کندتر اجرا می‌شوند.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+PROFILE_TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP_FUNCTIONS", "40"))
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "20"))
+REQUEST_PROFILE = contextvars.ContextVar("request_profile", default=None)
+
+class RequestProfile:
+    """زمان SQL و HTTP خارجی یک درخواست پروفایل‌شده (از threadpool هم به‌روزرسانی می‌شود)"""
+    
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now()
+        self.lock = threading.Lock()
+        self.sql = {}
+        self.http = {}
+        self.report = None
+        self.pstats = None
+    
+    def add(self, kind: str, name: str, seconds: float):
+        bucket = self.sql if kind == "sql" else self.http
+        with self.lock:
+            count, total = bucket.get(name, (0, 0.0))
+            bucket[name] = (count + 1, total + seconds)
+    
+    def finish(self, profiler, status_code: int, total_seconds: float, concurrent_requests: int):
+        """ساخت گزارش نهایی از cProfile و زمان‌های ثبت‌شده"""
+        stats = pstats.Stats(profiler)
+        functions = []
+        for (filename, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+            functions.append({
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "calls": ncalls,
+                "ownMs": round(tottime * 1000, 3),
+                "cumulativeMs": round(cumtime * 1000, 3),
+            })
+        functions.sort(key=lambda item: item["cumulativeMs"], reverse=True)
         
-        # دریافت اطلاعات کاربر (اگر authenticated باشد)
-        user_id = None
-        username = None
-        try:
-            # تلاش برای دریافت session token
-            session_token = request.cookies.get("session_token") or request.headers.get("authorization", "").replace("Bearer ", "")
-            if session_token:
-                # بررسی session در دیتابیس
-                conn = get_db_connection()
-                try:
-                    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                        cur.execute("""
-                            SELECT u.id, u.username 
-                            FROM user_sessions s
-                            JOIN users u ON s.user_id = u.id
-                            WHERE s.session_token = %s AND s.expires_at > CURRENT_TIMESTAMP
-                        """, (session_token,))
-                        user = cur.fetchone()
-                        if user:
-                            user_id = user["id"]
-                            username = user["username"]
-                except:
-                    pass
-                finally:
-                    conn.close()
-        except:
-            pass
+        def summarize(bucket: dict, key: str) -> dict:
+            items = sorted(bucket.items(), key=lambda item: item[1][1], reverse=True)
+            return {
+                "count": sum(count for count, _ in bucket.values()),
+                "totalMs": round(sum(total for _, total in bucket.values()) * 1000, 3),
+                "items": [{key: name, "count": count, "totalMs": round(total * 1000, 3)} for name, (count, total) in items],
+            }
         
+        sql = summarize(self.sql, "name")
+        http = summarize(self.http, "service")
+        total_ms = round(total_seconds * 1000, 3)
+        self.pstats = marshal.dumps(stats.stats)
+        self.report = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "startedAt": self.started_at.isoformat(),
+            "totalMs": total_ms,
+            "sql": sql,
+            "http": http,
+            # زمان باقی‌مانده (پردازش پایتون و انتظار) پس از کسر SQL و HTTP خارجی
+            "otherMs": round(max(0.0, total_ms - sql["totalMs"] - http["totalMs"]), 3),
+            # functions شامل همه کارهای حلقه رویداد در این مدت است، نه فقط همین درخواست
+            "scope": "event-loop",
+            "concurrentRequests": concurrent_requests,
+            "contaminated": concurrent_requests > 0,
+            "functions": functions[:PROFILE_TOP_FUNCTIONS],
+        }
+        return self.report
+    
+    def server_timing(self) -> str:
+        report = self.report
+        return (
+            f'sql;desc="{report["sql"]["count"]} queries";dur={report["sql"]["totalMs"]}, '
+            f'http;desc="{report["http"]["count"]} calls";dur={report["http"]["totalMs"]}, '
+            f'total;dur={report["totalMs"]}'
+        )
+
+PROFILE_STORE = {}
+# cProfile در هر thread فقط یک پروفایلر فعال دارد؛ درخواست‌های همزمان پروفایل نمی‌شوند
+# inFlight: درخواست‌های در حال اجرای process؛ overlapping: درخواست‌های دیگری که در مدت پروفایل فعال بوده‌اند
+PROFILE_STATE = {"active": False, "inFlight": 0, "overlapping": 0}
+
+def profile_record(kind: str, name: str, seconds: float):
+    """ثبت زمان SQL یا HTTP در پروفایل درخواست جاری (در صورت وجود)"""
+    profile = REQUEST_PROFILE.get()
+    if profile is not None:
+        profile.add(kind, name, seconds)
+
+def profiling_requested(request: Request) -> bool:
+    """درخواست پروفایل فقط با هدر X-Profile و توکن ادمین معتبر پذیرفته می‌شود"""
+    return PROFILING_ENABLED and "x-profile" in request.headers and is_admin_token(request.headers.get("x-admin-token"))
+
+async def profile_request(request: Request, call_next):
+    """اجرای درخواست زیر cProfile و ذخیره گزارش؛ شناسه گزارش در هدر X-Profile-Id برمی‌گردد"""
+    # مشاهده گزارش‌ها (با همان هدر) خودش پروفایل نمی‌شود تا گزارش‌های واقعی از حافظه خارج نشوند
+    if request.url.path.startswith("/api/profiles"):
+        return await call_next(request)
+    if PROFILE_STATE["active"]:
+        response = await call_next(request)
+        response.headers["X-Profile-Status"] = "busy"
         return response
-        
-    except Exception as e:
-        # لاگ کردن خطا در کنسول
-        error_traceback = traceback.format_exc()
-        print(f"[ERROR] {type(e).__name__}: {str(e)} - Endpoint: {path}")
-        if error_traceback:
-            print(error_traceback)
-        raise
+    
+    profile = RequestProfile(request.method, request.url.path)
+    token = REQUEST_PROFILE.set(profile)
+    profiler = cProfile.Profile()
+    PROFILE_STATE["active"] = True
+    # درخواست‌های دیگری که همین حالا در حال اجرا هستند (خود این درخواست کسر می‌شود)
+    PROFILE_STATE["overlapping"] = PROFILE_STATE["inFlight"] - 1
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        # فقط thread حلقه رویداد پروفایل می‌شود (endpointهای async)؛ SQL و HTTP در threadpool هم ثبت می‌شوند
+        profiler.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.disable()
+        status_code = response.status_code
+    finally:
+        PROFILE_STATE["active"] = False
+        REQUEST_PROFILE.reset(token)
+        profile.finish(profiler, status_code, time.perf_counter() - started, max(0, PROFILE_STATE["overlapping"]))
+        PROFILE_STORE[profile.id] = profile
+        while len(PROFILE_STORE) > PROFILE_STORE_SIZE:
+            PROFILE_STORE.pop(next(iter(PROFILE_STORE)))
+        print(f"[PROFILE] {profile.id} {profile.method} {profile.path} total={profile.report['totalMs']}ms "
+              f"sql={profile.report['sql']['totalMs']}ms http={profile.report['http']['totalMs']}ms")
+    
+    response.headers["X-Profile-Id"] = profile.id
+    response.headers["X-Profile-Scope"] = "event-loop"
+    response.headers["X-Profile-Concurrent-Requests"] = str(profile.report["concurrentRequests"])
+    response.headers["Server-Timing"] = profile.server_timing()
+    return response
 
 # Mount static files for uploaded images
-import os
-from pathlib import Path
 uploads_dir = Path("uploads")
 uploads_dir.mkdir(exist_ok=True)
 uploads_dir.joinpath("comments").mkdir(exist_ok=True)
+# پوشه فایل‌های موقت آپلود (روی همان دیسک برای rename اتمیک)
+UPLOAD_TMP_DIR = uploads_dir / ".tmp"
+UPLOAD_TMP_DIR.mkdir(exist_ok=True)
 try:
     app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
     print("✅ Static files mounted successfully")
@@ -139,6 +335,131 @@ except Exception as e:
     error_msg = f"Warning: Could not mount static files: {e}"
     print(error_msg)
 
+# تنظیمات آپلود عکس
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "15")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_KB", "256")) * 1024
+# حاشیه برای هدرهای multipart در بررسی Content-Length
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
+# آپلود چندتایی عکس در یک درخواست
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "12"))
+UPLOAD_BATCH_CONCURRENCY = int(os.getenv("UPLOAD_BATCH_CONCURRENCY", "4"))
+# حداکثر Content-Length مجاز برای هر مسیر آپلود
+UPLOAD_PATH_LIMITS = {
+    "/api/upload-comment-image": UPLOAD_MAX_BYTES + UPLOAD_MULTIPART_OVERHEAD,
+    "/api/storage/local-upload": UPLOAD_MAX_BYTES + UPLOAD_MULTIPART_OVERHEAD,
+    "/api/upload-images": (UPLOAD_MAX_BYTES + UPLOAD_MULTIPART_OVERHEAD) * UPLOAD_BATCH_MAX_FILES,
+}
+
+# Middleware برای رد سریع آپلودهای بزرگ قبل از خواندن body
+@app.middleware("http")
+async def limit_upload_size_middleware(request: Request, call_next):
+    """رد کردن آپلودهایی که Content-Length آن‌ها از حد مجاز بیشتر است"""
+    if request.method == "POST" and request.url.path in UPLOAD_PATH_LIMITS:
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit():
+            if int(content_length) > UPLOAD_PATH_LIMITS[request.url.path]:
+                return JSONResponse(
+                    status_code=413,
+                    content={"detail": f"حجم فایل بیش از حد مجاز است ({UPLOAD_MAX_BYTES // (1024 * 1024)}MB)"},
+                )
+    return await call_next(request)
+
+# ==================== Concurrency Limits ====================
+
+# محدودیت همزمانی هر مسیر: "مسیر=حداکثر_همزمان:حداکثر_صف" جدا شده با کاما
+# مسیرهای وابسته به raah.ir محدود می‌شوند تا endpointهای سبک (مثل /api/auth/me) گرسنه نمانند
+ROUTE_CONCURRENCY_LIMITS = os.getenv(
+    "ROUTE_CONCURRENCY_LIMITS",
+    "/api/get-address=8:16,/api/get-neighborhood=8:16,/api/register-store=6:12,/api/upload-images=4:8,"
+    "/api/geo/lookup-batch=2:4"
+)
+ROUTE_QUEUE_TIMEOUT = float(os.getenv("ROUTE_QUEUE_TIMEOUT_SECONDS", "3"))
+ROUTE_RETRY_AFTER_SECONDS = int(os.getenv("ROUTE_RETRY_AFTER_SECONDS", "2"))
+
+class RouteLimiter:
+    """Semaphore با صف محدود برای یک مسیر به همراه شمارنده‌ها"""
+    
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.queued = 0
+        self.peak_in_flight = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+    
+    def stats(self) -> dict:
+        return {
+            "maxConcurrent": self.max_concurrent,
+            "maxQueue": self.max_queue,
+            "inFlight": self.in_flight,
+            "queued": self.queued,
+            "peakInFlight": self.peak_in_flight,
+            "peakQueued": self.peak_queued,
+            "completed": self.completed,
+            "rejectedQueueFull": self.rejected_queue_full,
+            "rejectedTimeout": self.rejected_timeout,
+        }
+
+def parse_route_limits(spec: str) -> dict:
+    """خواندن تنظیمات محدودیت مسیرها از رشته env"""
+    limiters = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            path, limits = entry.rsplit("=", 1)
+            max_concurrent, max_queue = (int(x) for x in limits.split(":", 1))
+            limiters[path.strip()] = RouteLimiter(max(1, max_concurrent), max(0, max_queue))
+        except ValueError:
+            print(f"Warning: Invalid ROUTE_CONCURRENCY_LIMITS entry: {entry}")
+    return limiters
+
+ROUTE_LIMITERS = parse_route_limits(ROUTE_CONCURRENCY_LIMITS)
+
+def overload_response(path: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "سرور در حال حاضر مشغول است. لطفاً چند لحظه دیگر تلاش کنید.", "path": path},
+        headers={"Retry-After": str(ROUTE_RETRY_AFTER_SECONDS)},
+    )
+
+# Middleware برای محدود کردن درخواست‌های همزمان هر مسیر و رد سریع در صورت پر بودن صف
+@app.middleware("http")
+async def route_concurrency_middleware(request: Request, call_next):
+    """اعمال محدودیت همزمانی؛ در صورت پر بودن صف یا طولانی شدن انتظار پاسخ 503 با Retry-After"""
+    path = request.url.path
+    limiter = ROUTE_LIMITERS.get(path)
+    if limiter is None or request.method == "OPTIONS":
+        return await call_next(request)
+    
+    if limiter.in_flight + limiter.queued >= limiter.max_concurrent + limiter.max_queue:
+        limiter.rejected_queue_full += 1
+        return overload_response(path)
+    
+    limiter.queued += 1
+    limiter.peak_queued = max(limiter.peak_queued, limiter.queued)
+    try:
+        await asyncio.wait_for(limiter.semaphore.acquire(), timeout=ROUTE_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        limiter.rejected_timeout += 1
+        return overload_response(path)
+    finally:
+        limiter.queued -= 1
+    
+    limiter.in_flight += 1
+    limiter.peak_in_flight = max(limiter.peak_in_flight, limiter.in_flight)
+    try:
+        return await call_next(request)
+    finally:
+        limiter.in_flight -= 1
+        limiter.completed += 1
+        limiter.semaphore.release()
+
 # تنظیمات CORS
 app.add_middleware(
     CORSMiddleware,
@@ -157,6 +478,50 @@ app.add_middleware(
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
+# Middleware برای لاگ کردن تمام درخواست‌ها
+# آخرین middleware تعریف‌شده بیرونی‌ترین لایه است؛ این middleware بعد از CORS و محدودیت‌ها تعریف می‌شود
+# تا پاسخ‌های 413 (حجم آپلود) و 503 (محدودیت همزمانی) هم در متریک‌ها شمرده شوند.
+@app.middleware("http")
+async def log_requests_middleware(request: Request, call_next):
+    """Middleware برای لاگ کردن تمام درخواست‌های API"""
+    start_time = time.time()
+    
+    # دریافت اطلاعات درخواست
+    method = request.method
+    path = request.url.path
+    ip_address = request.client.host if request.client else None
+    user_agent = request.headers.get("user-agent")
+    
+    route = metrics_route_label(path)
+    CURRENT_ROUTE.set(route)
+    
+    # اجرای درخواست (با پروفایل در صورت درخواست ادمین)
+    status_code = 500
+    PROFILE_STATE["inFlight"] += 1
+    if PROFILE_STATE["active"]:
+        PROFILE_STATE["overlapping"] += 1
+    try:
+        if profiling_requested(request):
+            response = await profile_request(request, call_next)
+        else:
+            response = await call_next(request)
+        status_code = response.status_code
+        return response
+        
+    except Exception as e:
+        # لاگ کردن خطا در کنسول
+        error_traceback = traceback.format_exc()
+        print(f"[ERROR] {type(e).__name__}: {str(e)} - Endpoint: {path}")
+        if error_traceback:
+            print(error_traceback)
+        raise
+    finally:
+        # ثبت مدت زمان اجرا و کد وضعیت
+        PROFILE_STATE["inFlight"] -= 1
+        duration = time.time() - start_time
+        HTTP_REQUEST_SECONDS.observe(duration, method, route)
+        HTTP_REQUESTS_TOTAL.inc(method, route, str(status_code))
+
 # تنظیمات دیتابیس
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
@@ -166,9 +531,169 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD", "Saman0866"),
 }
 
+# لاگ کوئری‌های کند و نمونه‌برداری از plan اجرای کوئری‌های SELECT
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+EXPLAIN_SAMPLE_RATE = float(os.getenv("EXPLAIN_SAMPLE_RATE", "0"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+# پارامترهای کوئری کند فقط برای این نام‌ها لاگ می‌شوند (بقیه <redacted>)
+SLOW_QUERY_PARAM_NAMES = {
+    name.strip() for name in os.getenv(
+        "SLOW_QUERY_PARAM_NAMES",
+        "nearby_stores.search,stores_by_neighborhood.count,stores_by_neighborhood.list,comments.page",
+    ).split(",") if name.strip()
+}
+# EXPLAIN ANALYZE کوئری را دوباره اجرا می‌کند؛ فقط کوئری‌های فقط‌خواندنی نام‌دار این فهرست نمونه‌برداری می‌شوند
+EXPLAIN_QUERY_NAMES = {
+    name.strip() for name in os.getenv(
+        "EXPLAIN_QUERY_NAMES",
+        "nearby_stores.search,stores_by_neighborhood.count,stores_by_neighborhood.list,comments.page,"
+        "assigned_stores.list,visit_data.list,image_blobs.variants",
+    ).split(",") if name.strip()
+}
+
+SLOW_QUERY_LOG = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+QUERY_PLAN_SAMPLES = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+def query_text(cur, query) -> str:
+    """متن کوئری برای لاگ (bytes از execute_values به str تبدیل می‌شود)"""
+    if isinstance(query, bytes):
+        return query.decode(errors="replace")
+    return query if isinstance(query, str) else str(query)
+
+def strip_query_values(text: str) -> str:
+    """حذف مقادیر literal فهرست VALUES (مثلاً خروجی execute_values) از متن کوئری برای لاگ"""
+    upper = text.upper()
+    parts = []
+    position = 0
+    while True:
+        start = upper.find("VALUES", position)
+        if start < 0:
+            break
+        index = start + len("VALUES")
+        rows = 0
+        while True:
+            while index < len(text) and text[index].isspace():
+                index += 1
+            if index >= len(text) or text[index] != "(":
+                break
+            # پیمایش پرانتزهای متوازن با در نظر گرفتن رشته‌های '...'
+            depth = 0
+            in_string = False
+            while index < len(text):
+                char = text[index]
+                if in_string:
+                    if char == "'":
+                        in_string = False
+                elif char == "'":
+                    in_string = True
+                elif char == "(":
+                    depth += 1
+                elif char == ")":
+                    depth -= 1
+                    if depth == 0:
+                        index += 1
+                        break
+                index += 1
+            rows += 1
+            lookahead = index
+            while lookahead < len(text) and text[lookahead].isspace():
+                lookahead += 1
+            if lookahead < len(text) and text[lookahead] == ",":
+                index = lookahead + 1
+            else:
+                break
+        if rows:
+            parts.append(text[position:start] + f"VALUES (...) /* {rows} rows */")
+            position = index
+        else:
+            parts.append(text[position:start + len("VALUES")])
+            position = start + len("VALUES")
+    parts.append(text[position:])
+    return "".join(parts)
+
+def capture_query_plan(cur, query, vars, name: str):
+    """اجرای EXPLAIN (ANALYZE, BUFFERS) با یک cursor جداگانه داخل savepoint"""
+    plan_cursor = psycopg2.extensions.cursor(cur.connection)
+    try:
+        plan_cursor.execute("SAVEPOINT query_plan_sample")
+        try:
+            plan_cursor.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + plan_cursor.mogrify(query, vars))
+            plan = "\n".join(row[0] for row in plan_cursor.fetchall())
+            plan_cursor.execute("RELEASE SAVEPOINT query_plan_sample")
+        except Exception:
+            plan_cursor.execute("ROLLBACK TO SAVEPOINT query_plan_sample")
+            raise
+        QUERY_PLAN_SAMPLES.append({"name": name, "capturedAt": datetime.now().isoformat(), "plan": plan})
+        print(f"[QUERY PLAN] {name}\n{plan}")
+    except Exception as e:
+        print(f"[ERROR] Could not capture query plan for {name}: {e}")
+    finally:
+        plan_cursor.close()
+
+_timed_cursor_classes = {}
+
+def timed_cursor_class(base):
+    """زیرکلاس cursor که هر کوئری را با نام ثبت می‌کند (مدت، تعداد ردیف، لاگ کوئری کند، نمونه plan)
+
+    cur.execute(sql, params, name="nearby_stores.search") - بدون name، مسیر درخواست جاری به عنوان نام استفاده می‌شود.
+    """
+    cls = _timed_cursor_classes.get(base)
+    if cls is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None, name: Optional[str] = None):
+                named = name is not None
+                name = name or CURRENT_ROUTE.get()
+                started = time.perf_counter()
+                try:
+                    result = super().execute(query, vars)
+                except Exception:
+                    DB_QUERY_ERRORS.inc(name)
+                    DB_QUERY_SECONDS.observe(time.perf_counter() - started, name)
+                    profile_record("sql", name, time.perf_counter() - started)
+                    raise
+                duration = time.perf_counter() - started
+                DB_QUERY_SECONDS.observe(duration, name)
+                profile_record("sql", name, duration)
+                
+                if duration * 1000 >= SLOW_QUERY_MS:
+                    text = strip_query_values(" ".join(query_text(self, query).split()))
+                    entry = {
+                        "name": name,
+                        "durationMs": round(duration * 1000, 2),
+                        "rows": self.rowcount,
+                        "query": text[:2000],
+                        # پارامترها (token، شماره تلفن، ...) فقط برای نام‌های SLOW_QUERY_PARAM_NAMES لاگ می‌شوند
+                        "params": None if vars is None else repr(vars)[:1000] if named and name in SLOW_QUERY_PARAM_NAMES else "<redacted>",
+                        "at": datetime.now().isoformat(),
+                    }
+                    SLOW_QUERY_LOG.append(entry)
+                    print(f"[SLOW QUERY] {name} {entry['durationMs']}ms rows={entry['rows']} params={entry['params']} - {text[:300]}")
+                
+                if EXPLAIN_SAMPLE_RATE > 0 and named and name in EXPLAIN_QUERY_NAMES and random.random() < EXPLAIN_SAMPLE_RATE:
+                    # ANALYZE کوئری را دوباره اجرا می‌کند؛ بررسی SELECT فقط محافظ دوم در کنار allowlist است
+                    if query_text(self, query).lstrip().upper().startswith(("SELECT", "WITH")) and "FOR UPDATE" not in query_text(self, query).upper():
+                        capture_query_plan(self, query, vars, name)
+                return result
+        
+        cls = _timed_cursor_classes[base] = TimedCursor
+    return cls
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """اتصالی که همه cursorهای آن (از جمله RealDictCursor) زمان‌سنجی می‌شوند"""
+    
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
 def get_db_connection():
     """ایجاد اتصال به دیتابیس"""
-    return psycopg2.connect(**DB_CONFIG)
+    started = time.perf_counter()
+    try:
+        return psycopg2.connect(connection_factory=InstrumentedConnection, **DB_CONFIG)
+    finally:
+        DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
+        profile_record("sql", "db.connect", time.perf_counter() - started)
 
 # ==================== Models ====================
 
@@ -210,6 +735,12 @@ class VisitDataRequest(BaseModel):
     latitude: Optional[float] = None
     longitude: Optional[float] = None
 
+class VisitSyncItem(VisitDataRequest):
+    clientKey: str  # کلید یکتای تولید شده در کلاینت برای جلوگیری از ثبت تکراری
+
+class BatchVisitSyncRequest(BaseModel):
+    visits: List[VisitSyncItem]
+
 class RegisterStoreRequest(BaseModel):
     name: str
     address: str
@@ -238,7 +769,6 @@ def generate_session_token() -> str:
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """محاسبه فاصله بین دو نقطه جغرافیایی (Haversine formula)"""
-    import math
     R = 6371000  # شعاع زمین به متر
     d_lat = math.radians(lat2 - lat1)
     d_lon = math.radians(lon2 - lon1)
@@ -300,7 +830,8 @@ async def authenticate_user(session_token: Optional[str] = Cookie(None), authori
                    FROM user_sessions s
                    JOIN users u ON s.user_id = u.id
                    WHERE s.session_token = %s AND s.expires_at > CURRENT_TIMESTAMP""",
-                (token,)
+                (token,),
+                name="auth.session_lookup"
             )
             result = cur.fetchone()
             if result:
@@ -322,326 +853,699 @@ def require_auth(user: Optional[dict] = Depends(authenticate_user)):
         raise HTTPException(status_code=401, detail="Authentication required")
     return user
 
+# جدول users نقش کاربری ندارد؛ عملیات مدیریتی با توکن مشترک ADMIN_TOKEN در هدر X-Admin-Token محافظت می‌شوند
+# (بدون تنظیم ADMIN_TOKEN این عملیات فقط از طریق CLI در دسترس‌اند)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """مقایسه توکن با ADMIN_TOKEN در زمان ثابت"""
+    return bool(ADMIN_TOKEN) and bool(token) and secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency برای routes مدیریتی"""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+# ==================== Store Cache Invalidation ====================
+
+# تغییرات دسته‌ای مغازه‌ها یک رویداد invalidation منتشر می‌کنند: سایر workerها از طریق LISTEN روی
+# کانال Postgres (بعد از commit) مطلع می‌شوند و listenerهای داخل همین process را فراخواننده
+# بعد از conn.commit() با run_store_invalidation_listeners صدا می‌زند تا داده commit نشده دیده نشود.
+STORE_INVALIDATION_CHANNEL = "store_invalidation"
+STORE_INVALIDATION_LISTENERS = []
+
+def notify_store_invalidation(cur, store_ids: List[int], reason: str):
+    """انتشار یک رویداد invalidation برای مجموعه‌ای از مغازه‌ها (داخل همان تراکنش)"""
+    store_ids = sorted(set(store_ids))
+    if not store_ids:
+        return
+    payload = json.dumps({"reason": reason, "storeIds": store_ids})
+    if len(payload) > 7000:
+        # محدودیت اندازه payload در NOTIFY - در این حالت کل cache باید پاک شود
+        payload = json.dumps({"reason": reason, "storeIds": None, "count": len(store_ids)})
+    cur.execute("SELECT pg_notify(%s, %s)", (STORE_INVALIDATION_CHANNEL, payload))
+
+def run_store_invalidation_listeners(store_ids: List[int], reason: str):
+    """اجرای listenerهای داخل process؛ فقط بعد از commit تراکنشی که notify_store_invalidation را صدا زده"""
+    store_ids = sorted(set(store_ids))
+    if not store_ids:
+        return
+    for listener in STORE_INVALIDATION_LISTENERS:
+        try:
+            listener(store_ids, reason)
+        except Exception as e:
+            print(f"[ERROR] Store invalidation listener failed: {e}")
+
 # ==================== Database Initialization ====================
 
-def init_database():
-    """ایجاد جداول در دیتابیس"""
+# جدول نسخه‌های اعمال‌شده در schema_migrations ثبت می‌شود و هر migration فقط یک بار اجرا می‌شود.
+# advisory lock تضمین می‌کند که هنگام بالا آمدن همزمان چند worker فقط یکی migration را اجرا کند.
+SCHEMA_MIGRATIONS_LOCK_ID = 7320451
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+def migration_001_baseline(cur):
+    """ساختار اولیه جداول"""
+    # جدول کاربران
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(100) UNIQUE NOT NULL,
+            email VARCHAR(255) UNIQUE,
+            password_hash VARCHAR(255) NOT NULL,
+            full_name VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+    
+    # جدول sessions
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            session_token VARCHAR(255) UNIQUE NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions(session_token)")
+    
+    # جدول comments
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_user_comments (
+            id SERIAL PRIMARY KEY,
+            store_id INTEGER NOT NULL,
+            user_id INTEGER,
+            user_latitude FLOAT,
+            user_longitude FLOAT,
+            comment TEXT NOT NULL,
+            rating INTEGER CHECK (rating >= 1 AND rating <= 10),
+            image_urls TEXT[],
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+        )
+    """)
+    
+    # اضافه کردن فیلد image_urls اگر وجود نداشته باشد
+    cur.execute("""
+        DO $$ 
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'store_user_comments' AND column_name = 'image_urls'
+            ) THEN
+                ALTER TABLE store_user_comments ADD COLUMN image_urls TEXT[];
+            END IF;
+        END $$;
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_store_id ON store_user_comments(store_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_user_id ON store_user_comments(user_id)")
+    # جدول groups
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_groups (
+            id SERIAL PRIMARY KEY,
+            group_code VARCHAR(50) UNIQUE NOT NULL,
+            group_name VARCHAR(500),
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL
+        )
+    """)
+    
+    # جدول group members
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_group_members (
+            id SERIAL PRIMARY KEY,
+            group_code VARCHAR(50) NOT NULL,
+            store_id INTEGER NOT NULL,
+            is_primary BOOLEAN DEFAULT FALSE,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE,
+            FOREIGN KEY (group_code) REFERENCES store_groups(group_code) ON DELETE CASCADE,
+            FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
+            UNIQUE(group_code, store_id)
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_group_members_group_code ON store_group_members(group_code)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_group_members_store_id ON store_group_members(store_id)")
+    
+    # جدول اختصاص مغازه‌ها به کاربران (Market Visit) - استفاده از store_token
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS assigned_stores (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            store_token VARCHAR(255) NOT NULL,
+            assigned_date DATE NOT NULL,
+            visit_date DATE,
+            status VARCHAR(50) DEFAULT 'pending',
+            notes TEXT,
+            assigned_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (assigned_by) REFERENCES users(id) ON DELETE SET NULL,
+            UNIQUE(user_id, store_token, assigned_date)
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_user_id ON assigned_stores(user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_store_token ON assigned_stores(store_token)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_assigned_date ON assigned_stores(assigned_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_status ON assigned_stores(status)")
+    
+    # جدول اطلاعات و عکس‌های مارکت ویزیت - استفاده از store_token
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_visit_data (
+            id SERIAL PRIMARY KEY,
+            assignment_id INTEGER NOT NULL,
+            store_token VARCHAR(255) NOT NULL,
+            user_id INTEGER NOT NULL,
+            visit_date DATE NOT NULL,
+            visit_time TIME,
+            image_urls TEXT[],
+            additional_info JSONB,
+            latitude FLOAT,
+            longitude FLOAT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (assignment_id) REFERENCES assigned_stores(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_assignment_id ON store_visit_data(assignment_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_store_token ON store_visit_data(store_token)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_user_id ON store_visit_data(user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_visit_date ON store_visit_data(visit_date)")
+    
+    # اضافه کردن فیلدهای جدید به city_categories اگر وجود نداشته باشند
+    cur.execute("""
+        DO $$ 
+        BEGIN
+            -- اضافه کردن فیلد پلاک
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'city_categories' 
+                AND column_name = 'place_plate_number'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD COLUMN place_plate_number VARCHAR(50);
+            END IF;
+            
+            -- اضافه کردن فیلد کد پستی
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'city_categories' 
+                AND column_name = 'place_postal_code'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD COLUMN place_postal_code VARCHAR(20);
+            END IF;
+            
+            -- اضافه کردن فیلد وضعیت (فعال/غیرفعال)
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'city_categories' 
+                AND column_name = 'is_active'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD COLUMN is_active BOOLEAN DEFAULT TRUE;
+                UPDATE city_categories SET is_active = TRUE WHERE is_active IS NULL;
+                CREATE INDEX IF NOT EXISTS idx_city_categories_is_active ON city_categories(is_active);
+            END IF;
+            
+            -- اضافه کردن فیلد عکس‌ها
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'city_categories' 
+                AND column_name = 'place_images'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD COLUMN place_images TEXT[];
+            END IF;
+            
+            -- اضافه کردن فیلد کاربر ثبت‌کننده
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'city_categories' 
+                AND column_name = 'created_by_user_id'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD COLUMN created_by_user_id INTEGER;
+            END IF;
+            
+            -- اضافه کردن constraint برای created_by_user_id اگر وجود نداشته باشد
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.table_constraints 
+                WHERE table_name = 'city_categories' 
+                AND constraint_name = 'fk_city_categories_created_by'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD CONSTRAINT fk_city_categories_created_by 
+                    FOREIGN KEY (created_by_user_id) REFERENCES users(id) ON DELETE SET NULL;
+            END IF;
+            
+            -- اضافه کردن فیلد کارگاه دارد/ندارد
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'city_categories' 
+                AND column_name = 'has_workshop'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD COLUMN has_workshop BOOLEAN DEFAULT FALSE;
+                UPDATE city_categories SET has_workshop = FALSE WHERE has_workshop IS NULL;
+                CREATE INDEX IF NOT EXISTS idx_city_categories_has_workshop ON city_categories(has_workshop);
+            END IF;
+            
+            -- اضافه کردن فیلد place_full_data برای ذخیره داده‌های کامل از API
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name = 'city_categories' 
+                AND column_name = 'place_full_data'
+                AND table_schema = 'public'
+            ) THEN
+                ALTER TABLE city_categories ADD COLUMN place_full_data JSONB;
+            END IF;
+        END $$;
+    """)
+    
+    # جدول درخواست‌های غیرفعال کردن مغازه‌ها
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_deactivation_requests (
+            id SERIAL PRIMARY KEY,
+            store_id INTEGER NOT NULL,
+            store_token VARCHAR(255),
+            requested_by INTEGER NOT NULL,
+            reason TEXT,
+            status VARCHAR(50) DEFAULT 'pending',
+            reviewed_by INTEGER,
+            reviewed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE,
+            FOREIGN KEY (requested_by) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (reviewed_by) REFERENCES users(id) ON DELETE SET NULL
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_store_id ON store_deactivation_requests(store_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_store_token ON store_deactivation_requests(store_token)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_status ON store_deactivation_requests(status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_requested_by ON store_deactivation_requests(requested_by)")
+    
+    # جداول دسته‌بندی مشتریان
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_main_categories (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            slug VARCHAR(255) UNIQUE NOT NULL,
+            preview_count INTEGER DEFAULT 0,
+            display_order INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_main_categories_slug ON store_main_categories(slug)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_main_categories_display_order ON store_main_categories(display_order)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_main_categories_is_active ON store_main_categories(is_active)")
+    
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_sub_categories (
+            id SERIAL PRIMARY KEY,
+            main_category_id INTEGER NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            slug VARCHAR(255) NOT NULL,
+            icon VARCHAR(255),
+            display_order INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (main_category_id) REFERENCES store_main_categories(id) ON DELETE CASCADE,
+            UNIQUE(main_category_id, slug)
+        )
+    """)
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_main_category_id ON store_sub_categories(main_category_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_slug ON store_sub_categories(slug)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_display_order ON store_sub_categories(display_order)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_is_active ON store_sub_categories(is_active)")
+
+def migration_002_image_blobs(cur):
+    """blobهای عکس و ایندکس‌های GIN برای GC"""
+    # جدول blobهای عکس (ذخیره بر اساس hash محتوا)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS image_blobs (
+            sha256 CHAR(64) PRIMARY KEY,
+            url TEXT UNIQUE NOT NULL,
+            size_bytes BIGINT NOT NULL,
+            content_type VARCHAR(100),
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_referenced_at TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL
+        )
+    """)
+    
+    # کلید storage و وضعیت آپلود مستقیم (pending تا زمان تایید آپلود)
+    cur.execute("ALTER TABLE image_blobs ADD COLUMN IF NOT EXISTS storage_key TEXT")
+    cur.execute("ALTER TABLE image_blobs ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'stored'")
+    
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_image_blobs_ref_count ON image_blobs(ref_count) WHERE ref_count = 0")
+    # ایندکس‌های GIN برای پیدا کردن ارجاع‌ها به یک عکس در GC
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_image_urls ON store_user_comments USING GIN (image_urls)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_image_urls ON store_visit_data USING GIN (image_urls)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_city_categories_place_images ON city_categories USING GIN (place_images)")
+
+def migration_003_visit_client_key(cur):
+    """کلید idempotency همگام‌سازی آفلاین بازدیدها"""
+    # کلید idempotency کلاینت برای همگام‌سازی آفلاین (جلوگیری از ثبت تکراری)
+    cur.execute("ALTER TABLE store_visit_data ADD COLUMN IF NOT EXISTS client_key VARCHAR(100)")
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_visit_data_user_client_key
+        ON store_visit_data(user_id, client_key) WHERE client_key IS NOT NULL
+    """)
+
+def migration_004_comment_stats(cur):
+    """صفحه‌بندی keyset و آمار تجمیعی نظرات"""
+    # ایندکس برای صفحه‌بندی keyset نظرات هر مغازه
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_store_created ON store_user_comments(store_id, created_at DESC, id DESC)")
+    
+    # آمار تجمیعی نظرات هر مغازه (به‌روزرسانی تدریجی در ثبت نظر)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS store_comment_stats (
+            store_id INTEGER PRIMARY KEY,
+            comment_count INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum BIGINT NOT NULL DEFAULT 0,
+            last_comment_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE
+        )
+    """)
+    
+    # پر کردن اولیه آمار از نظرات موجود (فقط وقتی جدول خالی است)
+    cur.execute("""
+        INSERT INTO store_comment_stats (store_id, comment_count, rating_count, rating_sum, last_comment_at)
+        SELECT store_id, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0), MAX(created_at)
+        FROM store_user_comments
+        WHERE NOT EXISTS (SELECT 1 FROM store_comment_stats)
+        GROUP BY store_id
+    """)
+
+def migration_005_unique_place_token(cur):
+    """ایندکس یکتای place_token"""
+    # ایندکس یکتا روی place_token (برای join‌ها و تولید token بدون پیش‌بررسی)
+    # ردیف‌های تکراری قدیمی: کوچک‌ترین id همان token را نگه می‌دارد و بقیه token جدید می‌گیرند
+    cur.execute("""
+        DO $$
+        DECLARE
+            duplicate_rows INTEGER;
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_indexes
+                WHERE tablename = 'city_categories'
+                AND indexname = 'uq_city_categories_place_token'
+                AND schemaname = 'public'
+            ) THEN
+                UPDATE city_categories cc
+                SET place_token = cc.place_token || '~dup' || cc.id
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY place_token ORDER BY id) AS rn
+                    FROM city_categories
+                    WHERE place_token IS NOT NULL
+                ) d
+                WHERE cc.id = d.id AND d.rn > 1;
+                GET DIAGNOSTICS duplicate_rows = ROW_COUNT;
+                IF duplicate_rows > 0 THEN
+                    RAISE NOTICE 'place_token: % duplicate rows re-tokened', duplicate_rows;
+                END IF;
+                
+                CREATE UNIQUE INDEX uq_city_categories_place_token ON city_categories(place_token);
+                DROP INDEX IF EXISTS idx_city_categories_place_token;
+            END IF;
+        END $$;
+    """)
+
+def migration_006_deactivation_queue(cur):
+    """ایندکس‌های صف درخواست‌های غیرفعال‌سازی"""
+    # ایندکس partial برای صف درخواست‌های pending (صفحه‌بندی و شمارش بدون اسکن کل جدول)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_deactivation_requests_pending
+        ON store_deactivation_requests(created_at DESC, id DESC) WHERE status = 'pending'
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_created ON store_deactivation_requests(created_at DESC, id DESC)")
+
+def migration_007_session_expiry_index(cur):
+    """ایندکس expires_at برای پاک‌سازی sessionهای منقضی"""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON user_sessions(expires_at)")
+
+def migration_008_image_variant_status(cur):
+    """نسخه‌های ساخته‌شده هر عکس (فقط URL نسخه‌های موجود به کلاینت داده می‌شود)"""
+    cur.execute("ALTER TABLE image_blobs ADD COLUMN IF NOT EXISTS variants TEXT[] NOT NULL DEFAULT '{}'")
+    cur.execute("ALTER TABLE image_blobs ADD COLUMN IF NOT EXISTS variants_status VARCHAR(20)")
+
+def migration_009_deactivation_request_counts(cur):
+    """شمارنده درخواست‌های غیرفعال‌سازی به تفکیک وضعیت"""
+    # تعداد درخواست‌ها به تفکیک وضعیت (به‌روزرسانی در ثبت و بررسی درخواست، مانند store_comment_stats)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS deactivation_request_counts (
+            status VARCHAR(50) PRIMARY KEY,
+            request_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # پر کردن اولیه از درخواست‌های موجود (فقط وقتی جدول خالی است)
+    cur.execute("""
+        INSERT INTO deactivation_request_counts (status, request_count)
+        SELECT COALESCE(status, 'pending'), COUNT(*)
+        FROM store_deactivation_requests
+        WHERE NOT EXISTS (SELECT 1 FROM deactivation_request_counts)
+        GROUP BY COALESCE(status, 'pending')
+    """)
+
+SCHEMA_MIGRATIONS = [
+    (1, "baseline", migration_001_baseline),
+    (2, "image_blobs", migration_002_image_blobs),
+    (3, "visit_client_key", migration_003_visit_client_key),
+    (4, "comment_stats", migration_004_comment_stats),
+    (5, "unique_place_token", migration_005_unique_place_token),
+    (6, "deactivation_queue", migration_006_deactivation_queue),
+    (7, "session_expiry_index", migration_007_session_expiry_index),
+    (8, "image_variant_status", migration_008_image_variant_status),
+    (9, "deactivation_request_counts", migration_009_deactivation_request_counts),
+]
+
+def get_applied_migrations(cur) -> set:
+    """نسخه‌های اعمال‌شده (مجموعه خالی اگر جدول schema_migrations هنوز وجود ندارد)"""
+    cur.execute("SELECT to_regclass('public.schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return set()
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def run_migrations() -> list:
+    """اجرای migrationهای اعمال‌نشده؛ اگر schema به‌روز باشد فقط یک کوئری سبک اجرا می‌شود"""
     conn = get_db_connection()
+    applied_now = []
     try:
         with conn.cursor() as cur:
-            # جدول کاربران
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(100) UNIQUE NOT NULL,
-                    email VARCHAR(255) UNIQUE,
-                    password_hash VARCHAR(255) NOT NULL,
-                    full_name VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-            
-            # جدول sessions
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    session_token VARCHAR(255) UNIQUE NOT NULL,
-                    expires_at TIMESTAMP NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions(session_token)")
-            
-            # جدول comments
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS store_user_comments (
-                    id SERIAL PRIMARY KEY,
-                    store_id INTEGER NOT NULL,
-                    user_id INTEGER,
-                    user_latitude FLOAT,
-                    user_longitude FLOAT,
-                    comment TEXT NOT NULL,
-                    rating INTEGER CHECK (rating >= 1 AND rating <= 10),
-                    image_urls TEXT[],
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
-                )
-            """)
-            
-            # اضافه کردن فیلد image_urls اگر وجود نداشته باشد
-            cur.execute("""
-                DO $$ 
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'store_user_comments' AND column_name = 'image_urls'
-                    ) THEN
-                        ALTER TABLE store_user_comments ADD COLUMN image_urls TEXT[];
-                    END IF;
-                END $$;
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_store_id ON store_user_comments(store_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_user_id ON store_user_comments(user_id)")
-            
-            # جدول groups
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS store_groups (
-                    id SERIAL PRIMARY KEY,
-                    group_code VARCHAR(50) UNIQUE NOT NULL,
-                    group_name VARCHAR(500),
-                    created_by INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL
-                )
-            """)
-            
-            # جدول group members
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS store_group_members (
-                    id SERIAL PRIMARY KEY,
-                    group_code VARCHAR(50) NOT NULL,
-                    store_id INTEGER NOT NULL,
-                    is_primary BOOLEAN DEFAULT FALSE,
-                    created_by INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE,
-                    FOREIGN KEY (group_code) REFERENCES store_groups(group_code) ON DELETE CASCADE,
-                    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
-                    UNIQUE(group_code, store_id)
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_group_members_group_code ON store_group_members(group_code)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_group_members_store_id ON store_group_members(store_id)")
-            
-            # جدول اختصاص مغازه‌ها به کاربران (Market Visit) - استفاده از store_token
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS assigned_stores (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    store_token VARCHAR(255) NOT NULL,
-                    assigned_date DATE NOT NULL,
-                    visit_date DATE,
-                    status VARCHAR(50) DEFAULT 'pending',
-                    notes TEXT,
-                    assigned_by INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (assigned_by) REFERENCES users(id) ON DELETE SET NULL,
-                    UNIQUE(user_id, store_token, assigned_date)
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_user_id ON assigned_stores(user_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_store_token ON assigned_stores(store_token)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_assigned_date ON assigned_stores(assigned_date)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_assigned_stores_status ON assigned_stores(status)")
+            # مسیر سریع: schema به‌روز است و نیازی به lock نیست
+            applied = get_applied_migrations(cur)
+            conn.commit()
+            if all(version in applied for version, _, _ in SCHEMA_MIGRATIONS):
+                return applied_now
             
-            # جدول اطلاعات و عکس‌های مارکت ویزیت - استفاده از store_token
+            cur.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_MIGRATIONS_LOCK_ID,))
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name VARCHAR(255) NOT NULL,
+                        duration_ms INTEGER,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                conn.commit()
+                
+                # بعد از گرفتن lock دوباره خوانده می‌شود (ممکن است worker دیگری migration را انجام داده باشد)
+                applied = get_applied_migrations(cur)
+                for version, name, migration in SCHEMA_MIGRATIONS:
+                    if version in applied:
+                        continue
+                    started = time.time()
+                    migration(cur)
+                    duration_ms = int((time.time() - started) * 1000)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+                        (version, name, duration_ms)
+                    )
+                    conn.commit()
+                    applied_now.append(version)
+                    print(f"[MIGRATION] Applied {version:03d}_{name} in {duration_ms}ms")
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_MIGRATIONS_LOCK_ID,))
+                conn.commit()
+    except Exception as e:
+        error_msg = f"Error running migrations: {e}"
+        print(f"[ERROR] DatabaseError: {error_msg} - Endpoint: run_migrations")
+        print(traceback.format_exc())
+        conn.rollback()
+        # schema نیمه‌کاره نباید سرو شود: startup متوقف و CLI با کد غیر صفر خارج می‌شود
+        raise
+    finally:
+        conn.close()
+    return applied_now
+
+# ==================== Schema Capabilities ====================
+
+# وضعیت schema یک بار در startup (و بعد از هر migration) خوانده می‌شود تا endpointها
+# به جای کوئری روی information_schema در هر درخواست، فقط این dict را بررسی کنند.
+SCHEMA_CAPABILITY_TABLES = [
+    "store_main_categories",
+    "store_sub_categories",
+    "store_deactivation_requests",
+    "store_comment_stats",
+    "image_blobs",
+]
+
+SCHEMA_CAPABILITIES = {}
+SCHEMA_CAPABILITIES_LOADED_AT = None
+
+def refresh_schema_capabilities() -> dict:
+    """خواندن وضعیت جداول از information_schema و به‌روزرسانی registry"""
+    global SCHEMA_CAPABILITIES_LOADED_AT
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS store_visit_data (
-                    id SERIAL PRIMARY KEY,
-                    assignment_id INTEGER NOT NULL,
-                    store_token VARCHAR(255) NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    visit_date DATE NOT NULL,
-                    visit_time TIME,
-                    image_urls TEXT[],
-                    additional_info JSONB,
-                    latitude FLOAT,
-                    longitude FLOAT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (assignment_id) REFERENCES assigned_stores(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_assignment_id ON store_visit_data(assignment_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_store_token ON store_visit_data(store_token)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_user_id ON store_visit_data(user_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_visit_data_visit_date ON store_visit_data(visit_date)")
-            
-            # اضافه کردن فیلدهای جدید به city_categories اگر وجود نداشته باشند
-            cur.execute("""
-                DO $$ 
-                BEGIN
-                    -- اضافه کردن فیلد پلاک
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'city_categories' 
-                        AND column_name = 'place_plate_number'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD COLUMN place_plate_number VARCHAR(50);
-                    END IF;
-                    
-                    -- اضافه کردن فیلد کد پستی
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'city_categories' 
-                        AND column_name = 'place_postal_code'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD COLUMN place_postal_code VARCHAR(20);
-                    END IF;
-                    
-                    -- اضافه کردن فیلد وضعیت (فعال/غیرفعال)
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'city_categories' 
-                        AND column_name = 'is_active'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD COLUMN is_active BOOLEAN DEFAULT TRUE;
-                        UPDATE city_categories SET is_active = TRUE WHERE is_active IS NULL;
-                        CREATE INDEX IF NOT EXISTS idx_city_categories_is_active ON city_categories(is_active);
-                    END IF;
-                    
-                    -- اضافه کردن فیلد عکس‌ها
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'city_categories' 
-                        AND column_name = 'place_images'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD COLUMN place_images TEXT[];
-                    END IF;
-                    
-                    -- اضافه کردن فیلد کاربر ثبت‌کننده
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'city_categories' 
-                        AND column_name = 'created_by_user_id'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD COLUMN created_by_user_id INTEGER;
-                    END IF;
-                    
-                    -- اضافه کردن constraint برای created_by_user_id اگر وجود نداشته باشد
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.table_constraints 
-                        WHERE table_name = 'city_categories' 
-                        AND constraint_name = 'fk_city_categories_created_by'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD CONSTRAINT fk_city_categories_created_by 
-                            FOREIGN KEY (created_by_user_id) REFERENCES users(id) ON DELETE SET NULL;
-                    END IF;
-                    
-                    -- اضافه کردن فیلد کارگاه دارد/ندارد
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'city_categories' 
-                        AND column_name = 'has_workshop'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD COLUMN has_workshop BOOLEAN DEFAULT FALSE;
-                        UPDATE city_categories SET has_workshop = FALSE WHERE has_workshop IS NULL;
-                        CREATE INDEX IF NOT EXISTS idx_city_categories_has_workshop ON city_categories(has_workshop);
-                    END IF;
-                    
-                    -- اضافه کردن فیلد place_full_data برای ذخیره داده‌های کامل از API
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'city_categories' 
-                        AND column_name = 'place_full_data'
-                        AND table_schema = 'public'
-                    ) THEN
-                        ALTER TABLE city_categories ADD COLUMN place_full_data JSONB;
-                    END IF;
-                END $$;
-            """)
-            
-            # جدول درخواست‌های غیرفعال کردن مغازه‌ها
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS store_deactivation_requests (
-                    id SERIAL PRIMARY KEY,
-                    store_id INTEGER NOT NULL,
-                    store_token VARCHAR(255),
-                    requested_by INTEGER NOT NULL,
-                    reason TEXT,
-                    status VARCHAR(50) DEFAULT 'pending',
-                    reviewed_by INTEGER,
-                    reviewed_at TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE,
-                    FOREIGN KEY (requested_by) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (reviewed_by) REFERENCES users(id) ON DELETE SET NULL
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_store_id ON store_deactivation_requests(store_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_store_token ON store_deactivation_requests(store_token)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_status ON store_deactivation_requests(status)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_requested_by ON store_deactivation_requests(requested_by)")
-            
-            # جداول دسته‌بندی مشتریان
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS store_main_categories (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(255) NOT NULL,
-                    slug VARCHAR(255) UNIQUE NOT NULL,
-                    preview_count INTEGER DEFAULT 0,
-                    display_order INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_main_categories_slug ON store_main_categories(slug)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_main_categories_display_order ON store_main_categories(display_order)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_main_categories_is_active ON store_main_categories(is_active)")
-            
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS store_sub_categories (
-                    id SERIAL PRIMARY KEY,
-                    main_category_id INTEGER NOT NULL,
-                    name VARCHAR(255) NOT NULL,
-                    slug VARCHAR(255) NOT NULL,
-                    icon VARCHAR(255),
-                    display_order INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (main_category_id) REFERENCES store_main_categories(id) ON DELETE CASCADE,
-                    UNIQUE(main_category_id, slug)
-                )
-            """)
-            
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_main_category_id ON store_sub_categories(main_category_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_slug ON store_sub_categories(slug)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_display_order ON store_sub_categories(display_order)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_sub_categories_is_active ON store_sub_categories(is_active)")
-            
-        conn.commit()
-    except Exception as e:
-        error_msg = f"Error initializing database: {e}"
-        print(f"[ERROR] DatabaseError: {error_msg} - Endpoint: init_database")
-        import traceback
-        print(traceback.format_exc())
-        conn.rollback()
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = 'public' AND table_name = ANY(%s)
+            """, (SCHEMA_CAPABILITY_TABLES,))
+            existing = {row[0] for row in cur.fetchall()}
+        capabilities = {table: table in existing for table in SCHEMA_CAPABILITY_TABLES}
+        SCHEMA_CAPABILITIES.clear()
+        SCHEMA_CAPABILITIES.update(capabilities)
+        SCHEMA_CAPABILITIES_LOADED_AT = datetime.now()
+        missing = [table for table, exists in capabilities.items() if not exists]
+        if missing:
+            print(f"[SCHEMA] Missing tables: {', '.join(missing)}")
+        return capabilities
     finally:
         conn.close()
 
-# اجرای initialization در startup
+def has_schema_capability(table_name: str) -> bool:
+    """آیا جدول در schema وجود دارد (از registry؛ فقط اگر هنوز بارگذاری نشده یک بار probe می‌شود)"""
+    if SCHEMA_CAPABILITIES_LOADED_AT is None:
+        try:
+            refresh_schema_capabilities()
+        except Exception as e:
+            print(f"[ERROR] DatabaseError: Error loading schema capabilities: {e}")
+            return False
+    return SCHEMA_CAPABILITIES.get(table_name, False)
+
+# اجرای migrationها در startup (با RUN_MIGRATIONS_ON_STARTUP=false می‌توان آن را جدا اجرا کرد: python main.py migrate)
 @app.on_event("startup")
 async def startup_event():
-    init_database()
+    # خطای migration از startup عبور می‌کند و uvicorn برنامه را اجرا نمی‌کند
+    if RUN_MIGRATIONS_ON_STARTUP:
+        run_migrations()
+    try:
+        refresh_schema_capabilities()
+    except Exception as e:
+        print(f"[ERROR] DatabaseError: Error loading schema capabilities: {e}")
+
+# registry هر worker در حافظه خودش است؛ refresh با NOTIFY روی این کانال به همه workerها اطلاع داده می‌شود
+SCHEMA_REFRESH_CHANNEL = "schema_refresh"
+_schema_refresh_listener = {"conn": None}
+
+@app.on_event("startup")
+async def start_schema_refresh_listener():
+    """LISTEN روی کانال refresh با یک اتصال جداگانه (بدون thread؛ از طریق add_reader حلقه رویداد)"""
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {SCHEMA_REFRESH_CHANNEL}")
+    except Exception as e:
+        print(f"[ERROR] DatabaseError: Could not listen for schema refresh: {e}")
+        return
+    loop = asyncio.get_running_loop()
+    
+    def on_notify():
+        try:
+            conn.poll()
+        except Exception as e:
+            # با قطع اتصال، این worker تا restart بعدی فقط با refresh محلی به‌روز می‌شود
+            print(f"[ERROR] DatabaseError: Schema refresh listener stopped: {e}")
+            loop.remove_reader(conn.fileno())
+            return
+        senders = [notify.payload for notify in conn.notifies]
+        conn.notifies.clear()
+        if senders and any(sender != str(os.getpid()) for sender in senders):
+            loop.run_in_executor(None, refresh_schema_capabilities_safely)
+    
+    loop.add_reader(conn.fileno(), on_notify)
+    _schema_refresh_listener["conn"] = conn
+
+@app.on_event("shutdown")
+async def stop_schema_refresh_listener():
+    conn = _schema_refresh_listener["conn"]
+    if conn is not None:
+        _schema_refresh_listener["conn"] = None
+        asyncio.get_running_loop().remove_reader(conn.fileno())
+        conn.close()
+
+def refresh_schema_capabilities_safely():
+    try:
+        refresh_schema_capabilities()
+        print(f"[SCHEMA] Capabilities refreshed by broadcast (pid {os.getpid()})")
+    except Exception as e:
+        print(f"[ERROR] DatabaseError: Error refreshing schema capabilities: {e}")
+
+def broadcast_schema_refresh():
+    """اطلاع به سایر workerها برای بارگذاری دوباره registry"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (SCHEMA_REFRESH_CHANNEL, str(os.getpid())))
+        conn.commit()
+    finally:
+        conn.close()
+
+@app.post("/api/schema/refresh", dependencies=[Depends(require_admin)])
+async def refresh_schema():
+    """اجرای migrationهای جدید و به‌روزرسانی registry وضعیت schema در همه workerها (فقط ادمین)"""
+    try:
+        applied = await run_in_threadpool(run_migrations)
+        capabilities = await run_in_threadpool(refresh_schema_capabilities)
+        await run_in_threadpool(broadcast_schema_refresh)
+        return {
+            "success": True,
+            "appliedMigrations": applied,
+            "capabilities": capabilities,
+        }
+    except Exception as e:
+        print(f"[ERROR] DatabaseError: {e} - Endpoint: /api/schema/refresh")
+        raise HTTPException(status_code=500, detail=str(e))
 
 # ==================== Auth Endpoints ====================
 
@@ -853,6 +1757,124 @@ async def get_current_user(user: dict = Depends(require_auth)):
         },
     }
 
+# ==================== Session Sweeper ====================
+
+# پاک‌سازی دوره‌ای sessionهای منقضی در دسته‌های کوچک (هر دسته تراکنش جداگانه و قفل کوتاه)
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "900"))
+SESSION_SWEEP_BATCH_SIZE = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", "1000"))
+SESSION_SWEEP_BATCH_PAUSE = float(os.getenv("SESSION_SWEEP_BATCH_PAUSE_SECONDS", "0.05"))
+SESSION_SWEEP_LOCK_ID = 7320452
+
+SESSION_SWEEPER_STATS = {
+    "runs": 0,
+    "skippedRuns": 0,
+    "failedRuns": 0,
+    "purgedTotal": 0,
+    "lastPurged": 0,
+    "lastBatches": 0,
+    "lastDurationMs": 0.0,
+    "lastRunAt": None,
+    "tableRows": None,
+    "expiredRows": None,
+}
+
+_session_sweeper_task = None
+
+def purge_expired_sessions(batch_size: int = SESSION_SWEEP_BATCH_SIZE) -> dict:
+    """حذف sessionهای منقضی؛ فقط یک worker در هر لحظه (advisory lock) این کار را انجام می‌دهد"""
+    started = time.time()
+    purged = 0
+    batches = 0
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS locked", (SESSION_SWEEP_LOCK_ID,))
+            locked = cur.fetchone()["locked"]
+            conn.commit()
+            if not locked:
+                SESSION_SWEEPER_STATS["skippedRuns"] += 1
+                return {"skipped": True, "purged": 0}
+            
+            try:
+                while True:
+                    cur.execute("""
+                        DELETE FROM user_sessions
+                        WHERE id IN (
+                            SELECT id FROM user_sessions
+                            WHERE expires_at <= CURRENT_TIMESTAMP
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                    """, (batch_size,))
+                    deleted = cur.rowcount
+                    conn.commit()
+                    purged += deleted
+                    batches += 1
+                    if deleted < batch_size:
+                        break
+                    time.sleep(SESSION_SWEEP_BATCH_PAUSE)
+                
+                # اندازه جدول از آمار pg_class (بدون اسکن) و تعداد منقضی‌های باقیمانده از ایندکس expires_at
+                cur.execute("""
+                    SELECT GREATEST(reltuples, 0)::BIGINT AS table_rows
+                    FROM pg_class WHERE oid = 'user_sessions'::regclass
+                """)
+                row = cur.fetchone()
+                SESSION_SWEEPER_STATS["tableRows"] = row["table_rows"] if row else None
+                cur.execute("SELECT COUNT(*) AS count FROM user_sessions WHERE expires_at <= CURRENT_TIMESTAMP")
+                SESSION_SWEEPER_STATS["expiredRows"] = cur.fetchone()["count"]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (SESSION_SWEEP_LOCK_ID,))
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        SESSION_SWEEPER_STATS["failedRuns"] += 1
+        raise
+    finally:
+        conn.close()
+    
+    duration_ms = round((time.time() - started) * 1000, 2)
+    SESSION_SWEEPER_STATS["runs"] += 1
+    SESSION_SWEEPER_STATS["purgedTotal"] += purged
+    SESSION_SWEEPER_STATS["lastPurged"] = purged
+    SESSION_SWEEPER_STATS["lastBatches"] = batches
+    SESSION_SWEEPER_STATS["lastDurationMs"] = duration_ms
+    SESSION_SWEEPER_STATS["lastRunAt"] = datetime.now().isoformat()
+    if purged:
+        print(f"[SESSIONS] Purged {purged} expired sessions in {batches} batches ({duration_ms}ms)")
+    return {"skipped": False, "purged": purged, "batches": batches, "durationMs": duration_ms}
+
+async def run_session_sweeper():
+    """حلقه پس‌زمینه پاک‌سازی sessionها"""
+    while True:
+        try:
+            await run_in_threadpool(purge_expired_sessions)
+        except Exception as e:
+            print(f"[ERROR] DatabaseError: Error purging sessions: {e}")
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    global _session_sweeper_task
+    if SESSION_SWEEP_INTERVAL > 0:
+        _session_sweeper_task = asyncio.create_task(run_session_sweeper())
+
+@app.on_event("shutdown")
+async def stop_session_sweeper():
+    global _session_sweeper_task
+    if _session_sweeper_task is not None:
+        _session_sweeper_task.cancel()
+        _session_sweeper_task = None
+
+@app.get("/api/sessions/sweeper-stats")
+async def get_session_sweeper_stats(user: dict = Depends(require_auth)):
+    """آمار پاک‌سازی sessionهای منقضی (اندازه جدول و تعداد حذف‌شده‌ها)"""
+    return {"success": True, "stats": {**SESSION_SWEEPER_STATS, "intervalSeconds": SESSION_SWEEP_INTERVAL}}
+
 # ==================== Nearby Stores Endpoint ====================
 
 @app.get("/api/nearby-stores")
@@ -885,12 +1907,17 @@ async def get_nearby_stores(
                     cc.place_seo_details,
                     cc.province_name,
                     cc.has_workshop,
+                    scs.comment_count,
+                    scs.rating_count,
+                    scs.rating_sum,
+                    scs.last_comment_at,
                     (SELECT sgm.group_code 
                      FROM store_group_members sgm 
                      WHERE sgm.store_id = cc.id 
                      ORDER BY sgm.is_primary DESC, sgm.created_at ASC 
                      LIMIT 1) as group_code
                 FROM city_categories cc
+                LEFT JOIN store_comment_stats scs ON scs.store_id = cc.id
                 WHERE cc.place_name IS NOT NULL 
                 AND cc.place_name != ''
                 AND cc.place_coordinates_lat IS NOT NULL
@@ -930,7 +1957,7 @@ async def get_nearby_stores(
             
             query += " ORDER BY cc.place_coordinates_lat, cc.place_coordinates_lng, cc.id"
             
-            cur.execute(query, params)
+            cur.execute(query, params, name="nearby_stores.search")
             rows = cur.fetchall()
             
             # حذف تکراری‌ها بر اساس مختصات
@@ -985,6 +2012,7 @@ async def get_nearby_stores(
                             "distance": round(distance * 10) / 10,
                             "groupCode": row["group_code"],
                             "has_workshop": row.get("has_workshop", False),
+                            "commentStats": format_comment_stats(row),
                         })
             
             # مرتب‌سازی بر اساس فاصله
@@ -1008,17 +2036,343 @@ async def get_nearby_stores(
     finally:
         conn.close()
 
+# ==================== Local Reverse Geocoding ====================
+
+# مرزهای محله/منطقه/شهر از فایل‌های GeoJSON (neighborhoods.geojson، districts.geojson، cities.geojson)
+# در STRtree بارگذاری می‌شوند تا جستجوی نقطه در چندضلعی بدون تماس با raah.ir انجام شود.
+GEO_BOUNDARIES_DIR = Path(os.getenv("GEO_BOUNDARIES_DIR", str(Path(__file__).parent / "geodata")))
+GEO_LEVELS = ("neighborhood", "district", "city")
+GEO_LEVEL_FILES = {
+    "neighborhood": "neighborhoods.geojson",
+    "district": "districts.geojson",
+    "city": "cities.geojson",
+}
+GEO_NAME_PROPERTIES = ("name", "name_fa", "title", "label")
+GEO_BATCH_MAX_POINTS = int(os.getenv("GEO_BATCH_MAX_POINTS", "5000"))
+GEO_BATCH_REMOTE_MAX = int(os.getenv("GEO_BATCH_REMOTE_MAX", "50"))
+# fallbackهای raah.ir در یک thread pool مشترک با همزمانی محدود و یک مهلت کلی برای هر درخواست اجرا می‌شوند
+GEO_BATCH_REMOTE_CONCURRENCY = int(os.getenv("GEO_BATCH_REMOTE_CONCURRENCY", "4"))
+GEO_BATCH_REMOTE_DEADLINE = float(os.getenv("GEO_BATCH_REMOTE_DEADLINE_SECONDS", "10"))
+_geo_remote_pool = None
+
+class LocalGeocoder:
+    """جستجوی نقطه در چندضلعی برای هر سطح (محله، منطقه، شهر) با shapely STRtree"""
+    
+    def __init__(self, boundaries_dir: Path):
+        self.levels = {}
+        self.loaded_at = datetime.now().isoformat()
+        try:
+            from shapely.geometry import shape
+            from shapely.strtree import STRtree
+        except ImportError:
+            print("Warning: shapely is not installed - local geocoding disabled")
+            return
+        
+        for level, filename in GEO_LEVEL_FILES.items():
+            path = boundaries_dir / filename
+            if not path.exists():
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    collection = json.load(f)
+                geometries = []
+                names = []
+                for feature in collection.get("features", []):
+                    properties = feature.get("properties") or {}
+                    name = next((properties[key] for key in GEO_NAME_PROPERTIES if properties.get(key)), None)
+                    if not name or not feature.get("geometry"):
+                        continue
+                    geometry = shape(feature["geometry"])
+                    if geometry.is_empty:
+                        continue
+                    geometries.append(geometry)
+                    names.append(str(name).strip())
+                if geometries:
+                    self.levels[level] = {
+                        "tree": STRtree(geometries),
+                        "geometries": geometries,
+                        "areas": [geometry.area for geometry in geometries],
+                        "names": names,
+                    }
+                    print(f"✅ Loaded {len(geometries)} {level} boundaries from {path}")
+            except Exception as e:
+                print(f"Warning: Could not load {path}: {e}")
+    
+    @property
+    def available(self) -> bool:
+        return bool(self.levels)
+    
+    def lookup_many(self, points: List[tuple]) -> List[dict]:
+        """جستجوی دسته‌ای؛ points لیست (lat, lng) و خروجی برای هر نقطه {level: name}"""
+        results = [{level: None for level in GEO_LEVELS} for _ in points]
+        if not points or not self.levels:
+            return results
+        import shapely
+        
+        geoms = shapely.points([(lng, lat) for lat, lng in points])
+        for level, index in self.levels.items():
+            point_idx, poly_idx = index["tree"].query(geoms, predicate="intersects")
+            # در صورت همپوشانی، کوچک‌ترین چندضلعی (دقیق‌ترین) انتخاب می‌شود
+            best_area = {}
+            for p, g in zip(point_idx.tolist(), poly_idx.tolist()):
+                area = index["areas"][g]
+                if p not in best_area or area < best_area[p][0]:
+                    best_area[p] = (area, g)
+            for p, (_, g) in best_area.items():
+                results[p][level] = index["names"][g]
+        return results
+    
+    def lookup(self, lat: float, lng: float) -> dict:
+        return self.lookup_many([(lat, lng)])[0]
+    
+    def stats(self) -> dict:
+        return {
+            "available": self.available,
+            "loadedAt": self.loaded_at,
+            "levels": {level: len(index["names"]) for level, index in self.levels.items()},
+        }
+
+_local_geocoder = None
+
+def get_local_geocoder() -> LocalGeocoder:
+    """geocoder محلی (یک بار بارگذاری در هر process)"""
+    global _local_geocoder
+    if _local_geocoder is None:
+        _local_geocoder = LocalGeocoder(GEO_BOUNDARIES_DIR)
+    return _local_geocoder
+
+@app.on_event("startup")
+async def load_local_geocoder():
+    await run_in_threadpool(get_local_geocoder)
+
+def local_reverse_geocode(lat: Optional[float], lng: Optional[float]) -> dict:
+    """محله/منطقه/شهر از مرزهای محلی (مقادیر None در صورت نبود داده)"""
+    if lat is None or lng is None:
+        return {level: None for level in GEO_LEVELS}
+    try:
+        return get_local_geocoder().lookup(lat, lng)
+    except Exception as e:
+        print(f"[ERROR] Local geocoding failed: {e}")
+        return {level: None for level in GEO_LEVELS}
+
+# ==================== raah.ir Client (Circuit Breaker) ====================
+
+RAAH_BREAKER_WINDOW = int(os.getenv("RAAH_BREAKER_WINDOW", "20"))
+RAAH_BREAKER_MIN_CALLS = int(os.getenv("RAAH_BREAKER_MIN_CALLS", "5"))
+RAAH_BREAKER_FAILURE_RATE = float(os.getenv("RAAH_BREAKER_FAILURE_RATE", "0.5"))
+RAAH_BREAKER_SLOW_CALL_MS = float(os.getenv("RAAH_BREAKER_SLOW_CALL_MS", "3000"))
+RAAH_BREAKER_OPEN_SECONDS = float(os.getenv("RAAH_BREAKER_OPEN_SECONDS", "30"))
+RAAH_CACHE_TTL = int(os.getenv("RAAH_CACHE_TTL_SECONDS", "21600"))
+RAAH_CACHE_MAX_ENTRIES = int(os.getenv("RAAH_CACHE_MAX_ENTRIES", "5000"))
+
+# آدرس پایه سرویس‌ها قابل تنظیم است تا در تست کارایی به جای raah.ir سرور mock (mock_raah.py) استفاده شود
+RAAH_REVERSE_GEOCODING_URL = os.getenv("RAAH_REVERSE_GEOCODING_URL", "https://reverse-geocoding.raah.ir/v1").rstrip("/")
+RAAH_GEOCODING_URL = os.getenv("RAAH_GEOCODING_URL", "https://geocoding.raah.ir/v1").rstrip("/")
+RAAH_SERVICE_URLS = {
+    "reverse-geocoding": RAAH_REVERSE_GEOCODING_URL,
+    "geocoding": RAAH_GEOCODING_URL,
+}
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """درخواست به دلیل باز بودن circuit breaker ارسال نشد"""
+
+class CircuitBreaker:
+    """Circuit breaker با نرخ خطا و کندی در یک پنجره لغزان و probe در حالت half-open"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.window = deque(maxlen=RAAH_BREAKER_WINDOW)
+        self.state = "closed"
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.counters = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "slowCalls": 0,
+            "shortCircuited": 0,
+            "opened": 0,
+        }
+    
+    def allow(self) -> bool:
+        """آیا درخواست می‌تواند ارسال شود (در half-open فقط یک probe)"""
+        with self.lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < RAAH_BREAKER_OPEN_SECONDS:
+                    self.counters["shortCircuited"] += 1
+                    return False
+                self.state = "half_open"
+                self.probe_in_flight = False
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    self.counters["shortCircuited"] += 1
+                    return False
+                self.probe_in_flight = True
+            self.counters["calls"] += 1
+            return True
+    
+    def record(self, ok: bool, duration_ms: float):
+        """ثبت نتیجه یک فراخوانی و تغییر وضعیت در صورت نیاز"""
+        slow = duration_ms > RAAH_BREAKER_SLOW_CALL_MS
+        failed = not ok or slow
+        with self.lock:
+            self.counters["successes" if ok else "failures"] += 1
+            if slow:
+                self.counters["slowCalls"] += 1
+            
+            if self.state == "half_open":
+                self.probe_in_flight = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = "closed"
+                    self.window.clear()
+                    print(f"[BREAKER] {self.name} closed")
+                return
+            
+            self.window.append(failed)
+            if self.state == "closed" and len(self.window) >= RAAH_BREAKER_MIN_CALLS:
+                if sum(self.window) / len(self.window) >= RAAH_BREAKER_FAILURE_RATE:
+                    self._open()
+    
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.time()
+        self.window.clear()
+        self.counters["opened"] += 1
+        print(f"[BREAKER] {self.name} opened")
+    
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "state": self.state,
+                "failureRate": round(sum(self.window) / len(self.window), 3) if self.window else 0.0,
+                "windowSize": len(self.window),
+                "openedAt": datetime.fromtimestamp(self.opened_at).isoformat() if self.opened_at else None,
+                **self.counters,
+            }
+
+RAAH_BREAKERS = {service: CircuitBreaker(service) for service in RAAH_SERVICE_URLS}
+
+def raah_service(url: str) -> str:
+    """نام سرویس raah.ir (کلید breaker و برچسب متریک‌ها) بر اساس آدرس پایه"""
+    # طولانی‌ترین آدرس پایه اول بررسی می‌شود تا آدرس‌های تو در تو درست تشخیص داده شوند
+    for service, base_url in sorted(RAAH_SERVICE_URLS.items(), key=lambda item: -len(item[1])):
+        if url.startswith(base_url + "/") or url.startswith(base_url + "?"):
+            return service
+    return "unknown"
+
+class RaahResponseCache:
+    """Cache LRU پاسخ‌های موفق raah.ir؛ مقادیر منقضی فقط به عنوان fallback در زمان قطعی استفاده می‌شوند"""
+    
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+    
+    def get(self, url: str, allow_stale: bool = False):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, data = entry
+            if time.time() - stored_at > self.ttl and not allow_stale:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(url)
+            if allow_stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return data
+    
+    def put(self, url: str, data):
+        with self.lock:
+            self.entries[url] = (time.time(), data)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "staleHits": self.stale_hits, "misses": self.misses}
+
+RAAH_CACHE = RaahResponseCache(RAAH_CACHE_MAX_ENTRIES, RAAH_CACHE_TTL)
+
+def raah_get(url: str, timeout: float = 5):
+    """GET به raah.ir از طریق cache و circuit breaker؛ خروجی JSON پاسخ
+
+    در صورت باز بودن breaker یا خطا، آخرین پاسخ cache شده (حتی منقضی) برگردانده می‌شود
+    و اگر وجود نداشت CircuitOpenError یا خطای requests بالا می‌رود.
+    """
+    cached = RAAH_CACHE.get(url)
+    if cached is not None:
+        return cached
+    
+    host = raah_service(url)
+    breaker = RAAH_BREAKERS.get(host)
+    if breaker is not None and not breaker.allow():
+        RAAH_REQUEST_ERRORS.inc(breaker.name, "short_circuit")
+        stale = RAAH_CACHE.get(url, allow_stale=True)
+        if stale is not None:
+            return stale
+        raise CircuitOpenError(f"Circuit open for {breaker.name}")
+    
+    started = time.time()
+    try:
+        response = requests.get(url, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        RAAH_REQUEST_SECONDS.observe(time.time() - started, host)
+        profile_record("http", host, time.time() - started)
+        RAAH_REQUEST_ERRORS.inc(host, "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection")
+        if breaker is not None:
+            breaker.record(False, (time.time() - started) * 1000)
+        stale = RAAH_CACHE.get(url, allow_stale=True)
+        if stale is not None:
+            return stale
+        raise
+    
+    RAAH_REQUEST_SECONDS.observe(time.time() - started, host)
+    profile_record("http", host, time.time() - started)
+    if response.status_code >= 400:
+        RAAH_REQUEST_ERRORS.inc(host, f"http_{response.status_code // 100}xx")
+    
+    # خطای 4xx مشکل سرویس نیست و breaker را باز نمی‌کند
+    if breaker is not None:
+        breaker.record(response.status_code < 500, (time.time() - started) * 1000)
+    if response.status_code >= 500:
+        stale = RAAH_CACHE.get(url, allow_stale=True)
+        if stale is not None:
+            return stale
+    response.raise_for_status()
+    data = response.json()
+    RAAH_CACHE.put(url, data)
+    return data
+
+@app.get("/api/raah/breaker-stats", dependencies=[Depends(require_admin)])
+async def get_raah_breaker_stats():
+    """وضعیت circuit breaker و cache سرویس‌های raah.ir (فقط مدیر)"""
+    return {
+        "success": True,
+        "breakers": {name: breaker.stats() for name, breaker in RAAH_BREAKERS.items()},
+        "cache": RAAH_CACHE.stats(),
+    }
+
 @app.get("/api/get-address")
-async def get_address(lat: float, lng: float):
+def get_address(lat: float, lng: float):
     """دریافت آدرس کامل از مختصات جغرافیایی با استفاده از API جدید raah.ir"""
     try:
         # استفاده از API جدید که formatted_address و components برمی‌گرداند
-        url = f"https://reverse-geocoding.raah.ir/v1/?location={lng},{lat}"
+        url = f"{RAAH_REVERSE_GEOCODING_URL}/?location={lng},{lat}"
         
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            data = raah_get(url, timeout=10)
             
             # دریافت formatted_address
             formatted_address = data.get("formatted_address")
@@ -1092,16 +2446,23 @@ async def get_address(lat: float, lng: float):
                 }
                 
         except requests.exceptions.RequestException as e:
+            # در زمان قطعی raah.ir (breaker باز) درخواست‌های fallback هم بی‌نتیجه‌اند
+            if isinstance(e, CircuitOpenError):
+                return {
+                    "success": False,
+                    "address": None,
+                    "message": "سرویس آدرس‌یابی موقتاً در دسترس نیست"
+                }
+            
             # Fallback به روش قدیمی در صورت خطا
             address_parts = []
             
             # دریافت اطلاعات مختلف از API raah.ir و ساخت آدرس کامل
             # 1. دریافت street (خیابان)
             try:
-                street_url = f"https://reverse-geocoding.raah.ir/v1/features?result_type=street&location={lng},{lat}"
-                street_response = requests.get(street_url, timeout=5)
-                if street_response.ok:
-                    street_data = street_response.json()
+                street_url = f"{RAAH_REVERSE_GEOCODING_URL}/features?result_type=street&location={lng},{lat}"
+                street_data = raah_get(street_url, timeout=5)
+                if street_data:
                     if "features" in street_data and isinstance(street_data["features"], list) and len(street_data["features"]) > 0:
                         street_feature = street_data["features"][0]
                         street_name = None
@@ -1117,10 +2478,9 @@ async def get_address(lat: float, lng: float):
             
             # 2. دریافت neighborhood (محله)
             try:
-                neighborhood_url = f"https://reverse-geocoding.raah.ir/v1/features?result_type=neighborhood&location={lng},{lat}"
-                neighborhood_response = requests.get(neighborhood_url, timeout=5)
-                if neighborhood_response.ok:
-                    neighborhood_data = neighborhood_response.json()
+                neighborhood_url = f"{RAAH_REVERSE_GEOCODING_URL}/features?result_type=neighborhood&location={lng},{lat}"
+                neighborhood_data = raah_get(neighborhood_url, timeout=5)
+                if neighborhood_data:
                     if "features" in neighborhood_data and isinstance(neighborhood_data["features"], list) and len(neighborhood_data["features"]) > 0:
                         neighborhood_feature = neighborhood_data["features"][0]
                         neighborhood_name = None
@@ -1136,10 +2496,9 @@ async def get_address(lat: float, lng: float):
             
             # 3. دریافت city (شهر)
             try:
-                city_url = f"https://reverse-geocoding.raah.ir/v1/features?result_type=city&location={lng},{lat}"
-                city_response = requests.get(city_url, timeout=5)
-                if city_response.ok:
-                    city_data = city_response.json()
+                city_url = f"{RAAH_REVERSE_GEOCODING_URL}/features?result_type=city&location={lng},{lat}"
+                city_data = raah_get(city_url, timeout=5)
+                if city_data:
                     city_name = None
                     if "features" in city_data and isinstance(city_data["features"], list) and len(city_data["features"]) > 0:
                         city_feature = city_data["features"][0]
@@ -1184,18 +2543,8 @@ async def get_store_categories():
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # بررسی وجود جداول
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_schema = 'public' 
-                    AND table_name = 'store_main_categories'
-                ) as table_exists;
-            """)
-            result = cur.fetchone()
-            table_exists = result["table_exists"] if result else False
-            
-            if not table_exists:
+            # بررسی وجود جداول (از registry وضعیت schema)
+            if not has_schema_capability("store_main_categories"):
                 return {
                     "success": False,
                     "error": "جداول دسته‌بندی ایجاد نشده‌اند. لطفاً ابتدا جداول را ایجاد کنید.",
@@ -1253,7 +2602,6 @@ async def get_store_categories():
                 "count": len(categories_result)
             }
     except Exception as e:
-        import traceback
         error_detail = f"{str(e)}\n{traceback.format_exc()}"
         print(f"[ERROR] DatabaseError: Error in get_store_categories - Endpoint: /api/store-categories")
         print(error_detail)
@@ -1267,17 +2615,24 @@ async def get_store_categories():
         conn.close()
 
 @app.get("/api/get-neighborhood")
-async def get_neighborhood(lat: float, lng: float):
-    """دریافت نام محله از مختصات جغرافیایی"""
+def get_neighborhood(lat: float, lng: float):
+    """دریافت نام محله از مختصات جغرافیایی (ابتدا از مرزهای محلی، سپس raah.ir)"""
     try:
         neighborhood_name = None
         
+        local = local_reverse_geocode(lat, lng)
+        if local["neighborhood"]:
+            return {
+                "success": True,
+                "neighborhood": local["neighborhood"],
+                "location": {"lat": lat, "lng": lng},
+                "source": "local"
+            }
+        
         # دریافت محله از API raah.ir
         try:
-            url = f"https://reverse-geocoding.raah.ir/v1/features?result_type=neighborhood&location={lng},{lat}"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            url = f"{RAAH_REVERSE_GEOCODING_URL}/features?result_type=neighborhood&location={lng},{lat}"
+            data = raah_get(url, timeout=10)
             
             # بررسی ساختارهای مختلف پاسخ
             if "features" in data and isinstance(data["features"], list) and len(data["features"]) > 0:
@@ -1307,13 +2662,15 @@ async def get_neighborhood(lat: float, lng: float):
             # در صورت خطا در دریافت محله، ادامه می‌دهیم تا city را امتحان کنیم
             pass
         
-        # اگر محله پیدا نشد، city را برگردان
+        # اگر محله پیدا نشد، city را برگردان (ابتدا از مرزهای محلی)
+        if not neighborhood_name:
+            neighborhood_name = local["district"] or local["city"]
+        
         if not neighborhood_name:
             try:
-                city_url = f"https://reverse-geocoding.raah.ir/v1/features?result_type=city&location={lng},{lat}"
-                city_response = requests.get(city_url, timeout=10)
-                if city_response.ok:
-                    city_data = city_response.json()
+                city_url = f"{RAAH_REVERSE_GEOCODING_URL}/features?result_type=city&location={lng},{lat}"
+                city_data = raah_get(city_url, timeout=10)
+                if city_data:
                     # بررسی ساختارهای مختلف
                     if "features" in city_data and isinstance(city_data["features"], list) and len(city_data["features"]) > 0:
                         city_feature = city_data["features"][0]
@@ -1346,6 +2703,75 @@ async def get_neighborhood(lat: float, lng: float):
             "error": str(e)
         }
 
+class GeoPoint(BaseModel):
+    lat: float
+    lng: float
+
+class GeoLookupBatchRequest(BaseModel):
+    points: List[GeoPoint]
+    remoteFallback: bool = False
+
+def get_geo_remote_pool():
+    """ایجاد thread pool مشترک برای fallbackهای raah.ir در جستجوی دسته‌ای (lazy)"""
+    global _geo_remote_pool
+    if _geo_remote_pool is None:
+        _geo_remote_pool = ThreadPoolExecutor(max_workers=max(1, GEO_BATCH_REMOTE_CONCURRENCY), thread_name_prefix="geo-remote")
+    return _geo_remote_pool
+
+@app.post("/api/geo/lookup-batch")
+def geo_lookup_batch(request: GeoLookupBatchRequest, user: dict = Depends(require_auth)):
+    """جستجوی دسته‌ای محله/منطقه/شهر برای تعداد زیادی نقطه (برای backfill)"""
+    
+    if len(request.points) > GEO_BATCH_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"حداکثر {GEO_BATCH_MAX_POINTS} نقطه در هر درخواست مجاز است")
+    
+    points = [(point.lat, point.lng) for point in request.points]
+    results = get_local_geocoder().lookup_many(points)
+    sources = ["local" if result["neighborhood"] else None for result in results]
+    
+    # نقاطی که محلی پیدا نشدند به تعداد محدود و تا پایان مهلت از raah.ir پرسیده می‌شوند
+    remote_timed_out = 0
+    remote_indexes = []
+    if request.remoteFallback:
+        remote_indexes = [i for i, result in enumerate(results) if not result["neighborhood"]][:GEO_BATCH_REMOTE_MAX]
+    if remote_indexes:
+        pool = get_geo_remote_pool()
+        futures = {pool.submit(get_neighborhood, *points[i]): i for i in remote_indexes}
+        done, not_done = wait_futures(futures, timeout=GEO_BATCH_REMOTE_DEADLINE)
+        for future in not_done:
+            # درخواست‌های در صف لغو می‌شوند؛ درخواست‌های در حال اجرا با timeout خود raah_get تمام می‌شوند
+            future.cancel()
+            remote_timed_out += 1
+        for future in done:
+            i = futures[future]
+            try:
+                remote = future.result()
+            except Exception as e:
+                print(f"[ERROR] Remote neighborhood lookup failed: {e}")
+                continue
+            if remote.get("success"):
+                results[i] = {**results[i], "neighborhood": remote["neighborhood"]}
+                sources[i] = remote.get("source", "remote")
+    
+    output = [
+        {"lat": lat, "lng": lng, **result, "source": source}
+        for (lat, lng), result, source in zip(points, results, sources)
+    ]
+    
+    return {
+        "success": True,
+        "results": output,
+        "count": len(output),
+        "resolved": sum(1 for item in output if item["neighborhood"]),
+        "remoteLookups": len(remote_indexes),
+        "remoteTimedOut": remote_timed_out,
+    }
+
+@app.get("/api/geo/status")
+async def geo_status():
+    """وضعیت مرزهای بارگذاری‌شده برای geocoding محلی"""
+    return {"success": True, **get_local_geocoder().stats()}
+
 @app.get("/api/stores-by-neighborhood")
 async def get_stores_by_neighborhood(
     neighborhood: str,
@@ -1376,7 +2802,7 @@ async def get_stores_by_neighborhood(
                 count_query += " AND cc.city_name = %s"
                 count_params.append(city)
             
-            cur.execute(count_query, count_params)
+            cur.execute(count_query, count_params, name="stores_by_neighborhood.count")
             total_count_result = cur.fetchone()
             total_count = total_count_result["total_count"] if total_count_result else 0
             
@@ -1397,6 +2823,10 @@ async def get_stores_by_neighborhood(
                     cc.place_seo_details,
                     cc.province_name,
                     cc.has_workshop,
+                    scs.comment_count,
+                    scs.rating_count,
+                    scs.rating_sum,
+                    scs.last_comment_at,
                     (SELECT sgm.group_code 
                      FROM store_group_members sgm 
                      WHERE sgm.store_id = cc.id 
@@ -1420,6 +2850,7 @@ async def get_stores_by_neighborhood(
             
             query += """
                 FROM city_categories cc
+                LEFT JOIN store_comment_stats scs ON scs.store_id = cc.id
                 WHERE cc.place_name IS NOT NULL 
                 AND cc.place_name != ''
                 AND cc.place_coordinates_lat IS NOT NULL
@@ -1444,7 +2875,7 @@ async def get_stores_by_neighborhood(
                 query += " ORDER BY cc.place_name LIMIT %s"
             params.append(limit)
             
-            cur.execute(query, params)
+            cur.execute(query, params, name="stores_by_neighborhood.list")
             rows = cur.fetchall()
             
             stores = []
@@ -1463,6 +2894,7 @@ async def get_stores_by_neighborhood(
                     "rating": row["place_rating"],
                     "token": row["place_token"] or "",
                     "has_workshop": row.get("has_workshop", False),
+                    "commentStats": format_comment_stats(row),
                 }
                 # اگر فاصله محاسبه شده، اضافه می‌کنیم
                 if "distance" in row and row["distance"] is not None:
@@ -1482,6 +2914,100 @@ async def get_stores_by_neighborhood(
     finally:
         conn.close()
 
+# ==================== Batch Store Lookup ====================
+
+# فیلدهای قابل انتخاب در جستجوی دسته‌ای مغازه‌ها و ستون متناظر در city_categories
+STORE_BATCH_FIELDS = {
+    "id": "id",
+    "token": "place_token",
+    "name": "place_name",
+    "address": "place_address",
+    "lat": "place_coordinates_lat",
+    "lng": "place_coordinates_lng",
+    "category": "category_display",
+    "categorySlug": "category_slug",
+    "city": "city_name",
+    "province": "province_name",
+    "phone": "place_phone",
+    "rating": "place_rating",
+    "plateNumber": "place_plate_number",
+    "postalCode": "place_postal_code",
+    "isActive": "is_active",
+    "hasWorkshop": "has_workshop",
+    "images": "place_images",
+    "fullData": "place_full_data",
+}
+STORE_BATCH_DEFAULT_FIELDS = [
+    "id", "token", "name", "address", "lat", "lng", "category", "categorySlug",
+    "city", "province", "phone", "rating", "isActive", "hasWorkshop",
+]
+STORE_BATCH_MAX_ITEMS = 500
+
+class BatchStoresRequest(BaseModel):
+    tokens: Optional[List[str]] = None
+    ids: Optional[List[int]] = None
+    fields: Optional[List[str]] = None
+
+@app.post("/api/stores/batch")
+async def get_stores_batch(request: BatchStoresRequest):
+    """دریافت اطلاعات چند مغازه بر اساس place_token یا id در یک درخواست"""
+    tokens = list(dict.fromkeys(t for t in (request.tokens or []) if t))
+    ids = list(dict.fromkeys(request.ids or []))
+    if len(tokens) + len(ids) > STORE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"حداکثر {STORE_BATCH_MAX_ITEMS} مغازه در هر درخواست مجاز است")
+
+    fields = request.fields or STORE_BATCH_DEFAULT_FIELDS
+    unknown_fields = [f for f in fields if f not in STORE_BATCH_FIELDS and f != "neighborhood"]
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"فیلد نامعتبر: {', '.join(unknown_fields)}")
+
+    if not tokens and not ids:
+        return {"success": True, "stores": [], "count": 0, "missingTokens": [], "missingIds": []}
+
+    # id و token همیشه برای تطبیق نتایج خوانده می‌شوند
+    columns = {"id", "place_token"}
+    columns.update(STORE_BATCH_FIELDS[f] for f in fields if f in STORE_BATCH_FIELDS)
+    if "neighborhood" in fields:
+        columns.update({"place_address", "city_name", "place_seo_details"})
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"""SELECT {', '.join(sorted(columns))}
+                    FROM city_categories
+                    WHERE place_token = ANY(%s) OR id = ANY(%s)""",
+                (tokens, ids)
+            )
+            rows = cur.fetchall()
+
+            stores = []
+            for row in rows:
+                store = {f: row[STORE_BATCH_FIELDS[f]] for f in fields if f in STORE_BATCH_FIELDS}
+                if "neighborhood" in fields:
+                    store["neighborhood"] = extract_neighborhood(
+                        row["place_address"] or "",
+                        row["city_name"] or "",
+                        row["place_seo_details"]
+                    )
+                if "images" in store:
+                    store["images"] = store["images"] or []
+                stores.append(store)
+
+            found_tokens = {row["place_token"] for row in rows}
+            found_ids = {row["id"] for row in rows}
+            return {
+                "success": True,
+                "stores": stores,
+                "count": len(stores),
+                "missingTokens": [t for t in tokens if t not in found_tokens],
+                "missingIds": [i for i in ids if i not in found_ids],
+            }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
 # ==================== Register Store Endpoint ====================
 
 @app.post("/api/register-store")
@@ -1490,35 +3016,21 @@ async def register_store(request: RegisterStoreRequest, user: dict = Depends(req
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # تولید place_token یکتا
-            place_token = generate_place_token()
-            
-            # بررسی تکراری نبودن token
-            max_attempts = 10
-            attempts = 0
-            while attempts < max_attempts:
-                cur.execute("SELECT COUNT(*) as count FROM city_categories WHERE place_token = %s", (place_token,))
-                result = cur.fetchone()
-                if result and result.get('count', 0) == 0:
-                    break
-                place_token = generate_place_token()
-                attempts += 1
-            
-            if attempts >= max_attempts:
-                raise HTTPException(status_code=500, detail="خطا در تولید token یکتا")
-            
             # استخراج city و province از آدرس یا استفاده از مقادیر ارسال شده
             city_name = request.city
             province_name = request.province
             
-            # اگر city ارسال نشده، از آدرس استخراج کن یا از API استفاده کن
+            # اگر city ارسال نشده، ابتدا از مرزهای محلی استفاده کن
+            if not city_name:
+                city_name = local_reverse_geocode(request.lat, request.lng)["city"]
+            
+            # اگر city پیدا نشد، از آدرس استخراج کن یا از API استفاده کن
             if not city_name:
                 try:
                     # استفاده از API get-address برای استخراج city
-                    address_url = f"https://reverse-geocoding.raah.ir/v1/?location={request.lng},{request.lat}"
-                    address_response = requests.get(address_url, timeout=5)
-                    if address_response.ok:
-                        address_data = address_response.json()
+                    address_url = f"{RAAH_REVERSE_GEOCODING_URL}/?location={request.lng},{request.lat}"
+                    address_data = await run_in_threadpool(raah_get, address_url, timeout=5)
+                    if address_data:
                         components = address_data.get("components", [])
                         for component in components:
                             if component.get("type") == "city" and not city_name:
@@ -1561,11 +3073,9 @@ async def register_store(request: RegisterStoreRequest, user: dict = Depends(req
             if not store_lat or not store_lng:
                 try:
                     # استفاده از API forward geocoding برای استخراج مختصات از آدرس
-                    from urllib.parse import quote
-                    geocode_url = f"https://geocoding.raah.ir/v1/?address={quote(request.address)}"
-                    geocode_response = requests.get(geocode_url, timeout=5)
-                    if geocode_response.ok:
-                        geocode_data = geocode_response.json()
+                    geocode_url = f"{RAAH_GEOCODING_URL}/?address={quote(request.address)}"
+                    geocode_data = await run_in_threadpool(raah_get, geocode_url, timeout=5)
+                    if geocode_data:
                         if geocode_data.get("location"):
                             location = geocode_data["location"]
                             store_lng = location.get("lng")
@@ -1581,42 +3091,48 @@ async def register_store(request: RegisterStoreRequest, user: dict = Depends(req
                 except:
                     place_full_data_json = None
             
-            # درج مغازه جدید
-            cur.execute(
-                """INSERT INTO city_categories 
-                   (place_name, place_address, place_coordinates_lat, place_coordinates_lng,
-                    category_display, category_slug, city_name, province_name, place_phone, place_token,
-                    place_plate_number, place_postal_code, is_active, place_images, created_by_user_id, page_number, place_full_data)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                   RETURNING id, place_name, place_address, place_coordinates_lat, place_coordinates_lng,
-                             category_display, category_slug, city_name, province_name, place_phone, place_token,
-                             place_plate_number, place_postal_code, is_active, place_images, created_by_user_id""",
-                (
-                    request.name,
-                    request.address,
-                    store_lat,
-                    store_lng,
-                    request.category,
-                    request.categorySlug or request.category.lower().replace(' ', '_'),
-                    city_name,
-                    province_name,
-                    request.phone,
-                    place_token,
-                    request.plateNumber,
-                    request.postalCode,
-                    request.isActive if request.isActive is not None else True,
-                    request.imageUrls or [],
-                    user["userId"],
-                    1,  # page_number - مقدار پیش‌فرض برای مغازه‌های دستی ثبت شده
-                    place_full_data_json  # place_full_data
+            # درج مغازه جدید - در صورت تکراری بودن place_token، با token جدید دوباره تلاش می‌شود
+            result = None
+            for _ in range(PLACE_TOKEN_MAX_ATTEMPTS):
+                cur.execute(
+                    """INSERT INTO city_categories 
+                       (place_name, place_address, place_coordinates_lat, place_coordinates_lng,
+                        category_display, category_slug, city_name, province_name, place_phone, place_token,
+                        place_plate_number, place_postal_code, is_active, place_images, created_by_user_id, page_number, place_full_data)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                       ON CONFLICT (place_token) DO NOTHING
+                       RETURNING id, place_name, place_address, place_coordinates_lat, place_coordinates_lng,
+                                 category_display, category_slug, city_name, province_name, place_phone, place_token,
+                                 place_plate_number, place_postal_code, is_active, place_images, created_by_user_id""",
+                    (
+                        request.name,
+                        request.address,
+                        store_lat,
+                        store_lng,
+                        request.category,
+                        request.categorySlug or request.category.lower().replace(' ', '_'),
+                        city_name,
+                        province_name,
+                        request.phone,
+                        generate_place_token(),
+                        request.plateNumber,
+                        request.postalCode,
+                        request.isActive if request.isActive is not None else True,
+                        request.imageUrls or [],
+                        user["userId"],
+                        1,  # page_number - مقدار پیش‌فرض برای مغازه‌های دستی ثبت شده
+                        place_full_data_json  # place_full_data
+                    )
                 )
-            )
+                result = cur.fetchone()
+                if result:
+                    break
             
-            result = cur.fetchone()
             if not result:
                 conn.rollback()
-                raise HTTPException(status_code=500, detail="خطا در ثبت مغازه. نتیجه ثبت نشد.")
+                raise HTTPException(status_code=500, detail="خطا در تولید token یکتا")
             
+            add_image_refs(cur, request.imageUrls)
             conn.commit()
             
             return {
@@ -1645,7 +3161,6 @@ async def register_store(request: RegisterStoreRequest, user: dict = Depends(req
         raise
     except Exception as e:
         conn.rollback()
-        import traceback
         error_detail = f"{str(e)}\n{traceback.format_exc()}"
         print(f"[ERROR] DatabaseError: Error in register-store - Endpoint: /api/register-store")
         print(error_detail)
@@ -1653,40 +3168,901 @@ async def register_store(request: RegisterStoreRequest, user: dict = Depends(req
     finally:
         conn.close()
 
+# ==================== Storage Backends ====================
+
+# نوع ذخیره‌سازی فایل‌ها: local (پوشه uploads) یا s3 (S3 / MinIO)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# آپلود مستقیم کلاینت به storage (presign)؛ با false کلاینت از مسیر آپلود API استفاده می‌کند
+DIRECT_UPLOADS_ENABLED = os.getenv("DIRECT_UPLOADS_ENABLED", "true").lower() in ("1", "true", "yes")
+# کلید امضای URLهای آپلود مستقیم در backend محلی - باید در همه workerها یکسان باشد و
+# برای STORAGE_BACKEND=local با آپلود مستقیم فعال الزامی است (در startup بررسی می‌شود)
+STORAGE_SIGNING_SECRET = os.getenv("STORAGE_SIGNING_SECRET", "")
+STORAGE_PRESIGN_EXPIRES = int(os.getenv("STORAGE_PRESIGN_EXPIRES", "900"))
+
+IMAGE_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/heic": "heic",
+}
+
+class LocalStorage:
+    """ذخیره فایل‌ها روی دیسک محلی (سرو شده از طریق /uploads)"""
+    name = "local"
+
+    def __init__(self, root: Path, base_url: str = "/uploads"):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def url_for(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def key_for_url(self, url: str) -> Optional[str]:
+        prefix = self.base_url + "/"
+        return url[len(prefix):] if url and url.startswith(prefix) else None
+
+    def stat(self, key: str) -> Optional[int]:
+        try:
+            return (self.root / key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def save_file(self, local_path: Path, key: str, content_type: Optional[str] = None):
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(local_path, target)
+
+    def delete(self, key: str) -> bool:
+        try:
+            (self.root / key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def open_local(self, key: str):
+        yield self.root / key
+
+    def presign_upload(self, key: str, content_type: str, max_bytes: int) -> dict:
+        expires = int(time.time()) + STORAGE_PRESIGN_EXPIRES
+        return {
+            "method": "POST",
+            "url": "/api/storage/local-upload",
+            "fields": {
+                "key": key,
+                "expires": str(expires),
+                "signature": sign_storage_upload(key, expires),
+            },
+        }
+
+class S3Storage:
+    """ذخیره فایل‌ها در S3 یا سرویس سازگار با S3 (مثل MinIO)"""
+    name = "s3"
+
+    def __init__(self):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("برای STORAGE_BACKEND=s3 نصب boto3 لازم است")
+
+        self.bucket = os.getenv("S3_BUCKET", "marketvisit")
+        endpoint_url = os.getenv("S3_ENDPOINT_URL")  # مثلاً http://localhost:9000 برای MinIO
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=os.getenv("S3_ACCESS_KEY"),
+            aws_secret_access_key=os.getenv("S3_SECRET_KEY"),
+            region_name=os.getenv("S3_REGION", "us-east-1"),
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        )
+        default_public_url = f"{endpoint_url.rstrip('/')}/{self.bucket}" if endpoint_url else f"https://{self.bucket}.s3.amazonaws.com"
+        self.base_url = os.getenv("S3_PUBLIC_URL", default_public_url).rstrip("/")
+
+    def url_for(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def key_for_url(self, url: str) -> Optional[str]:
+        prefix = self.base_url + "/"
+        return url[len(prefix):] if url and url.startswith(prefix) else None
+
+    def stat(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def save_file(self, local_path: Path, key: str, content_type: Optional[str] = None):
+        extra_args = {"CacheControl": "public, max-age=31536000, immutable"}
+        if content_type:
+            extra_args["ContentType"] = content_type
+        self.client.upload_file(str(local_path), self.bucket, key, ExtraArgs=extra_args)
+        Path(local_path).unlink(missing_ok=True)
+
+    def delete(self, key: str) -> bool:
+        # delete_object برای کلید ناموجود هم موفق است؛ وجود فایل قبل از حذف بررسی می‌شود
+        if self.stat(key) is None:
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return True
+
+    @contextmanager
+    def open_local(self, key: str):
+        fd, tmp_name = tempfile.mkstemp(suffix=Path(key).suffix)
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, key, tmp_name)
+            yield Path(tmp_name)
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+
+    def presign_upload(self, key: str, content_type: str, max_bytes: int) -> dict:
+        post = self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=key,
+            Fields={"Content-Type": content_type},
+            Conditions=[
+                {"Content-Type": content_type},
+                ["content-length-range", 1, max_bytes],
+            ],
+            ExpiresIn=STORAGE_PRESIGN_EXPIRES,
+        )
+        return {"method": "POST", "url": post["url"], "fields": post["fields"]}
+
+@app.on_event("startup")
+async def check_storage_signing_secret():
+    """بدون STORAGE_SIGNING_SECRET امضای آپلود مستقیم محلی قابل جعل است؛ برنامه اجرا نمی‌شود"""
+    if STORAGE_BACKEND == "local" and DIRECT_UPLOADS_ENABLED and not STORAGE_SIGNING_SECRET:
+        raise RuntimeError(
+            "STORAGE_SIGNING_SECRET is required when STORAGE_BACKEND=local and DIRECT_UPLOADS_ENABLED is true"
+        )
+
+_storage = {}
+
+def get_storage():
+    """دریافت backend ذخیره‌سازی (برای هر process یک نمونه ساخته می‌شود)"""
+    pid = os.getpid()
+    if pid not in _storage:
+        if STORAGE_BACKEND == "s3":
+            _storage[pid] = S3Storage()
+        else:
+            _storage[pid] = LocalStorage(uploads_dir)
+    return _storage[pid]
+
+def sign_storage_upload(key: str, expires: int) -> str:
+    """امضای HMAC برای آپلود مستقیم در backend محلی"""
+    return hmac.new(STORAGE_SIGNING_SECRET.encode(), f"{key}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def hash_stored_object(key: str) -> str:
+    """محاسبه sha256 فایل ذخیره‌شده در storage"""
+    hasher = hashlib.sha256()
+    with get_storage().open_local(key) as path:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+def image_storage_key(sha256: str, content_type: str, prefix: str = "comments") -> str:
+    """کلید ذخیره‌سازی عکس بر اساس hash محتوا"""
+    return f"{prefix}/{sha256}.{IMAGE_EXTENSIONS[content_type]}"
+
+# ==================== Image Pipeline (Thumbnails) ====================
+
+# اندازه‌ها و کیفیت نسخه‌های کوچک‌شده عکس‌ها
+IMAGE_VARIANTS = {
+    "thumb": {"max_size": int(os.getenv("IMAGE_THUMB_SIZE", "256")), "quality": 75},
+    "medium": {"max_size": int(os.getenv("IMAGE_MEDIUM_SIZE", "1024")), "quality": 82},
+}
+IMAGE_PIPELINE_WORKERS = int(os.getenv("IMAGE_PIPELINE_WORKERS", "2"))
+IMAGE_PIPELINE_MAX_ATTEMPTS = int(os.getenv("IMAGE_PIPELINE_MAX_ATTEMPTS", "3"))
+
+# آمار پردازش عکس‌ها
+IMAGE_PIPELINE_STATS = {
+    "queued": 0,
+    "inFlight": 0,
+    "succeeded": 0,
+    "failed": 0,
+    "retried": 0,
+    "totalProcessingMs": 0.0,
+    "maxProcessingMs": 0.0,
+}
+
+_image_pool = None
+_image_jobs = set()
+
+def variant_key(key: str, variant: str) -> str:
+    """کلید ذخیره‌سازی نسخه کوچک‌شده یک عکس"""
+    return f"{key.rsplit('.', 1)[0]}_{variant}.jpg"
+
+def image_variant_urls(url: Optional[str], available: Optional[List[str]] = None) -> dict:
+    """ساخت URL نسخه‌های یک عکس آپلود شده
+
+    فقط نسخه‌هایی که ساخت آن‌ها ثبت شده (ستون variants در image_blobs) برگردانده می‌شوند و
+    کلاینت برای نسخه‌های ناموجود از original استفاده می‌کند.
+    """
+    if not url:
+        return {}
+    variants = {"original": url}
+    storage = get_storage()
+    key = storage.key_for_url(url)
+    if key:
+        for name in IMAGE_VARIANTS:
+            if available and name in available:
+                variants[name] = storage.url_for(variant_key(key, name))
+    return variants
+
+def load_image_variants(cur, urls) -> dict:
+    """نسخه‌های ساخته‌شده برای مجموعه‌ای از URLها با یک کوئری (cursor از نوع RealDictCursor) - {url: [نام نسخه‌ها]}"""
+    urls = list({url for url in urls if url})
+    if not urls:
+        return {}
+    cur.execute("SELECT url, variants FROM image_blobs WHERE url = ANY(%s)", (urls,), name="image_blobs.variants")
+    return {row["url"]: row["variants"] or [] for row in cur.fetchall()}
+
+def record_image_variants(key: str, variants: List[str], status: str):
+    """ثبت نتیجه ساخت نسخه‌های یک عکس در image_blobs"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE image_blobs SET variants = %s, variants_status = %s WHERE url = %s",
+                (variants, status, get_storage().url_for(key))
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _render_image_variants(key: str, variants: dict) -> dict:
+    """ساخت نسخه‌های کوچک‌شده عکس (در process pool اجرا می‌شود)"""
+    from PIL import Image, ImageOps
+
+    started = time.perf_counter()
+    storage = get_storage()
+    with storage.open_local(key) as src:
+        with Image.open(src) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            for name, spec in variants.items():
+                resized = img.copy()
+                resized.thumbnail((spec["max_size"], spec["max_size"]))
+                fd, tmp_name = tempfile.mkstemp(suffix=".jpg", dir=UPLOAD_TMP_DIR)
+                os.close(fd)
+                try:
+                    resized.save(tmp_name, "JPEG", quality=spec["quality"], optimize=True, progressive=True)
+                    storage.save_file(Path(tmp_name), variant_key(key, name), "image/jpeg")
+                finally:
+                    Path(tmp_name).unlink(missing_ok=True)
+    return {"durationMs": (time.perf_counter() - started) * 1000, "variants": list(variants)}
+
+def get_image_pool():
+    """ایجاد process pool برای پردازش عکس‌ها (lazy)"""
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(max_workers=IMAGE_PIPELINE_WORKERS)
+    return _image_pool
+
+async def process_image_job(key: str):
+    """اجرای ساخت نسخه‌های عکس با تلاش مجدد در صورت خطا"""
+
+    loop = asyncio.get_running_loop()
+    IMAGE_PIPELINE_STATS["inFlight"] += 1
+    try:
+        for attempt in range(1, IMAGE_PIPELINE_MAX_ATTEMPTS + 1):
+            try:
+                result = await loop.run_in_executor(
+                    get_image_pool(), _render_image_variants, key, IMAGE_VARIANTS
+                )
+                duration_ms = result["durationMs"]
+                await run_in_threadpool(record_image_variants, key, result["variants"], "ready")
+                IMAGE_PIPELINE_STATS["succeeded"] += 1
+                IMAGE_PIPELINE_STATS["totalProcessingMs"] += duration_ms
+                IMAGE_PIPELINE_STATS["maxProcessingMs"] = max(IMAGE_PIPELINE_STATS["maxProcessingMs"], duration_ms)
+                return
+            except Exception as e:
+                if attempt >= IMAGE_PIPELINE_MAX_ATTEMPTS:
+                    IMAGE_PIPELINE_STATS["failed"] += 1
+                    print(f"[ERROR] ImagePipelineError: {type(e).__name__}: {e} - Key: {key}")
+                    try:
+                        await run_in_threadpool(record_image_variants, key, [], "failed")
+                    except Exception as record_error:
+                        print(f"[ERROR] Could not record variant failure for {key}: {record_error}")
+                    return
+                IMAGE_PIPELINE_STATS["retried"] += 1
+                await asyncio.sleep(2 ** (attempt - 1))
+    finally:
+        IMAGE_PIPELINE_STATS["inFlight"] -= 1
+
+def enqueue_image_variants(key: str):
+    """ثبت کار ساخت thumbnail برای یک عکس در پس‌زمینه"""
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return
+    IMAGE_PIPELINE_STATS["queued"] += 1
+    task = asyncio.get_running_loop().create_task(process_image_job(key))
+    _image_jobs.add(task)
+    task.add_done_callback(_image_jobs.discard)
+
+@app.on_event("shutdown")
+async def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+@app.get("/api/image-pipeline/stats")
+async def get_image_pipeline_stats(user: dict = Depends(require_auth)):
+    """آمار پردازش عکس‌ها (تعداد کارها، خطاها و زمان پردازش)"""
+    succeeded = IMAGE_PIPELINE_STATS["succeeded"]
+    return {
+        "success": True,
+        "stats": {
+            **IMAGE_PIPELINE_STATS,
+            "pending": len(_image_jobs),
+            "avgProcessingMs": round(IMAGE_PIPELINE_STATS["totalProcessingMs"] / succeeded, 2) if succeeded else None,
+        },
+    }
+
 # ==================== Store Comments Endpoints ====================
 
+def sniff_image_type(header: bytes) -> Optional[tuple]:
+    """تشخیص نوع عکس از روی بایت‌های ابتدای فایل - (پسوند, content-type) یا None"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return ("jpg", "image/jpeg")
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ("png", "image/png")
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return ("gif", "image/gif")
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ("webp", "image/webp")
+    if header[4:8] == b"ftyp" and header[8:12] in (b"heic", b"heix", b"heif", b"mif1", b"msf1"):
+        return ("heic", "image/heic")
+    return None
+
+def _write_chunk(buffer, hasher, chunk: bytes):
+    """نوشتن یک تکه روی دیسک و به‌روزرسانی hash (در threadpool اجرا می‌شود)"""
+    hasher.update(chunk)
+    buffer.write(chunk)
+
+async def save_upload_streaming(file: UploadFile, prefix: str = "comments") -> dict:
+    """ذخیره تکه‌تکه فایل آپلودی روی دیسک بدون خواندن کل فایل در حافظه
+
+    نوشتن روی دیسک و محاسبه sha256 در threadpool انجام می‌شود تا event loop بلاک نشود.
+    فایل فقط در یک فایل موقت نوشته می‌شود؛ کلید نهایی بر اساس hash محتواست و
+    انتقال به storage با finalize_upload انجام می‌شود.
+    """
+    declared_size = getattr(file, "size", None)
+    if declared_size is not None and declared_size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"حجم فایل بیش از حد مجاز است ({UPLOAD_MAX_BYTES // (1024 * 1024)}MB)")
+
+    tmp_path = UPLOAD_TMP_DIR / f"{uuid.uuid4().hex}.part"
+    buffer = await run_in_threadpool(open, tmp_path, "wb")
+    hasher = hashlib.sha256()
+    size = 0
+    image_type = None
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if image_type is None:
+                image_type = sniff_image_type(chunk[:16])
+                if image_type is None:
+                    raise HTTPException(status_code=415, detail="فرمت فایل پشتیبانی نمی‌شود. فقط عکس (JPEG, PNG, GIF, WebP, HEIC) مجاز است")
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"حجم فایل بیش از حد مجاز است ({UPLOAD_MAX_BYTES // (1024 * 1024)}MB)")
+            await run_in_threadpool(_write_chunk, buffer, hasher, chunk)
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail="فایل خالی است")
+
+        await run_in_threadpool(buffer.close)
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+        raise
+
+    content_type = image_type[1]
+    digest = hasher.hexdigest()
+    key = image_storage_key(digest, content_type, prefix)
+    return {
+        "sha256": digest,
+        "key": key,
+        "filename": key.rsplit("/", 1)[-1],
+        "tmpPath": tmp_path,
+        "size": size,
+        "contentType": content_type,
+    }
+
+def finalize_upload(saved: dict) -> bool:
+    """انتقال فایل موقت به storage - اگر همان محتوا قبلاً ذخیره شده، True برمی‌گرداند"""
+    storage = get_storage()
+    if storage.exists(saved["key"]):
+        saved["tmpPath"].unlink(missing_ok=True)
+        return True
+    storage.save_file(saved["tmpPath"], saved["key"], saved["contentType"])
+    return False
+
+def discard_upload(saved: dict):
+    """حذف فایل موقت آپلودی که ذخیره نهایی نشده"""
+    saved["tmpPath"].unlink(missing_ok=True)
+
+def register_image_blob(cur, saved: dict, url: str, user_id: Optional[int], status: str = "stored"):
+    """ثبت یا تمدید رکورد blob عکس در جدول image_blobs"""
+    cur.execute(
+        """INSERT INTO image_blobs (sha256, url, storage_key, size_bytes, content_type, status, created_by, created_at, last_uploaded_at)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+           ON CONFLICT (sha256) DO UPDATE SET
+               last_uploaded_at = CURRENT_TIMESTAMP,
+               status = CASE WHEN image_blobs.status = 'stored' THEN 'stored' ELSE EXCLUDED.status END,
+               size_bytes = CASE WHEN image_blobs.status = 'stored' THEN image_blobs.size_bytes ELSE EXCLUDED.size_bytes END
+           RETURNING status, variants""",
+        (saved["sha256"], url, saved["key"], saved["size"], saved["contentType"], status, user_id)
+    )
+    return cur.fetchone()
+
+def add_image_refs(cur, image_urls: Optional[List[str]]):
+    """افزایش شمارنده ارجاع blobهایی که در یک نظر/ویزیت/مغازه استفاده شده‌اند"""
+    if not image_urls:
+        return
+    cur.execute(
+        """UPDATE image_blobs
+           SET ref_count = ref_count + 1, last_referenced_at = CURRENT_TIMESTAMP
+           WHERE url = ANY(%s)""",
+        (list(image_urls),)
+    )
+
 @app.post("/api/upload-comment-image")
 async def upload_comment_image(file: UploadFile = File(...), user: dict = Depends(require_auth)):
-    """آپلود عکس برای نظر"""
-    import os
-    import uuid
-    from pathlib import Path
-    
-    # ایجاد پوشه uploads اگر وجود نداشته باشد
-    upload_dir = Path("uploads/comments")
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    
-    # تولید نام یکتا برای فایل
-    file_ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    unique_filename = f"{uuid.uuid4()}.{file_ext}"
-    file_path = upload_dir / unique_filename
-    
+    """آپلود عکس برای نظر (ذخیره بر اساس hash محتوا، بدون ذخیره تکراری)"""
     try:
-        # ذخیره فایل
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # URL فایل (در production باید از CDN یا storage service استفاده شود)
-        file_url = f"/uploads/comments/{unique_filename}"
-        
+        saved = await save_upload_streaming(file, "comments")
+        file_url = get_storage().url_for(saved["key"])
+        deduplicated = None
+
+        conn = get_db_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                blob = register_image_blob(cur, saved, file_url, user["userId"])
+                # فایل قبل از commit در جای نهایی قرار می‌گیرد تا با GC همزمان تداخل نکند
+                deduplicated = await run_in_threadpool(finalize_upload, saved)
+            conn.commit()
+        except Exception:
+            # فایلی که همین درخواست ذخیره کرده بدون رکورد blob یتیم می‌شود
+            if deduplicated is False:
+                await run_in_threadpool(get_storage().delete, saved["key"])
+            conn.rollback()
+            await run_in_threadpool(discard_upload, saved)
+            raise
+        finally:
+            conn.close()
+
+        # ساخت thumbnail و نسخه متوسط در پس‌زمینه (برای فایل تکراری قبلاً ساخته شده)
+        if not deduplicated:
+            enqueue_image_variants(saved["key"])
+
         return {
             "success": True,
             "url": file_url,
-            "filename": unique_filename
+            "filename": saved["filename"],
+            "sha256": saved["sha256"],
+            "size": saved["size"],
+            "contentType": saved["contentType"],
+            "deduplicated": deduplicated,
+            "variants": image_variant_urls(file_url, blob["variants"]),
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
+    finally:
+        await file.close()
+
+async def _save_batch_file(file: UploadFile, semaphore) -> dict:
+    """ذخیره یک فایل از آپلود چندتایی - خطا به جای exception در نتیجه برگردانده می‌شود"""
+    async with semaphore:
+        try:
+            saved = await save_upload_streaming(file, "comments")
+            return {"filename": file.filename, "saved": saved}
+        except HTTPException as e:
+            return {"filename": file.filename, "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            return {"filename": file.filename, "status": 500, "error": str(e)}
+        finally:
+            await file.close()
+
+@app.post("/api/upload-images")
+async def upload_images(
+    files: List[UploadFile] = File(...),
+    commentId: Optional[int] = Form(None),
+    visitId: Optional[int] = Form(None),
+    user: dict = Depends(require_auth),
+):
+    """آپلود چند عکس در یک درخواست با نتیجه جداگانه برای هر فایل
+
+    در صورت ارسال commentId یا visitId، URL عکس‌های موفق مستقیماً به نظر یا ویزیت اضافه می‌شود.
+    """
+
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"حداکثر {UPLOAD_BATCH_MAX_FILES} فایل در هر درخواست مجاز است")
+    if commentId and visitId:
+        raise HTTPException(status_code=400, detail="فقط یکی از commentId یا visitId را ارسال کنید")
+
+    semaphore = asyncio.Semaphore(UPLOAD_BATCH_CONCURRENCY)
+    results = await asyncio.gather(*[_save_batch_file(f, semaphore) for f in files])
+
+    # فایل‌های تکراری داخل همین درخواست فقط یک بار ذخیره و پردازش می‌شوند
+    saved_results = []
+    duplicates = []
+    by_sha256 = {}
+    for result in results:
+        if "saved" not in result:
+            continue
+        first = by_sha256.get(result["saved"]["sha256"])
+        if first is None:
+            by_sha256[result["saved"]["sha256"]] = result
+            saved_results.append(result)
+        else:
+            await run_in_threadpool(discard_upload, result["saved"])
+            duplicates.append((result, first))
+
+    storage = get_storage()
+    attached = None
+    stored_keys = []
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # مقصد اتصال قبل از انتقال فایل‌ها به storage بررسی می‌شود
+            table = "store_user_comments" if commentId else "store_visit_data"
+            if saved_results and (commentId or visitId):
+                cur.execute(
+                    f"SELECT id FROM {table} WHERE id = %s AND user_id = %s FOR UPDATE",
+                    (commentId or visitId, user["userId"])
+                )
+                if not cur.fetchone():
+                    raise HTTPException(status_code=404, detail="نظر یا ویزیت یافت نشد یا متعلق به شما نیست")
+
+            for result in saved_results:
+                saved = result["saved"]
+                result["url"] = storage.url_for(saved["key"])
+                result["variants"] = register_image_blob(cur, saved, result["url"], user["userId"])["variants"]
+
+            # فایل‌ها قبل از commit در جای نهایی قرار می‌گیرند تا با GC همزمان تداخل نکنند
+            deduplicated = await asyncio.gather(*[
+                run_in_threadpool(finalize_upload, r["saved"]) for r in saved_results
+            ], return_exceptions=True)
+            for result, is_duplicate in zip(saved_results, deduplicated):
+                result["deduplicated"] = is_duplicate
+                if is_duplicate is False:
+                    stored_keys.append(result["saved"]["key"])
+            errors = [e for e in deduplicated if isinstance(e, BaseException)]
+            if errors:
+                raise errors[0]
+
+            urls = [r["url"] for r in saved_results]
+            if urls and (commentId or visitId):
+                cur.execute(
+                    f"""UPDATE {table}
+                        SET image_urls = COALESCE(image_urls, ARRAY[]::TEXT[]) || %s::TEXT[],
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = %s AND user_id = %s
+                        RETURNING id, image_urls""",
+                    (urls, commentId or visitId, user["userId"])
+                )
+                attached = cur.fetchone()
+                add_image_refs(cur, urls)
+        conn.commit()
+    except Exception as e:
+        # فایل‌هایی که همین درخواست ذخیره کرده قبل از rollback حذف می‌شوند (قفل ردیف blob هنوز برقرار است)
+        for key in stored_keys:
+            try:
+                await run_in_threadpool(storage.delete, key)
+            except Exception as delete_error:
+                print(f"[ERROR] Could not remove stored upload {key}: {delete_error}")
+        conn.rollback()
+        for result in saved_results:
+            await run_in_threadpool(discard_upload, result["saved"])
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Error uploading files: {str(e)}")
+    finally:
+        conn.close()
+
+    for result, first in duplicates:
+        result.update(url=first["url"], variants=first["variants"], deduplicated=True)
+
+    items = []
+    for result in results:
+        saved = result.pop("saved", None)
+        if saved:
+            if not result["deduplicated"]:
+                enqueue_image_variants(saved["key"])
+            items.append({
+                "filename": result["filename"],
+                "success": True,
+                "url": result["url"],
+                "sha256": saved["sha256"],
+                "size": saved["size"],
+                "contentType": saved["contentType"],
+                "deduplicated": result["deduplicated"],
+                "variants": image_variant_urls(result["url"], result["variants"]),
+            })
+        else:
+            items.append({"filename": result["filename"], "success": False, "status": result["status"], "error": result["error"]})
+
+    uploaded = sum(1 for item in items if item["success"])
+    return {
+        "success": uploaded > 0,
+        "uploaded": uploaded,
+        "failed": len(items) - uploaded,
+        "results": items,
+        "attachedTo": attached and {
+            "type": "comment" if commentId else "visit",
+            "id": attached["id"],
+            "imageUrls": attached["image_urls"] or [],
+        },
+    }
+
+@app.get("/api/image-blobs/lookup")
+async def lookup_image_blob(sha256: str, user: dict = Depends(require_auth)):
+    """بررسی وجود عکس با hash مشخص تا کلاینت بدون آپلود دوباره از URL موجود استفاده کند"""
+    digest = normalize_sha256(sha256)
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # تمدید last_uploaded_at تا GC این blob را قبل از استفاده حذف نکند
+            cur.execute(
+                """UPDATE image_blobs SET last_uploaded_at = CURRENT_TIMESTAMP
+                   WHERE sha256 = %s AND status = 'stored'
+                   RETURNING url, size_bytes, content_type, variants""",
+                (digest,)
+            )
+            blob = cur.fetchone()
+            conn.commit()
+
+            if not blob:
+                return {"success": True, "exists": False}
+
+            return {
+                "success": True,
+                "exists": True,
+                "url": blob["url"],
+                "size": blob["size_bytes"],
+                "contentType": blob["content_type"],
+                "variants": image_variant_urls(blob["url"], blob["variants"]),
+            }
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
+class PresignUploadRequest(BaseModel):
+    sha256: str
+    size: int
+    contentType: str
+
+class CompleteUploadRequest(BaseModel):
+    sha256: str
+
+def normalize_sha256(value: str) -> str:
+    """اعتبارسنجی و نرمال‌سازی hash هگز sha256"""
+    digest = (value or "").strip().lower()
+    if len(digest) != 64 or any(ch not in "0123456789abcdef" for ch in digest):
+        raise HTTPException(status_code=400, detail="sha256 نامعتبر است")
+    return digest
+
+@app.post("/api/uploads/presign")
+async def presign_upload(request: PresignUploadRequest, user: dict = Depends(require_auth)):
+    """صدور URL آپلود مستقیم به storage (کلاینت فایل را مستقیم آپلود می‌کند، نه از طریق API)"""
+    if not DIRECT_UPLOADS_ENABLED:
+        raise HTTPException(status_code=404, detail="آپلود مستقیم غیرفعال است")
+    digest = normalize_sha256(request.sha256)
+    if request.contentType not in IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=415, detail="فرمت فایل پشتیبانی نمی‌شود. فقط عکس (JPEG, PNG, GIF, WebP, HEIC) مجاز است")
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="فایل خالی است")
+    if request.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"حجم فایل بیش از حد مجاز است ({UPLOAD_MAX_BYTES // (1024 * 1024)}MB)")
+
+    storage = get_storage()
+    key = image_storage_key(digest, request.contentType)
+    url = storage.url_for(key)
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            blob = register_image_blob(
+                cur,
+                {"sha256": digest, "key": key, "size": request.size, "contentType": request.contentType},
+                url,
+                user["userId"],
+                status="pending",
+            )
+            conn.commit()
+
+            # همین محتوا قبلاً ذخیره شده - نیازی به آپلود نیست
+            if blob and blob["status"] == "stored":
+                return {
+                    "success": True,
+                    "exists": True,
+                    "url": url,
+                    "variants": image_variant_urls(url, blob["variants"]),
+                }
+
+            return {
+                "success": True,
+                "exists": False,
+                "key": key,
+                "url": url,
+                "upload": storage.presign_upload(key, request.contentType, request.size),
+                "expiresIn": STORAGE_PRESIGN_EXPIRES,
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
+@app.post("/api/uploads/complete")
+async def complete_upload(request: CompleteUploadRequest, user: dict = Depends(require_auth)):
+    """تایید پایان آپلود مستقیم و ثبت متادیتای عکس"""
+    digest = normalize_sha256(request.sha256)
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT url, storage_key, size_bytes, status, variants FROM image_blobs WHERE sha256 = %s",
+                (digest,)
+            )
+            blob = cur.fetchone()
+            if not blob:
+                raise HTTPException(status_code=404, detail="آپلودی با این hash ثبت نشده است")
+
+            if blob["status"] != "stored":
+                storage = get_storage()
+                stored_size = await run_in_threadpool(storage.stat, blob["storage_key"])
+                if stored_size is None:
+                    raise HTTPException(status_code=409, detail="فایل هنوز در storage آپلود نشده است")
+                if stored_size != blob["size_bytes"]:
+                    await run_in_threadpool(storage.delete, blob["storage_key"])
+                    raise HTTPException(status_code=400, detail="حجم فایل آپلود شده با مقدار اعلام‌شده مطابقت ندارد")
+                # blob فقط پس از تطابق hash محتوا stored می‌شود تا dedup محتوای نادرست تحویل ندهد
+                if await run_in_threadpool(hash_stored_object, blob["storage_key"]) != digest:
+                    await run_in_threadpool(storage.delete, blob["storage_key"])
+                    raise HTTPException(status_code=400, detail="محتوای فایل با hash اعلام‌شده مطابقت ندارد")
+
+                cur.execute(
+                    """UPDATE image_blobs SET status = 'stored', last_uploaded_at = CURRENT_TIMESTAMP
+                       WHERE sha256 = %s""",
+                    (digest,)
+                )
+                conn.commit()
+
+                # ساخت thumbnail در پس‌زمینه
+                enqueue_image_variants(blob["storage_key"])
+
+            return {
+                "success": True,
+                "url": blob["url"],
+                "sha256": digest,
+                "size": blob["size_bytes"],
+                "variants": image_variant_urls(blob["url"], blob["variants"]),
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
+@app.post("/api/storage/local-upload")
+async def local_storage_upload(
+    key: str = Form(...),
+    expires: int = Form(...),
+    signature: str = Form(...),
+    file: UploadFile = File(...),
+):
+    """دریافت آپلود مستقیم برای backend محلی (معادل presigned POST در S3)"""
+
+    try:
+        if STORAGE_BACKEND != "local" or not DIRECT_UPLOADS_ENABLED:
+            raise HTTPException(status_code=404, detail="Not found")
+        if expires < int(time.time()):
+            raise HTTPException(status_code=403, detail="لینک آپلود منقضی شده است")
+        if not hmac.compare_digest(signature, sign_storage_upload(key, expires)):
+            raise HTTPException(status_code=403, detail="امضای آپلود نامعتبر است")
+
+        prefix, _, filename = key.rpartition("/")
+        saved = await save_upload_streaming(file, prefix)
+        if saved["key"] != key:
+            await run_in_threadpool(discard_upload, saved)
+            raise HTTPException(status_code=400, detail="محتوای فایل با hash اعلام‌شده مطابقت ندارد")
+
+        await run_in_threadpool(finalize_upload, saved)
+        return {"success": True, "key": key}
+    finally:
+        await file.close()
+
+def collect_image_garbage(grace_hours: int = 24, dry_run: bool = False) -> dict:
+    """همگام‌سازی شمارنده ارجاع blobها و حذف عکس‌هایی که هیچ نظر، ویزیت یا مغازه‌ای به آن‌ها ارجاع نمی‌دهد"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # محاسبه دقیق تعداد ارجاع‌ها (با استفاده از ایندکس‌های GIN روی آرایه URLها)
+            cur.execute("""
+                UPDATE image_blobs b
+                SET ref_count = (
+                    (SELECT COUNT(*) FROM store_user_comments c WHERE c.image_urls @> ARRAY[b.url]::TEXT[]) +
+                    (SELECT COUNT(*) FROM store_visit_data v WHERE v.image_urls @> ARRAY[b.url]::TEXT[]) +
+                    (SELECT COUNT(*) FROM city_categories cc WHERE cc.place_images @> ARRAY[b.url]::TEXT[])
+                )
+            """)
+            synced = cur.rowcount
+
+            query = """
+                FROM image_blobs
+                WHERE (ref_count = 0 OR status = 'pending')
+                AND COALESCE(last_uploaded_at, created_at) < CURRENT_TIMESTAMP - make_interval(hours => %s)
+            """
+            if dry_run:
+                cur.execute("SELECT sha256, url, storage_key, size_bytes " + query, (grace_hours,))
+            else:
+                cur.execute("DELETE " + query + " RETURNING sha256, url, storage_key, size_bytes", (grace_hours,))
+            orphans = cur.fetchall()
+
+            removed_files = 0
+            if not dry_run:
+                # حذف فایل‌ها قبل از commit تا آپلود همزمان همان محتوا فایل را دوباره بنویسد
+                storage = get_storage()
+                for blob in orphans:
+                    key = blob["storage_key"] or storage.key_for_url(blob["url"])
+                    if not key:
+                        continue
+                    for object_key in [key] + [variant_key(key, name) for name in IMAGE_VARIANTS]:
+                        if storage.delete(object_key):
+                            removed_files += 1
+            conn.commit()
+
+            return {
+                "synced": synced,
+                "orphans": len(orphans),
+                "freedBytes": sum(blob["size_bytes"] or 0 for blob in orphans),
+                "removedFiles": removed_files,
+                "dryRun": dry_run,
+            }
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@app.post("/api/image-blobs/gc", dependencies=[Depends(require_admin)])
+async def run_image_gc(graceHours: int = 24, dryRun: bool = False):
+    """اجرای garbage collection عکس‌های بدون ارجاع"""
+    try:
+        result = await run_in_threadpool(collect_image_garbage, graceHours, dryRun)
+        return {"success": True, **result}
+    except Exception as e:
+        print(f"[ERROR] DatabaseError: {e} - Endpoint: /api/image-blobs/gc")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/store-comments")
 async def create_comment(request: CommentRequest, user: dict = Depends(require_auth)):
@@ -1702,6 +4078,26 @@ async def create_comment(request: CommentRequest, user: dict = Depends(require_a
                 (request.storeId, user["userId"], request.comment, request.rating, request.userLat, request.userLng, request.imageUrls or [])
             )
             result = cur.fetchone()
+            add_image_refs(cur, request.imageUrls)
+            
+            # به‌روزرسانی آمار تجمیعی نظرات مغازه
+            cur.execute(
+                """INSERT INTO store_comment_stats AS s
+                   (store_id, comment_count, rating_count, rating_sum, last_comment_at, updated_at)
+                   VALUES (%s, 1, %s, %s, %s, CURRENT_TIMESTAMP)
+                   ON CONFLICT (store_id) DO UPDATE SET
+                       comment_count = s.comment_count + 1,
+                       rating_count = s.rating_count + EXCLUDED.rating_count,
+                       rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+                       last_comment_at = GREATEST(s.last_comment_at, EXCLUDED.last_comment_at),
+                       updated_at = CURRENT_TIMESTAMP""",
+                (
+                    request.storeId,
+                    1 if request.rating is not None else 0,
+                    request.rating or 0,
+                    result["created_at"],
+                )
+            )
             conn.commit()
             
             return {
@@ -1721,24 +4117,76 @@ async def create_comment(request: CommentRequest, user: dict = Depends(require_a
     finally:
         conn.close()
 
+COMMENTS_PAGE_SIZE = 20
+COMMENTS_MAX_PAGE_SIZE = 100
+
+def encode_keyset_cursor(created_at: datetime, row_id: int) -> str:
+    """ساخت cursor صفحه بعد از (created_at, id) آخرین ردیف"""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_keyset_cursor(cursor: str) -> tuple:
+    """خواندن cursor صفحه‌بندی keyset"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor نامعتبر است")
+
+def format_comment_stats(row: Optional[dict]) -> dict:
+    """تبدیل ردیف store_comment_stats به خروجی API"""
+    if not row or row.get("comment_count") is None:
+        return {"commentCount": 0, "ratingCount": 0, "ratingSum": 0, "averageRating": None, "lastCommentAt": None}
+    rating_count = row["rating_count"] or 0
+    return {
+        "commentCount": row["comment_count"],
+        "ratingCount": rating_count,
+        "ratingSum": row["rating_sum"],
+        "averageRating": round(row["rating_sum"] / rating_count, 2) if rating_count else None,
+        "lastCommentAt": row["last_comment_at"].isoformat() if row["last_comment_at"] else None,
+    }
+
 @app.get("/api/store-comments")
-async def get_comments(storeId: int):
-    """دریافت نظرات یک مغازه"""
+async def get_comments(storeId: int, limit: int = COMMENTS_PAGE_SIZE, cursor: Optional[str] = None):
+    """دریافت نظرات یک مغازه (صفحه‌بندی keyset بر اساس created_at و id)"""
+    limit = max(1, min(limit, COMMENTS_MAX_PAGE_SIZE))
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """SELECT c.id, c.store_id, c.user_id, c.comment, c.rating, 
+            query = """SELECT c.id, c.store_id, c.user_id, c.comment, c.rating, 
                           c.user_latitude, c.user_longitude, c.image_urls, c.created_at, c.updated_at,
                           u.username, u.full_name
                    FROM store_user_comments c
                    LEFT JOIN users u ON c.user_id = u.id
-                   WHERE c.store_id = %s
-                   ORDER BY c.created_at DESC""",
-                (storeId,)
-            )
+                   WHERE c.store_id = %s"""
+            params = [storeId]
+            
+            if cursor:
+                cursor_created_at, cursor_id = decode_keyset_cursor(cursor)
+                query += " AND (c.created_at, c.id) < (%s, %s)"
+                params.extend([cursor_created_at, cursor_id])
+            
+            query += " ORDER BY c.created_at DESC, c.id DESC LIMIT %s"
+            params.append(limit + 1)
+            
+            cur.execute(query, params, name="comments.page")
             comments = cur.fetchall()
             
+            has_more = len(comments) > limit
+            comments = comments[:limit]
+            next_cursor = None
+            if has_more and comments[-1]["created_at"]:
+                next_cursor = encode_keyset_cursor(comments[-1]["created_at"], comments[-1]["id"])
+            
+            cur.execute(
+                "SELECT comment_count, rating_count, rating_sum, last_comment_at FROM store_comment_stats WHERE store_id = %s",
+                (storeId,),
+                name="comments.stats"
+            )
+            stats = format_comment_stats(cur.fetchone())
+            variants = load_image_variants(cur, [url for c in comments for url in (c.get("image_urls") or [])])
+            
             return {
                 "success": True,
                 "comments": [
@@ -1751,11 +4199,90 @@ async def get_comments(storeId: int):
                         "comment": c["comment"],
                         "rating": c["rating"],
                         "image_urls": c.get("image_urls") or [],
+                        "image_variants": [image_variant_urls(url, variants.get(url)) for url in (c.get("image_urls") or [])],
                         "created_at": c["created_at"].isoformat() if c["created_at"] else None,
                     }
                     for c in comments
                 ],
                 "count": len(comments),
+                "totalCount": stats["commentCount"],
+                "stats": stats,
+                "hasMore": has_more,
+                "nextCursor": next_cursor,
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
+class BatchCommentsRequest(BaseModel):
+    storeIds: List[int]
+    perStore: int = 3
+
+COMMENTS_BATCH_MAX_STORES = 200
+COMMENTS_BATCH_MAX_PER_STORE = 20
+
+@app.post("/api/store-comments/batch")
+async def get_comments_batch(request: BatchCommentsRequest):
+    """دریافت آخرین نظرات و آمار نظرات چند مغازه با یک کوئری (برای مغازه‌های روی نقشه)"""
+    store_ids = list(dict.fromkeys(request.storeIds))
+    if len(store_ids) > COMMENTS_BATCH_MAX_STORES:
+        raise HTTPException(status_code=400, detail=f"حداکثر {COMMENTS_BATCH_MAX_STORES} مغازه در هر درخواست مجاز است")
+    per_store = max(0, min(request.perStore, COMMENTS_BATCH_MAX_PER_STORE))
+    if not store_ids:
+        return {"success": True, "results": [], "count": 0}
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """SELECT s.store_id,
+                          scs.comment_count, scs.rating_count, scs.rating_sum, scs.last_comment_at,
+                          c.id, c.user_id, c.comment, c.rating, c.image_urls, c.created_at,
+                          u.username, u.full_name
+                   FROM unnest(%s::INTEGER[]) AS s(store_id)
+                   LEFT JOIN store_comment_stats scs ON scs.store_id = s.store_id
+                   LEFT JOIN LATERAL (
+                       SELECT id, user_id, comment, rating, image_urls, created_at
+                       FROM store_user_comments
+                       WHERE store_id = s.store_id
+                       ORDER BY created_at DESC, id DESC
+                       LIMIT %s
+                   ) c ON TRUE
+                   LEFT JOIN users u ON c.user_id = u.id
+                   ORDER BY s.store_id, c.created_at DESC, c.id DESC""",
+                (store_ids, per_store)
+            )
+            rows = cur.fetchall()
+            variants = load_image_variants(cur, [url for row in rows for url in (row["image_urls"] or [])])
+
+            results = {store_id: {"storeId": store_id, "comments": [], "stats": None} for store_id in store_ids}
+            for row in rows:
+                result = results[row["store_id"]]
+                if result["stats"] is None:
+                    result["stats"] = format_comment_stats(row)
+                if row["id"] is not None:
+                    result["comments"].append({
+                        "id": row["id"],
+                        "user_id": row["user_id"],
+                        "username": row["username"],
+                        "fullName": row["full_name"],
+                        "comment": row["comment"],
+                        "rating": row["rating"],
+                        "image_urls": row["image_urls"] or [],
+                        "image_variants": [image_variant_urls(url, variants.get(url)) for url in (row["image_urls"] or [])],
+                        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+                    })
+
+            return {
+                "success": True,
+                "results": [
+                    {**result, "count": result["stats"]["commentCount"] if result["stats"] else 0}
+                    for result in results.values()
+                ],
+                "count": len(results),
             }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1766,18 +4293,14 @@ async def get_comments(storeId: int):
 
 def generate_group_code() -> str:
     """تولید کد یکتا برای گروه"""
-    import time
-    import random
-    import string
     timestamp = int(time.time() * 1000)
     random_str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
     return f"GRP-{timestamp}-{random_str}"
 
+PLACE_TOKEN_MAX_ATTEMPTS = 5
+
 def generate_place_token() -> str:
     """تولید place_token یکتا برای مغازه"""
-    import time
-    import random
-    import string
     timestamp = int(time.time() * 1000)
     random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=12))
     return f"store_{timestamp}_{random_str}"
@@ -1973,31 +4496,35 @@ async def assign_stores(request: AssignStoreRequest, admin: dict = Depends(requi
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            
+            store_tokens = list(dict.fromkeys(t for t in request.storeTokens if t))
+            
+            # بررسی وجود همه tokenها با یک کوئری (ایندکس یکتای place_token)
+            cur.execute(
+                "SELECT place_token FROM city_categories WHERE place_token = ANY(%s)",
+                (store_tokens,)
+            )
+            existing_tokens = {row["place_token"] for row in cur.fetchall()}
+            missing_tokens = [t for t in store_tokens if t not in existing_tokens]
+            for store_token in missing_tokens:
+                print(f"Store token {store_token} not found")
+            
             assigned_stores = []
-            for store_token in request.storeTokens:
-                try:
-                    # بررسی وجود token در دیتابیس
-                    cur.execute("SELECT COUNT(*) as count FROM city_categories WHERE place_token = %s", (store_token,))
-                    token_result = cur.fetchone()
-                    if not token_result or token_result['count'] == 0:
-                        print(f"Store token {store_token} not found")
-                        continue
-                    
-                    cur.execute(
-                        """INSERT INTO assigned_stores 
-                           (user_id, store_token, assigned_date, notes, assigned_by, created_at, updated_at)
-                           VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                           ON CONFLICT (user_id, store_token, assigned_date) DO UPDATE
-                           SET notes = EXCLUDED.notes, updated_at = CURRENT_TIMESTAMP
-                           RETURNING id, user_id, store_token, assigned_date, status""",
-                        (request.userId, store_token, request.assignedDate, request.notes, admin["userId"])
-                    )
-                    result = cur.fetchone()
-                    if result:
-                        assigned_stores.append(dict(result))
-                except Exception as e:
-                    print(f"Error assigning store {store_token}: {e}")
-                    continue
+            valid_tokens = [t for t in store_tokens if t in existing_tokens]
+            if valid_tokens:
+                rows = execute_values(
+                    cur,
+                    """INSERT INTO assigned_stores 
+                       (user_id, store_token, assigned_date, notes, assigned_by, created_at, updated_at)
+                       VALUES %s
+                       ON CONFLICT (user_id, store_token, assigned_date) DO UPDATE
+                       SET notes = EXCLUDED.notes, updated_at = CURRENT_TIMESTAMP
+                       RETURNING id, user_id, store_token, assigned_date, status""",
+                    [(request.userId, t, request.assignedDate, request.notes, admin["userId"]) for t in valid_tokens],
+                    template="(%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+                    fetch=True,
+                )
+                assigned_stores = [dict(row) for row in rows]
             
             conn.commit()
             
@@ -2005,6 +4532,7 @@ async def assign_stores(request: AssignStoreRequest, admin: dict = Depends(requi
                 "success": True,
                 "message": f"{len(assigned_stores)} stores assigned successfully",
                 "assignedStores": assigned_stores,
+                "missingTokens": missing_tokens,
             }
     except Exception as e:
         conn.rollback()
@@ -2012,6 +4540,165 @@ async def assign_stores(request: AssignStoreRequest, admin: dict = Depends(requi
     finally:
         conn.close()
 
+def build_assigned_store_info(row: dict) -> dict:
+    """ساخت اطلاعات یک مغازه اختصاص داده شده از ردیف کوئری (اولویت با place_full_data و fallback به ستون‌های city_categories)"""
+    full_data = row.get("place_full_data")
+    
+    # اگر fullData موجود است، از آن استفاده کن
+    store_name = "نامشخص"
+    store_address = ""
+    store_lat = None
+    store_lng = None
+    category = ""
+    category_slug = None
+    city = ""
+    phone = None
+    rating = None
+    rating_count = None
+    description = None
+    website = None
+    email = None
+    price_range = None
+    
+    if full_data:
+        if isinstance(full_data, str):
+            try:
+                full_data = json.loads(full_data)
+            except:
+                full_data = None
+        
+        if full_data and isinstance(full_data, dict):
+            # استخراج name از fullData
+            store_name = full_data.get("name") or full_data.get("seo_details", {}).get("name") or "نامشخص"
+            
+            # استخراج آدرس از fields
+            fields = full_data.get("fields", [])
+            if fields:
+                address_field = next((f.get("value") for f in fields if f.get("type") == "text" and f.get("value")), None)
+                if address_field:
+                    store_address = address_field
+            
+            # استخراج مختصات از geometry
+            geometry = full_data.get("geometry", {})
+            if geometry and geometry.get("type") == "Point":
+                coordinates = geometry.get("coordinates", [])
+                if len(coordinates) >= 2:
+                    try:
+                        store_lng = float(coordinates[0]) if not isinstance(coordinates[0], dict) else None  # longitude first
+                        store_lat = float(coordinates[1]) if not isinstance(coordinates[1], dict) else None  # latitude second
+                    except (ValueError, TypeError):
+                        store_lng = None
+                        store_lat = None
+            
+            # استخراج سایر اطلاعات
+            category = full_data.get("category") or ""
+            phone = full_data.get("phone_link")
+            rating = full_data.get("rating")
+            if rating is not None and isinstance(rating, dict):
+                rating = None
+            if full_data.get("reviews"):
+                rating_count = full_data.get("reviews", {}).get("total", 0)
+                if isinstance(rating_count, dict):
+                    rating_count = None
+            description = full_data.get("description")
+            price_range = full_data.get("price_range")
+            
+            # استخراج category_slug از seo_details
+            seo_details = full_data.get("seo_details", {})
+            if seo_details:
+                url_title = seo_details.get("url_title", "")
+                # استخراج slug از url_title (مثلاً: "آجیل-و-شیرینی-سرای-آفاق-tehran-nei-iran-shahr_nuts-store")
+                if "_" in url_title:
+                    category_slug = url_title.split("_")[-1]
+            
+            # استخراج city از seo_details
+            if seo_details:
+                schemas = seo_details.get("schemas", [])
+                if schemas and len(schemas) > 0:
+                    geo = schemas[0].get("geo", {})
+                    if geo:
+                        address_locality = geo.get("addressLocality")
+                        if address_locality:
+                            city = address_locality
+    
+    # اگر هنوز اطلاعات نداریم، از row استفاده کن (fallback)
+    if store_name == "نامشخص":
+        store_name = row.get("storeName") or row.get("place_name") or "نامشخص"
+    if not store_address:
+        store_address = row.get("storeAddress") or row.get("place_address") or ""
+    if not store_lat:
+        lat_val = row.get("storeLat") or row.get("place_coordinates_lat")
+        if lat_val is not None and not isinstance(lat_val, dict):
+            try:
+                store_lat = float(lat_val)
+            except (ValueError, TypeError):
+                store_lat = None
+    if not store_lng:
+        lng_val = row.get("storeLng") or row.get("place_coordinates_lng")
+        if lng_val is not None and not isinstance(lng_val, dict):
+            try:
+                store_lng = float(lng_val)
+            except (ValueError, TypeError):
+                store_lng = None
+    if not category:
+        category = row.get("category") or row.get("category_display") or ""
+    if not category_slug:
+        category_slug = row.get("category_slug")
+    if not city:
+        city = row.get("city") or row.get("city_name") or ""
+    if not phone:
+        phone = row.get("place_phone")
+    if rating is None:
+        rating_val = row.get("place_rating")
+        if rating_val is not None and not isinstance(rating_val, dict):
+            try:
+                rating = float(rating_val)
+            except (ValueError, TypeError):
+                rating = None
+    if rating_count is None:
+        count_val = row.get("place_rating_count")
+        if count_val is not None and not isinstance(count_val, dict):
+            try:
+                rating_count = int(count_val)
+            except (ValueError, TypeError):
+                rating_count = None
+    if not description:
+        description = row.get("place_description")
+    if not website:
+        website = row.get("place_website")
+    if not email:
+        email = row.get("place_email")
+    if not price_range:
+        price_range = row.get("place_price_range")
+    
+    return {
+        "id": row["id"],
+        "userId": row["user_id"],
+        "storeToken": row["store_token"],
+        "assignedDate": to_jalali_date(row["assigned_date"]),
+        "visitDate": to_jalali_date(row["visit_date"]) if row["visit_date"] else None,
+        "status": row["status"],
+        "notes": row["notes"],
+        "storeName": store_name,
+        "storeAddress": store_address,
+        "storeLat": store_lat if isinstance(store_lat, (int, float)) else None,
+        "storeLng": store_lng if isinstance(store_lng, (int, float)) else None,
+        "category": category,
+        "categorySlug": category_slug,
+        "city": city,
+        "phone": phone,
+        "rating": rating if isinstance(rating, (int, float)) else None,
+        "ratingCount": rating_count if isinstance(rating_count, int) else None,
+        "description": description,
+        "website": website,
+        "email": email,
+        "priceRange": price_range,
+        "fullData": full_data if full_data else (json.loads(row["place_full_data"]) if row.get("place_full_data") and isinstance(row.get("place_full_data"), str) else (row.get("place_full_data") if row.get("place_full_data") else None)),
+        "username": row["username"],
+        "fullName": row["full_name"],
+        "createdAt": to_jalali_datetime(row["created_at"]) if row["created_at"] else None,
+    }
+
 @app.get("/api/assigned-stores")
 async def get_assigned_stores(
     userId: Optional[int] = None,
@@ -2070,7 +4757,7 @@ async def get_assigned_stores(
             
             query += " ORDER BY as_store.assigned_date DESC, COALESCE(cc.place_name, '')"
             
-            cur.execute(query, params)
+            cur.execute(query, params, name="assigned_stores.list")
             rows = cur.fetchall()
             
             # Debug: Log query results
@@ -2087,7 +4774,7 @@ async def get_assigned_stores(
                     if row.get('storeName') == 'نامشخص' or row.get('storeName') is None:
                         print(f"  - WARNING: JOIN may have failed! Checking place_token match...")
                         # Check if place_token exists
-                        cur.execute("SELECT place_token, place_name FROM city_categories WHERE place_token = %s LIMIT 1", (row.get('store_token'),))
+                        cur.execute("SELECT place_token, place_name FROM city_categories WHERE place_token = %s LIMIT 1", (row.get('store_token'),), name="assigned_stores.debug_token_check")
                         match = cur.fetchone()
                         if match:
                             print(f"  - Found matching place_token: {match.get('place_token')}, place_name: {match.get('place_name')}")
@@ -2108,162 +4795,7 @@ async def get_assigned_stores(
                     continue
                 seen_tokens.add(store_token)
                 
-                full_data = row.get("place_full_data")
-                
-                # اگر fullData موجود است، از آن استفاده کن
-                store_name = "نامشخص"
-                store_address = ""
-                store_lat = None
-                store_lng = None
-                category = ""
-                category_slug = None
-                city = ""
-                phone = None
-                rating = None
-                rating_count = None
-                description = None
-                website = None
-                email = None
-                price_range = None
-                
-                if full_data:
-                    if isinstance(full_data, str):
-                        try:
-                            full_data = json.loads(full_data)
-                        except:
-                            full_data = None
-                    
-                    if full_data and isinstance(full_data, dict):
-                        # استخراج name از fullData
-                        store_name = full_data.get("name") or full_data.get("seo_details", {}).get("name") or "نامشخص"
-                        
-                        # استخراج آدرس از fields
-                        fields = full_data.get("fields", [])
-                        if fields:
-                            address_field = next((f.get("value") for f in fields if f.get("type") == "text" and f.get("value")), None)
-                            if address_field:
-                                store_address = address_field
-                        
-                        # استخراج مختصات از geometry
-                        geometry = full_data.get("geometry", {})
-                        if geometry and geometry.get("type") == "Point":
-                            coordinates = geometry.get("coordinates", [])
-                            if len(coordinates) >= 2:
-                                try:
-                                    store_lng = float(coordinates[0]) if not isinstance(coordinates[0], dict) else None  # longitude first
-                                    store_lat = float(coordinates[1]) if not isinstance(coordinates[1], dict) else None  # latitude second
-                                except (ValueError, TypeError):
-                                    store_lng = None
-                                    store_lat = None
-                        
-                        # استخراج سایر اطلاعات
-                        category = full_data.get("category") or ""
-                        phone = full_data.get("phone_link")
-                        rating = full_data.get("rating")
-                        if rating is not None and isinstance(rating, dict):
-                            rating = None
-                        if full_data.get("reviews"):
-                            rating_count = full_data.get("reviews", {}).get("total", 0)
-                            if isinstance(rating_count, dict):
-                                rating_count = None
-                        description = full_data.get("description")
-                        price_range = full_data.get("price_range")
-                        
-                        # استخراج category_slug از seo_details
-                        seo_details = full_data.get("seo_details", {})
-                        if seo_details:
-                            url_title = seo_details.get("url_title", "")
-                            # استخراج slug از url_title (مثلاً: "آجیل-و-شیرینی-سرای-آفاق-tehran-nei-iran-shahr_nuts-store")
-                            if "_" in url_title:
-                                category_slug = url_title.split("_")[-1]
-                        
-                        # استخراج city از seo_details
-                        if seo_details:
-                            schemas = seo_details.get("schemas", [])
-                            if schemas and len(schemas) > 0:
-                                geo = schemas[0].get("geo", {})
-                                if geo:
-                                    address_locality = geo.get("addressLocality")
-                                    if address_locality:
-                                        city = address_locality
-                
-                # اگر هنوز اطلاعات نداریم، از row استفاده کن (fallback)
-                if store_name == "نامشخص":
-                    store_name = row.get("storeName") or row.get("place_name") or "نامشخص"
-                if not store_address:
-                    store_address = row.get("storeAddress") or row.get("place_address") or ""
-                if not store_lat:
-                    lat_val = row.get("storeLat") or row.get("place_coordinates_lat")
-                    if lat_val is not None and not isinstance(lat_val, dict):
-                        try:
-                            store_lat = float(lat_val)
-                        except (ValueError, TypeError):
-                            store_lat = None
-                if not store_lng:
-                    lng_val = row.get("storeLng") or row.get("place_coordinates_lng")
-                    if lng_val is not None and not isinstance(lng_val, dict):
-                        try:
-                            store_lng = float(lng_val)
-                        except (ValueError, TypeError):
-                            store_lng = None
-                if not category:
-                    category = row.get("category") or row.get("category_display") or ""
-                if not category_slug:
-                    category_slug = row.get("category_slug")
-                if not city:
-                    city = row.get("city") or row.get("city_name") or ""
-                if not phone:
-                    phone = row.get("place_phone")
-                if rating is None:
-                    rating_val = row.get("place_rating")
-                    if rating_val is not None and not isinstance(rating_val, dict):
-                        try:
-                            rating = float(rating_val)
-                        except (ValueError, TypeError):
-                            rating = None
-                if rating_count is None:
-                    count_val = row.get("place_rating_count")
-                    if count_val is not None and not isinstance(count_val, dict):
-                        try:
-                            rating_count = int(count_val)
-                        except (ValueError, TypeError):
-                            rating_count = None
-                if not description:
-                    description = row.get("place_description")
-                if not website:
-                    website = row.get("place_website")
-                if not email:
-                    email = row.get("place_email")
-                if not price_range:
-                    price_range = row.get("place_price_range")
-                
-                assigned_stores_list.append({
-                    "id": row["id"],
-                    "userId": row["user_id"],
-                    "storeToken": row["store_token"],
-                    "assignedDate": to_jalali_date(row["assigned_date"]),
-                    "visitDate": to_jalali_date(row["visit_date"]) if row["visit_date"] else None,
-                    "status": row["status"],
-                    "notes": row["notes"],
-                    "storeName": store_name,
-                    "storeAddress": store_address,
-                    "storeLat": store_lat if isinstance(store_lat, (int, float)) else None,
-                    "storeLng": store_lng if isinstance(store_lng, (int, float)) else None,
-                    "category": category,
-                    "categorySlug": category_slug,
-                    "city": city,
-                    "phone": phone,
-                    "rating": rating if isinstance(rating, (int, float)) else None,
-                    "ratingCount": rating_count if isinstance(rating_count, int) else None,
-                    "description": description,
-                    "website": website,
-                    "email": email,
-                    "priceRange": price_range,
-                    "fullData": full_data if full_data else (json.loads(row["place_full_data"]) if row.get("place_full_data") and isinstance(row.get("place_full_data"), str) else (row.get("place_full_data") if row.get("place_full_data") else None)),
-                    "username": row["username"],
-                    "fullName": row["full_name"],
-                    "createdAt": to_jalali_datetime(row["created_at"]) if row["created_at"] else None,
-                })
+                assigned_stores_list.append(build_assigned_store_info(row))
             
             return {
                 "success": True,
@@ -2313,6 +4845,7 @@ async def submit_visit_data(request: VisitDataRequest, user: dict = Depends(requ
                 )
             )
             visit_data = cur.fetchone()
+            add_image_refs(cur, request.imageUrls)
             
             # به‌روزرسانی وضعیت assignment
             cur.execute(
@@ -2342,6 +4875,163 @@ async def submit_visit_data(request: VisitDataRequest, user: dict = Depends(requ
     finally:
         conn.close()
 
+VISIT_SYNC_MAX_ITEMS = int(os.getenv("VISIT_SYNC_MAX_ITEMS", "200"))
+
+@app.post("/api/store-visit-data/batch")
+async def sync_visit_data_batch(request: BatchVisitSyncRequest, user: dict = Depends(require_auth)):
+    """ثبت دسته‌ای ویزیت‌های ذخیره شده در حالت آفلاین
+
+    هر ویزیت یک clientKey دارد؛ ارسال دوباره همان دسته هرگز رکورد تکراری ایجاد نمی‌کند
+    و برای آیتم‌های قبلاً ثبت‌شده وضعیت duplicate برگردانده می‌شود.
+    """
+
+    if len(request.visits) > VISIT_SYNC_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"حداکثر {VISIT_SYNC_MAX_ITEMS} ویزیت در هر درخواست مجاز است")
+
+    # نتیجه هر آیتم به ترتیب ورودی؛ تاریخ و ساعت هر آیتم جداگانه بررسی می‌شود تا یک مقدار نامعتبر کل دسته را رد نکند
+    outcomes = [None] * len(request.visits)
+    items = []
+    seen_keys = {}
+    for index, item in enumerate(request.visits):
+        client_key = item.clientKey.strip()
+        error = None
+        if not client_key or len(client_key) > 100:
+            error = "clientKey نامعتبر است"
+        elif client_key in seen_keys:
+            error = f"clientKey تکراری در همین دسته (آیتم {seen_keys[client_key]})"
+        else:
+            seen_keys[client_key] = index
+            try:
+                visit_date = datetime.strptime(item.visitDate, "%Y-%m-%d").date()
+            except (TypeError, ValueError):
+                error = "visitDate باید به صورت YYYY-MM-DD باشد"
+            visit_time = None
+            if error is None and item.visitTime:
+                for time_format in ("%H:%M:%S", "%H:%M"):
+                    try:
+                        visit_time = datetime.strptime(item.visitTime, time_format).time()
+                        break
+                    except ValueError:
+                        pass
+                else:
+                    error = "visitTime باید به صورت HH:MM:SS باشد"
+        if error:
+            outcomes[index] = {"index": index, "clientKey": item.clientKey, "status": "invalid", "error": error}
+        else:
+            items.append((index, client_key, item, visit_date, visit_time))
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # بررسی مالکیت همه assignmentها با یک کوئری
+            assignment_ids = list({item.assignmentId for _, _, item, _, _ in items})
+            cur.execute(
+                "SELECT id, user_id, store_token FROM assigned_stores WHERE id = ANY(%s)",
+                (assignment_ids,)
+            )
+            assignments = {row["id"]: row for row in cur.fetchall()}
+
+            valid_items = []
+            for index, client_key, item, visit_date, visit_time in items:
+                assignment = assignments.get(item.assignmentId)
+                if not assignment:
+                    outcomes[index] = {"index": index, "clientKey": client_key, "status": "not_found", "error": "Assignment not found"}
+                elif assignment["user_id"] != user["userId"]:
+                    outcomes[index] = {"index": index, "clientKey": client_key, "status": "forbidden", "error": "You don't have permission to submit data for this assignment"}
+                else:
+                    valid_items.append((index, client_key, item, assignment, visit_date, visit_time))
+
+            inserted = {}
+            if valid_items:
+                # درج دسته‌ای؛ ویزیت‌هایی که قبلاً با همان clientKey ثبت شده‌اند نادیده گرفته می‌شوند
+                rows = execute_values(
+                    cur,
+                    """INSERT INTO store_visit_data
+                       (assignment_id, store_token, user_id, visit_date, visit_time, image_urls,
+                        additional_info, latitude, longitude, client_key, created_at, updated_at)
+                       VALUES %s
+                       ON CONFLICT (user_id, client_key) WHERE client_key IS NOT NULL DO NOTHING
+                       RETURNING id, client_key, created_at""",
+                    [
+                        (
+                            item.assignmentId,
+                            assignment["store_token"],
+                            user["userId"],
+                            visit_date,
+                            visit_time,
+                            item.imageUrls or [],
+                            json.dumps(item.additionalInfo) if item.additionalInfo else None,
+                            item.latitude,
+                            item.longitude,
+                            client_key,
+                        )
+                        for _, client_key, item, assignment, visit_date, visit_time in valid_items
+                    ],
+                    template="(%s, %s, %s, %s, %s, %s::TEXT[], %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+                    fetch=True,
+                )
+                inserted = {row["client_key"]: row for row in rows}
+
+            duplicate_keys = [client_key for _, client_key, _, _, _, _ in valid_items if client_key not in inserted]
+            existing = {}
+            if duplicate_keys:
+                cur.execute(
+                    "SELECT id, client_key, created_at FROM store_visit_data WHERE user_id = %s AND client_key = ANY(%s)",
+                    (user["userId"], duplicate_keys)
+                )
+                existing = {row["client_key"]: row for row in cur.fetchall()}
+
+            # به‌روزرسانی وضعیت همه assignmentها با یک دستور (آخرین تاریخ ویزیت هر assignment)
+            latest_visit_dates = {}
+            for _, client_key, item, _, visit_date, _ in valid_items:
+                if client_key in inserted:
+                    current = latest_visit_dates.get(item.assignmentId)
+                    if current is None or visit_date > current:
+                        latest_visit_dates[item.assignmentId] = visit_date
+            if latest_visit_dates:
+                execute_values(
+                    cur,
+                    """UPDATE assigned_stores AS a
+                       SET visit_date = v.visit_date, status = 'completed', updated_at = CURRENT_TIMESTAMP
+                       FROM (VALUES %s) AS v(id, visit_date)
+                       WHERE a.id = v.id""",
+                    list(latest_visit_dates.items()),
+                    template="(%s::INTEGER, %s::DATE)",
+                )
+
+            new_image_urls = [url for _, client_key, item, _, _, _ in valid_items if client_key in inserted for url in (item.imageUrls or [])]
+            add_image_refs(cur, new_image_urls)
+
+            conn.commit()
+
+            for index, client_key, item, _, visit_date, _ in valid_items:
+                row = inserted.get(client_key) or existing.get(client_key)
+                outcomes[index] = {
+                    "index": index,
+                    "clientKey": client_key,
+                    "status": "created" if client_key in inserted else "duplicate",
+                    "id": row["id"] if row else None,
+                    "assignmentId": item.assignmentId,
+                    "visitDate": to_jalali_date(visit_date),
+                    "createdAt": to_jalali_datetime(row["created_at"]) if row and row["created_at"] else None,
+                }
+
+            results = outcomes
+            return {
+                "success": True,
+                "results": results,
+                "created": sum(1 for r in results if r["status"] == "created"),
+                "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+                "failed": sum(1 for r in results if r["status"] not in ("created", "duplicate")),
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
 @app.get("/api/store-visit-data")
 async def get_visit_data(
     assignmentId: Optional[int] = None,
@@ -2399,8 +5089,9 @@ async def get_visit_data(
             
             query += " ORDER BY svd.visit_date DESC, svd.created_at DESC"
             
-            cur.execute(query, params)
+            cur.execute(query, params, name="visit_data.list")
             rows = cur.fetchall()
+            variants = load_image_variants(cur, [url for row in rows for url in (row["image_urls"] or [])])
             
             return {
                 "success": True,
@@ -2413,6 +5104,7 @@ async def get_visit_data(
                         "visitDate": to_jalali_date(row["visit_date"]),
                         "visitTime": str(row["visit_time"]) if row["visit_time"] else None,
                         "imageUrls": row["image_urls"] or [],
+                        "imageVariants": [image_variant_urls(url, variants.get(url)) for url in (row["image_urls"] or [])],
                         "additionalInfo": json.loads(row["additional_info"]) if row["additional_info"] else None,
                         "latitude": row["latitude"],
                         "longitude": row["longitude"],
@@ -2445,41 +5137,12 @@ async def create_store_deactivation_request(
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # بررسی وجود جدول store_deactivation_requests
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_schema = 'public' 
-                    AND table_name = 'store_deactivation_requests'
-                ) as table_exists;
-            """)
-            result = cur.fetchone()
-            table_exists = result["table_exists"] if result else False
-            
-            if not table_exists:
-                # ایجاد جدول در صورت عدم وجود
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS store_deactivation_requests (
-                        id SERIAL PRIMARY KEY,
-                        store_id INTEGER NOT NULL,
-                        store_token VARCHAR(255),
-                        requested_by INTEGER NOT NULL,
-                        reason TEXT,
-                        status VARCHAR(50) DEFAULT 'pending',
-                        reviewed_by INTEGER,
-                        reviewed_at TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (store_id) REFERENCES city_categories(id) ON DELETE CASCADE,
-                        FOREIGN KEY (requested_by) REFERENCES users(id) ON DELETE CASCADE,
-                        FOREIGN KEY (reviewed_by) REFERENCES users(id) ON DELETE SET NULL
-                    )
-                """)
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_store_id ON store_deactivation_requests(store_id)")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_store_token ON store_deactivation_requests(store_token)")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_status ON store_deactivation_requests(status)")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_deactivation_requests_requested_by ON store_deactivation_requests(requested_by)")
-                conn.commit()
+            # بررسی وجود جدول store_deactivation_requests (از registry وضعیت schema)
+            if not has_schema_capability("store_deactivation_requests"):
+                raise HTTPException(
+                    status_code=503,
+                    detail="جدول درخواست‌های غیرفعال‌سازی ایجاد نشده است. لطفاً migrationها را اجرا کنید."
+                )
             
             # بررسی وجود مغازه
             cur.execute("SELECT id, place_token FROM city_categories WHERE id = %s", (request.storeId,))
@@ -2514,6 +5177,7 @@ async def create_store_deactivation_request(
                 raise HTTPException(status_code=500, detail="خطا در ثبت درخواست. لطفاً دوباره تلاش کنید.")
             
             request_id = result["id"]
+            adjust_deactivation_request_counts(cur, {"pending": 1})
             conn.commit()
             
             return {
@@ -2525,7 +5189,6 @@ async def create_store_deactivation_request(
         raise
     except Exception as e:
         conn.rollback()
-        import traceback
         error_detail = f"{str(e)}\n{traceback.format_exc()}"
         print(f"[ERROR] DatabaseError: Error in store-deactivation-request - Endpoint: /api/store-deactivation-request")
         print(error_detail)
@@ -2570,16 +5233,22 @@ async def review_deactivation_request(
                     WHERE id = %s
                 """, (deactivation_request["store_id"],))
                 
-                # به‌روزرسانی وضعیت درخواست
+                # به‌روزرسانی وضعیت درخواست (فقط اگر هنوز pending است - بررسی همزمان شمارنده را دوبار کم نمی‌کند)
                 cur.execute("""
                     UPDATE store_deactivation_requests 
                     SET status = 'approved',
                         reviewed_by = %s,
                         reviewed_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
+                    WHERE id = %s AND status = 'pending'
                 """, (user["userId"], request.requestId))
+                if cur.rowcount == 0:
+                    conn.rollback()
+                    raise HTTPException(status_code=404, detail="درخواست یافت نشد یا قبلاً بررسی شده است")
+                adjust_deactivation_request_counts(cur, {"pending": -1, "approved": 1})
                 
+                notify_store_invalidation(cur, [deactivation_request["store_id"]], "deactivation_approved")
                 conn.commit()
+                run_store_invalidation_listeners([deactivation_request["store_id"]], "deactivation_approved")
                 
                 return {
                     "success": True,
@@ -2592,8 +5261,12 @@ async def review_deactivation_request(
                     SET status = 'rejected',
                         reviewed_by = %s,
                         reviewed_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
+                    WHERE id = %s AND status = 'pending'
                 """, (user["userId"], request.requestId))
+                if cur.rowcount == 0:
+                    conn.rollback()
+                    raise HTTPException(status_code=404, detail="درخواست یافت نشد یا قبلاً بررسی شده است")
+                adjust_deactivation_request_counts(cur, {"pending": -1, "rejected": 1})
                 
                 conn.commit()
                 
@@ -2611,12 +5284,160 @@ async def review_deactivation_request(
     finally:
         conn.close()
 
+DEACTIVATION_BULK_MAX = 500
+
+class BulkReviewDeactivationRequest(BaseModel):
+    requestIds: List[int]
+    action: str  # 'approve' or 'reject'
+    notes: Optional[str] = None
+
+@app.post("/api/review-deactivation-requests/bulk", dependencies=[Depends(require_admin)])
+async def bulk_review_deactivation_requests(
+    request: BulkReviewDeactivationRequest,
+    user: dict = Depends(require_auth)
+):
+    """تایید/رد دسته‌ای درخواست‌های غیرفعال کردن در یک تراکنش (فقط مدیر؛ session برای ثبت reviewed_by)"""
+    if request.action not in ("approve", "reject"):
+        raise HTTPException(status_code=400, detail="عمل نامعتبر است. باید 'approve' یا 'reject' باشد")
+    
+    request_ids = list(dict.fromkeys(request.requestIds))
+    if not request_ids:
+        return {"success": True, "results": [], "summary": {}}
+    if len(request_ids) > DEACTIVATION_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"حداکثر {DEACTIVATION_BULK_MAX} درخواست در هر بار مجاز است")
+    
+    new_status = "approved" if request.action == "approve" else "rejected"
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # به‌روزرسانی همه درخواست‌های pending با یک دستور (قفل ردیف از بررسی همزمان جلوگیری می‌کند)
+            cur.execute("""
+                UPDATE store_deactivation_requests 
+                SET status = %s,
+                    reviewed_by = %s,
+                    reviewed_at = CURRENT_TIMESTAMP,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ANY(%s) AND status = 'pending'
+                RETURNING id, store_id
+            """, (new_status, user["userId"], request_ids))
+            reviewed = {row["id"]: row["store_id"] for row in cur.fetchall()}
+            if reviewed:
+                adjust_deactivation_request_counts(cur, {"pending": -len(reviewed), new_status: len(reviewed)})
+            
+            deactivated_store_ids = []
+            if request.action == "approve" and reviewed:
+                cur.execute("""
+                    UPDATE city_categories 
+                    SET is_active = FALSE 
+                    WHERE id = ANY(%s) AND is_active IS DISTINCT FROM FALSE
+                    RETURNING id
+                """, (list(set(reviewed.values())),))
+                deactivated_store_ids = [row["id"] for row in cur.fetchall()]
+            
+            # وضعیت درخواست‌هایی که به‌روزرسانی نشدند (قبلاً بررسی شده یا موجود نیست)
+            skipped_ids = [rid for rid in request_ids if rid not in reviewed]
+            previous_status = {}
+            if skipped_ids:
+                cur.execute(
+                    "SELECT id, status FROM store_deactivation_requests WHERE id = ANY(%s)",
+                    (skipped_ids,)
+                )
+                previous_status = {row["id"]: row["status"] for row in cur.fetchall()}
+            
+            notify_store_invalidation(cur, deactivated_store_ids, "deactivation_approved")
+            conn.commit()
+            run_store_invalidation_listeners(deactivated_store_ids, "deactivation_approved")
+            
+            results = []
+            for rid in request_ids:
+                if rid in reviewed:
+                    results.append({"requestId": rid, "status": new_status, "storeId": reviewed[rid]})
+                elif rid in previous_status:
+                    results.append({"requestId": rid, "status": "already_reviewed", "currentStatus": previous_status[rid]})
+                else:
+                    results.append({"requestId": rid, "status": "not_found"})
+            
+            summary = {}
+            for item in results:
+                summary[item["status"]] = summary.get(item["status"], 0) + 1
+            
+            return {
+                "success": True,
+                "results": results,
+                "summary": summary,
+                "deactivatedStoreIds": deactivated_store_ids
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] DatabaseError: {e} - Endpoint: /api/review-deactivation-requests/bulk")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
+DEACTIVATION_PAGE_SIZE = 50
+DEACTIVATION_PAGE_MAX = 200
+
+def adjust_deactivation_request_counts(cur, changes: dict):
+    """به‌روزرسانی شمارنده وضعیت‌ها داخل همان تراکنش ثبت/بررسی درخواست"""
+    execute_values(
+        cur,
+        """INSERT INTO deactivation_request_counts AS c (status, request_count, updated_at)
+           VALUES %s
+           ON CONFLICT (status) DO UPDATE SET
+               request_count = c.request_count + EXCLUDED.request_count,
+               updated_at = CURRENT_TIMESTAMP""",
+        # ترتیب ثابت وضعیت‌ها تا دو تراکنش همزمان ردیف‌ها را با ترتیب متفاوت قفل نکنند
+        [(status, delta) for status, delta in sorted(changes.items()) if delta],
+        template="(%s, %s, CURRENT_TIMESTAMP)",
+    )
+
+def count_pending_deactivation_requests(cur) -> int:
+    """تعداد درخواست‌های pending از شمارنده deactivation_request_counts (بدون اسکن جدول درخواست‌ها)"""
+    cur.execute("SELECT request_count FROM deactivation_request_counts WHERE status = 'pending'")
+    row = cur.fetchone()
+    return max(0, row["request_count"]) if row else 0
+
 @app.get("/api/deactivation-requests")
 async def get_deactivation_requests(
     status: Optional[str] = None,
+    requestedBy: Optional[int] = None,
+    city: Optional[str] = None,
+    fromDate: Optional[str] = None,  # YYYY-MM-DD
+    toDate: Optional[str] = None,  # YYYY-MM-DD (شامل خود روز)
+    limit: int = DEACTIVATION_PAGE_SIZE,
+    cursor: Optional[str] = None,
     user: dict = Depends(require_auth)
 ):
-    """دریافت لیست درخواست‌های غیرفعال کردن (فقط مدیر)"""
+    """دریافت لیست درخواست‌های غیرفعال کردن با صفحه‌بندی keyset و فیلتر (فقط مدیر)"""
+    limit = max(1, min(limit, DEACTIVATION_PAGE_MAX))
+    
+    conditions = []
+    params = []
+    if status:
+        conditions.append("sdr.status = %s")
+        params.append(status)
+    if requestedBy is not None:
+        conditions.append("sdr.requested_by = %s")
+        params.append(requestedBy)
+    if city:
+        conditions.append("cc.city_name = %s")
+        params.append(city)
+    try:
+        if fromDate:
+            conditions.append("sdr.created_at >= %s")
+            params.append(datetime.strptime(fromDate, "%Y-%m-%d"))
+        if toDate:
+            conditions.append("sdr.created_at < %s")
+            params.append(datetime.strptime(toDate, "%Y-%m-%d") + timedelta(days=1))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="فرمت تاریخ باید YYYY-MM-DD باشد")
+    if cursor:
+        cursor_created_at, cursor_id = decode_keyset_cursor(cursor)
+        conditions.append("(sdr.created_at, sdr.id) < (%s, %s)")
+        params.extend([cursor_created_at, cursor_id])
+    
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -2631,6 +5452,7 @@ async def get_deactivation_requests(
                     sdr.reviewed_at,
                     cc.place_name,
                     cc.place_address,
+                    cc.city_name,
                     u1.username as requested_by_username,
                     u1.full_name as requested_by_fullname,
                     u2.username as reviewed_by_username,
@@ -2641,16 +5463,19 @@ async def get_deactivation_requests(
                 LEFT JOIN users u2 ON sdr.reviewed_by = u2.id
             """
             
-            params = []
-            if status:
-                query += " WHERE sdr.status = %s"
-                params.append(status)
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
             
-            query += " ORDER BY sdr.created_at DESC"
+            query += " ORDER BY sdr.created_at DESC, sdr.id DESC LIMIT %s"
+            params.append(limit + 1)
             
             cur.execute(query, params)
             rows = cur.fetchall()
             
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = encode_keyset_cursor(rows[-1]["created_at"], rows[-1]["id"]) if has_more else None
+            
             requests = []
             for row in rows:
                 requests.append({
@@ -2659,6 +5484,7 @@ async def get_deactivation_requests(
                     "storeToken": row["store_token"],
                     "storeName": row["place_name"],
                     "storeAddress": row["place_address"],
+                    "city": row["city_name"],
                     "reason": row["reason"],
                     "status": row["status"],
                     "requestedBy": {
@@ -2676,8 +5502,25 @@ async def get_deactivation_requests(
             return {
                 "success": True,
                 "requests": requests,
-                "count": len(requests)
+                "count": len(requests),
+                "pendingCount": count_pending_deactivation_requests(cur),
+                "nextCursor": next_cursor,
+                "hasMore": has_more
             }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        conn.close()
+
+@app.get("/api/deactivation-requests/pending-count")
+async def get_pending_deactivation_count(user: dict = Depends(require_auth)):
+    """تعداد درخواست‌های غیرفعال‌سازی در انتظار بررسی"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            return {"success": True, "pendingCount": count_pending_deactivation_requests(cur)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
@@ -2726,6 +5569,238 @@ async def update_store_workshop(
     finally:
         conn.close()
 
+# ==================== Bulk Store Patch ====================
+
+# فیلدهای مجاز برای ویرایش دسته‌ای: نام فیلد API -> (ستون، نوع SQL)
+STORE_PATCH_FIELDS = {
+    "hasWorkshop": ("has_workshop", "BOOLEAN"),
+    "isActive": ("is_active", "BOOLEAN"),
+    "plateNumber": ("place_plate_number", "VARCHAR(50)"),
+    "postalCode": ("place_postal_code", "VARCHAR(20)"),
+}
+STORE_PATCH_MAX_ITEMS = 1000
+# حداکثر طول فیلدهای متنی (مطابق ستون) و فیلدهایی که null برایشان مجاز نیست
+STORE_PATCH_MAX_LENGTHS = {"plateNumber": 50, "postalCode": 20}
+STORE_PATCH_NOT_NULL = {"hasWorkshop", "isActive"}
+
+class StorePatchItem(BaseModel):
+    storeId: int
+    hasWorkshop: Optional[bool] = None
+    isActive: Optional[bool] = None
+    plateNumber: Optional[str] = None
+    postalCode: Optional[str] = None
+
+class BulkStorePatchRequest(BaseModel):
+    updates: List[StorePatchItem]
+
+@app.patch("/api/stores/bulk", dependencies=[Depends(require_admin)])
+async def bulk_patch_stores(request: BulkStorePatchRequest):
+    """ویرایش دسته‌ای ویژگی‌های مغازه‌ها (کارگاه، فعال بودن، پلاک، کد پستی) با یک دستور UPDATE (فقط مدیر)"""
+    
+    if len(request.updates) > STORE_PATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"حداکثر {STORE_PATCH_MAX_ITEMS} مورد در هر بار مجاز است")
+    
+    # ادغام چند تغییر برای یک مغازه (تغییر بعدی اولویت دارد)؛ فقط فیلدهای ارسال‌شده اعمال می‌شوند
+    # خطاهای اعتبارسنجی قبل از اجرای UPDATE به تفکیک آیتم و فیلد گزارش می‌شوند
+    changes = {}
+    errors = []
+    for index, item in enumerate(request.updates):
+        fields_set = getattr(item, "model_fields_set", None)
+        if fields_set is None:
+            fields_set = item.__fields_set__
+        store_changes = changes.setdefault(item.storeId, {})
+        for field in STORE_PATCH_FIELDS:
+            if field not in fields_set:
+                continue
+            value = getattr(item, field)
+            if value is None and field in STORE_PATCH_NOT_NULL:
+                errors.append(f"updates[{index}].{field}: مقدار null مجاز نیست")
+            elif value is not None and field in STORE_PATCH_MAX_LENGTHS and len(value) > STORE_PATCH_MAX_LENGTHS[field]:
+                errors.append(f"updates[{index}].{field}: حداکثر {STORE_PATCH_MAX_LENGTHS[field]} کاراکتر مجاز است")
+            else:
+                store_changes[field] = value
+    if errors:
+        raise HTTPException(status_code=400, detail="؛ ".join(errors))
+    changes = {store_id: fields for store_id, fields in changes.items() if fields}
+    
+    if not changes:
+        return {"success": True, "updated": [], "updatedCount": 0, "unchangedIds": [], "notFoundIds": []}
+    
+    fields = list(STORE_PATCH_FIELDS.items())
+    value_columns = ["id"] + [name for field, (column, _) in fields for name in (f"set_{column}", column)]
+    template = "(%s::INTEGER, " + ", ".join(f"%s::BOOLEAN, %s::{sql_type}" for _, (_, sql_type) in fields) + ")"
+    set_clause = ",\n                ".join(
+        f"{column} = CASE WHEN v.set_{column} THEN v.{column} ELSE cc.{column} END"
+        for _, (column, _) in fields
+    )
+    changed_clause = " OR ".join(
+        f"(v.set_{column} AND cc.{column} IS DISTINCT FROM v.{column})"
+        for _, (column, _) in fields
+    )
+    rows = [
+        (store_id, *[value for field, _ in fields for value in (field in store_fields, store_fields.get(field))])
+        for store_id, store_fields in changes.items()
+    ]
+    
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            updated_rows = execute_values(
+                cur,
+                f"""UPDATE city_categories AS cc
+                    SET {set_clause},
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS v({", ".join(value_columns)})
+                    WHERE cc.id = v.id AND ({changed_clause})
+                    RETURNING cc.id, cc.place_token, cc.has_workshop, cc.is_active,
+                              cc.place_plate_number, cc.place_postal_code""",
+                rows,
+                template=template,
+                fetch=True,
+            )
+            updated_ids = {row["id"] for row in updated_rows}
+            
+            # تفکیک مغازه‌های بدون تغییر از مغازه‌های ناموجود
+            remaining_ids = [store_id for store_id in changes if store_id not in updated_ids]
+            existing_ids = set()
+            if remaining_ids:
+                cur.execute("SELECT id FROM city_categories WHERE id = ANY(%s)", (remaining_ids,))
+                existing_ids = {row["id"] for row in cur.fetchall()}
+            
+            notify_store_invalidation(cur, list(updated_ids), "bulk_patch")
+            conn.commit()
+            run_store_invalidation_listeners(list(updated_ids), "bulk_patch")
+            
+            return {
+                "success": True,
+                "updated": [
+                    {
+                        "storeId": row["id"],
+                        "token": row["place_token"],
+                        "hasWorkshop": row["has_workshop"],
+                        "isActive": row["is_active"],
+                        "plateNumber": row["place_plate_number"],
+                        "postalCode": row["place_postal_code"],
+                    }
+                    for row in updated_rows
+                ],
+                "updatedCount": len(updated_rows),
+                "unchangedIds": [store_id for store_id in remaining_ids if store_id in existing_ids],
+                "notFoundIds": [store_id for store_id in remaining_ids if store_id not in existing_ids],
+            }
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] DatabaseError: {e} - Endpoint: /api/stores/bulk")
+        raise HTTPException(status_code=500, detail=f"خطا در ویرایش دسته‌ای مغازه‌ها: {str(e)}")
+    finally:
+        conn.close()
+
+# ==================== Metrics Endpoint ====================
+
+def render_metric_gauges() -> List[str]:
+    """gaugeها و شمارنده‌های وضعیت فعلی (breaker، محدودیت همزمانی، پردازش عکس، sessionها)"""
+    lines = []
+    
+    def gauge(name: str, help_text: str, samples: list, metric_type: str = "gauge"):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for label_names, label_values, value in samples:
+            if value is not None:
+                lines.append(f"{name}{format_metric_labels(label_names, label_values)} {value}")
+    
+    breaker_states = {"closed": 0, "half_open": 1, "open": 2}
+    breakers = {name: breaker.stats() for name, breaker in RAAH_BREAKERS.items()}
+    gauge("raah_breaker_state", "Circuit breaker state (0=closed, 1=half_open, 2=open)",
+          [(("service",), (name, ), breaker_states[stats["state"]]) for name, stats in breakers.items()])
+    gauge("raah_breaker_opened_total", "Times the circuit breaker opened",
+          [(("service",), (name, ), stats["opened"]) for name, stats in breakers.items()], metric_type="counter")
+    cache = RAAH_CACHE.stats()
+    gauge("raah_cache_entries", "Cached raah.ir responses", [((), (), cache["entries"])])
+    gauge("raah_cache_hits_total", "raah.ir cache hits", [(("kind",), ("fresh",), cache["hits"]), (("kind",), ("stale",), cache["staleHits"])], metric_type="counter")
+    
+    routes = {path: limiter.stats() for path, limiter in ROUTE_LIMITERS.items()}
+    gauge("route_in_flight", "Requests currently executing per limited route",
+          [(("route",), (path,), stats["inFlight"]) for path, stats in routes.items()])
+    gauge("route_queued", "Requests waiting for a slot per limited route",
+          [(("route",), (path,), stats["queued"]) for path, stats in routes.items()])
+    gauge("route_rejected_total", "Requests shed per limited route",
+          [(("route", "reason"), (path, reason), stats[key]) for path, stats in routes.items()
+           for reason, key in (("queue_full", "rejectedQueueFull"), ("timeout", "rejectedTimeout"))], metric_type="counter")
+    
+    gauge("image_pipeline_jobs_total", "Image variant jobs by outcome",
+          [(("outcome",), (key,), IMAGE_PIPELINE_STATS[key]) for key in ("succeeded", "failed", "retried")], metric_type="counter")
+    gauge("image_pipeline_in_flight", "Image variant jobs running", [((), (), IMAGE_PIPELINE_STATS["inFlight"])])
+    
+    gauge("sessions_purged_total", "Expired sessions purged by this process", [((), (), SESSION_SWEEPER_STATS["purgedTotal"])], metric_type="counter")
+    gauge("sessions_table_rows", "Estimated user_sessions rows", [((), (), SESSION_SWEEPER_STATS["tableRows"])])
+    return lines
+
+@app.get("/api/concurrency-limits/stats", dependencies=[Depends(require_admin)])
+async def get_concurrency_limit_stats():
+    """شمارنده‌های همزمانی و رد درخواست برای هر مسیر محدودشده (فقط مدیر)"""
+    return {
+        "success": True,
+        "queueTimeoutSeconds": ROUTE_QUEUE_TIMEOUT,
+        "routes": {path: limiter.stats() for path, limiter in ROUTE_LIMITERS.items()},
+    }
+
+@app.get("/api/db/slow-queries", dependencies=[Depends(require_admin)])
+async def get_slow_queries():
+    """آخرین کوئری‌های کند و planهای نمونه‌برداری‌شده"""
+    return {
+        "success": True,
+        "slowQueryMs": SLOW_QUERY_MS,
+        "explainSampleRate": EXPLAIN_SAMPLE_RATE,
+        "explainQueryNames": sorted(EXPLAIN_QUERY_NAMES),
+        "slowQueries": list(SLOW_QUERY_LOG)[::-1],
+        "planSamples": list(QUERY_PLAN_SAMPLES)[::-1],
+    }
+
+@app.get("/api/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """فهرست آخرین درخواست‌های پروفایل‌شده"""
+    profiles = [
+        {
+            **{key: profile.report[key] for key in ("id", "method", "path", "status", "startedAt", "totalMs")},
+            "sqlMs": profile.report["sql"]["totalMs"],
+            "httpMs": profile.report["http"]["totalMs"],
+        }
+        for profile in reversed(list(PROFILE_STORE.values()))
+    ]
+    return {"success": True, "profiles": profiles, "count": len(profiles)}
+
+@app.get("/api/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """گزارش کامل یک درخواست پروفایل‌شده (توابع پایتون، SQL و HTTP خارجی)"""
+    profile = PROFILE_STORE.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {"success": True, "profile": profile.report}
+
+@app.get("/api/profiles/{profile_id}/pstats", dependencies=[Depends(require_admin)])
+async def download_profile_pstats(profile_id: str):
+    """خروجی خام cProfile (قابل باز شدن با pstats یا snakeviz)"""
+    profile = PROFILE_STORE.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        content=profile.pstats,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'},
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """متریک‌ها با فرمت متنی Prometheus"""
+    lines = []
+    for metric in (HTTP_REQUESTS_TOTAL, HTTP_REQUEST_SECONDS, DB_QUERY_SECONDS, DB_QUERY_ERRORS,
+                   DB_CONNECT_SECONDS, RAAH_REQUEST_SECONDS, RAAH_REQUEST_ERRORS):
+        lines.extend(metric.render())
+    lines.extend(render_metric_gauges())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 # ==================== Root Endpoint ====================
 
 @app.get("/")
@@ -2734,6 +5809,19 @@ async def root():
     return {"message": "Store Management API", "version": "1.0.0"}
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        try:
+            applied = run_migrations()
+        except Exception:
+            sys.exit(1)
+        print(f"[MIGRATION] {len(applied)} migration(s) applied")
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "gc-images":
+        # python main.py gc-images [graceHours] [--dry-run]
+        args = [arg for arg in sys.argv[2:] if arg != "--dry-run"]
+        result = collect_image_garbage(int(args[0]) if args else 24, "--dry-run" in sys.argv)
+        print(f"[IMAGE GC] {json.dumps(result)}")
+        sys.exit(0)
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,270 @@
+"""
+سرور mock سرویس‌های raah.ir برای تست کارایی بدون تماس با سرویس واقعی
+
+    python mock_raah.py --port 8090 --latency-ms 80 --jitter-ms 40 --error-rate 0.05 --timeout-rate 0.01
+
+و اجرای API با:
+
+    RAAH_REVERSE_GEOCODING_URL=http://localhost:8090/reverse/v1 \\
+    RAAH_GEOCODING_URL=http://localhost:8090/geocoding/v1 uvicorn main:app
+
+endpointها با هر پیشوندی پاسخ داده می‌شوند (فقط انتهای مسیر مهم است) تا هر سرویس آدرس پایه
+و در نتیجه circuit breaker جداگانه داشته باشد:
+    .../v1/?location=lng,lat                       reverse geocoding (formatted_address و components)
+    .../v1/features?result_type=X&location=lng,lat  street / neighborhood / city / county
+    .../v1/?address=...                             forward geocoding
+
+پاسخ‌ها فقط به مختصات/آدرس وابسته‌اند و خطاها با random seed ثابت تولید می‌شوند، پس نتایج
+تکرارپذیرند. تنظیمات در حین اجرا با POST /_mock/config قابل تغییر است (مثلاً برای شبیه‌سازی
+قطعی در وسط یک load test) و آمار در GET /_mock/stats است.
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import threading
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import uvicorn
+
+# محله‌های نمونه تهران: (نام، منطقه، عرض، طول)
+NEIGHBORHOODS = [
+    ("ونک", "منطقه ۳", 35.7575, 51.4100),
+    ("تجریش", "منطقه ۱", 35.8040, 51.4330),
+    ("پاسداران", "منطقه ۴", 35.7700, 51.4650),
+    ("سعادت آباد", "منطقه ۲", 35.7800, 51.3750),
+    ("جنت آباد", "منطقه ۵", 35.7500, 51.3050),
+    ("نارمک", "منطقه ۸", 35.7450, 51.5050),
+    ("تهرانپارس", "منطقه ۴", 35.7350, 51.5400),
+    ("بازار", "منطقه ۱۲", 35.6750, 51.4200),
+    ("انقلاب", "منطقه ۶", 35.7010, 51.3950),
+    ("یوسف آباد", "منطقه ۶", 35.7300, 51.4050),
+    ("شهرک غرب", "منطقه ۲", 35.7600, 51.3600),
+    ("نازی آباد", "منطقه ۱۶", 35.6400, 51.4100),
+    ("شهر ری", "منطقه ۲۰", 35.5950, 51.4400),
+    ("پیروزی", "منطقه ۱۳", 35.6950, 51.4750),
+    ("صادقیه", "منطقه ۵", 35.7200, 51.3400),
+]
+STREETS = ["ولیعصر", "شریعتی", "آزادی", "انقلاب", "دماوند", "پیروزی", "ستارخان", "مطهری", "بهشتی", "کارگر", "جمهوری", "نواب"]
+# شهرها: (نام، استان، عرض، طول، شعاع به کیلومتر)
+CITIES = [
+    ("تهران", "استان تهران", 35.6997, 51.3380, 25),
+    ("کرج", "استان البرز", 35.8400, 50.9391, 15),
+]
+RESULT_TYPES = ("street", "neighborhood", "city", "county")
+
+class MockConfig(BaseModel):
+    """رفتار سرور mock"""
+    latencyMs: float = 50
+    jitterMs: float = 20
+    # درصد درخواست‌هایی که با errorStatus پاسخ می‌گیرند
+    errorRate: float = 0.0
+    errorStatus: int = 503
+    # درصد درخواست‌هایی که timeoutSeconds معطل می‌مانند (بیشتر از timeout کلاینت)
+    timeoutRate: float = 0.0
+    timeoutSeconds: float = 30
+    # درصد درخواست‌هایی که نتیجه خالی می‌گیرند (برای تست مسیرهای fallback)
+    emptyRate: float = 0.0
+
+class MockConfigUpdate(BaseModel):
+    latencyMs: Optional[float] = None
+    jitterMs: Optional[float] = None
+    errorRate: Optional[float] = None
+    errorStatus: Optional[int] = None
+    timeoutRate: Optional[float] = None
+    timeoutSeconds: Optional[float] = None
+    emptyRate: Optional[float] = None
+
+class MockState:
+    """تنظیمات، random seed و آمار سرور"""
+
+    def __init__(self, config: MockConfig, seed: int):
+        self.config = config
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.rng = random.Random(self.seed)
+            self.counters = {}
+
+    def decide(self) -> tuple:
+        """(نتیجه، تاخیر به ثانیه) برای درخواست بعدی"""
+        config = self.config
+        with self.lock:
+            roll = self.rng.random()
+            delay = max(0.0, self.rng.gauss(config.latencyMs, config.jitterMs)) / 1000 if config.jitterMs else config.latencyMs / 1000
+        if roll < config.timeoutRate:
+            return "timeout", config.timeoutSeconds
+        if roll < config.timeoutRate + config.errorRate:
+            return "error", delay
+        if roll < config.timeoutRate + config.errorRate + config.emptyRate:
+            return "empty", delay
+        return "ok", delay
+
+    def count(self, endpoint: str, outcome: str):
+        with self.lock:
+            key = f"{endpoint}:{outcome}"
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+STATE = MockState(MockConfig(), seed=1)
+
+app = FastAPI(title="raah.ir mock")
+
+# ==================== Data ====================
+
+def stable_int(text: str) -> int:
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+
+def parse_location(location: Optional[str]) -> tuple:
+    """location به صورت lng,lat (مانند raah.ir)"""
+    try:
+        lng, lat = (float(value) for value in (location or "").split(","))
+        return lat, lng
+    except ValueError:
+        raise HTTPException(status_code=400, detail="location must be lng,lat")
+
+def nearest_neighborhood(lat: float, lng: float) -> tuple:
+    return min(NEIGHBORHOODS, key=lambda n: (n[2] - lat) ** 2 + (n[3] - lng) ** 2)
+
+def find_city(lat: float, lng: float) -> Optional[tuple]:
+    for city in CITIES:
+        # فاصله تقریبی به کیلومتر
+        distance = math.hypot((city[2] - lat) * 111, (city[3] - lng) * 111 * math.cos(math.radians(lat)))
+        if distance <= city[4]:
+            return city
+    return None
+
+def place_names(lat: float, lng: float) -> dict:
+    """نام‌های جغرافیایی نقطه (فقط به مختصات گرد شده وابسته است)"""
+    city = find_city(lat, lng)
+    if city is None:
+        return {}
+    names = {"city": city[0], "county": city[1]}
+    if city[0] == "تهران":
+        neighborhood = nearest_neighborhood(lat, lng)
+        names["neighborhood"] = neighborhood[0]
+        names["district"] = neighborhood[1]
+    names["street"] = "خیابان " + STREETS[stable_int(f"{lat:.4f},{lng:.4f}") % len(STREETS)]
+    return names
+
+def feature(name: str, result_type: str, lat: float, lng: float) -> dict:
+    return {
+        "type": "Feature",
+        "properties": {"name": name, "type": result_type},
+        "geometry": {"type": "Point", "coordinates": [lng, lat]},
+    }
+
+def reverse_geocode(lat: float, lng: float) -> dict:
+    names = place_names(lat, lng)
+    if not names:
+        return {"formatted_address": None, "components": []}
+    parts = [names[key] for key in ("city", "neighborhood", "street") if names.get(key)]
+    return {
+        "formatted_address": "، ".join(parts),
+        "components": [
+            {"type": key, "full_name": names[key], "short_name": names[key]}
+            for key in ("county", "city", "neighborhood", "street") if names.get(key)
+        ],
+    }
+
+def forward_geocode(address: str) -> dict:
+    """مختصات ثابت برای هر آدرس؛ اگر نام محله‌ای در آدرس باشد نزدیک همان محله"""
+    seed = stable_int(address)
+    anchor = next((n for n in NEIGHBORHOODS if n[0] in address), NEIGHBORHOODS[seed % len(NEIGHBORHOODS)])
+    offset_lat = ((seed >> 4) % 1000 - 500) / 100000
+    offset_lng = ((seed >> 14) % 1000 - 500) / 100000
+    return {"location": {"lat": round(anchor[2] + offset_lat, 6), "lng": round(anchor[3] + offset_lng, 6)}, "address": address}
+
+# ==================== Endpoints ====================
+
+@app.get("/_mock/stats")
+async def mock_stats():
+    with STATE.lock:
+        counters = dict(STATE.counters)
+    return {"config": STATE.config.dict(), "seed": STATE.seed, "counters": counters, "total": sum(counters.values())}
+
+@app.post("/_mock/config")
+async def mock_config(update: MockConfigUpdate):
+    """تغییر رفتار سرور در حین اجرا"""
+    changes = {key: value for key, value in update.dict().items() if value is not None}
+    STATE.config = MockConfig(**{**STATE.config.dict(), **changes})
+    return {"config": STATE.config.dict()}
+
+@app.post("/_mock/reset")
+async def mock_reset():
+    """پاک کردن آمار و شروع دوباره دنباله تصادفی (برای تکرار دقیق یک سناریو)"""
+    STATE.reset()
+    return {"success": True}
+
+@app.get("/{path:path}")
+async def raah_endpoint(path: str, request: Request):
+    path = path.rstrip("/")
+    params = request.query_params
+    if path.endswith("v1/features"):
+        endpoint = f"features.{params.get('result_type')}"
+    elif path == "v1" or path.endswith("/v1"):
+        endpoint = "geocode" if "address" in params else "reverse"
+    else:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    outcome, delay = STATE.decide()
+    STATE.count(endpoint, outcome)
+    await asyncio.sleep(delay)
+    if outcome == "timeout":
+        return JSONResponse({"error": "timeout"}, status_code=504)
+    if outcome == "error":
+        return JSONResponse({"error": "injected failure"}, status_code=STATE.config.errorStatus)
+
+    if endpoint == "geocode":
+        if outcome == "empty" or not params.get("address"):
+            return {"location": None}
+        return forward_geocode(params["address"])
+
+    lat, lng = parse_location(params.get("location"))
+    if endpoint == "reverse":
+        if outcome == "empty":
+            return {"formatted_address": None, "components": []}
+        return reverse_geocode(lat, lng)
+
+    result_type = params.get("result_type")
+    if result_type not in RESULT_TYPES:
+        raise HTTPException(status_code=400, detail=f"result_type must be one of {', '.join(RESULT_TYPES)}")
+    name = place_names(lat, lng).get(result_type)
+    if outcome == "empty" or not name:
+        return {"type": "FeatureCollection", "features": []}
+    return {"type": "FeatureCollection", "features": [feature(name, result_type, lat, lng)]}
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Mock raah.ir geocoding server for offline performance tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=30)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    global STATE
+    STATE = MockState(MockConfig(
+        latencyMs=args.latency_ms,
+        jitterMs=args.jitter_ms,
+        errorRate=args.error_rate,
+        errorStatus=args.error_status,
+        timeoutRate=args.timeout_rate,
+        timeoutSeconds=args.timeout_seconds,
+        emptyRate=args.empty_rate,
+    ), seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main_cli()
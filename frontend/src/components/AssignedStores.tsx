@@ -155,6 +155,10 @@ export default function AssignedStores() {
   const [submittingComment, setSubmittingComment] = useState(false);
   const [storeComments, setStoreComments] = useState<any[]>([]);
   const [loadingComments, setLoadingComments] = useState(false);
+  const [loadingMoreComments, setLoadingMoreComments] = useState(false);
+  const [storeCommentsCursor, setStoreCommentsCursor] = useState<string | null>(null);
+  const [storeCommentsTotal, setStoreCommentsTotal] = useState<number | null>(null);
+  const [storeCommentsError, setStoreCommentsError] = useState<string | null>(null);
   
   // Store deactivation state
   const [showDeactivationModal, setShowDeactivationModal] = useState(false);
@@ -592,18 +596,33 @@ export default function AssignedStores() {
 
   const mapCenter: [number, number] = userLocation || [35.6892, 51.3890];
 
-  // Load store comments
-  const loadStoreComments = async (storeId: number) => {
-    setLoadingComments(true);
+  // Load store comments (صفحه اول؛ صفحه‌های بعد با cursor از دکمه "نظرات بیشتر")
+  const loadStoreComments = async (storeId: number, cursor?: string | null) => {
+    if (cursor) {
+      setLoadingMoreComments(true);
+    } else {
+      setLoadingComments(true);
+      setStoreComments([]);
+      setStoreCommentsCursor(null);
+      setStoreCommentsTotal(null);
+    }
+    setStoreCommentsError(null);
     try {
-      const response = await storeCommentsAPI.getComments(storeId);
+      const response = await storeCommentsAPI.getComments(storeId, cursor ? { cursor } : undefined);
       if (response.success) {
-        setStoreComments(response.comments || []);
+        const page = response.comments || [];
+        setStoreComments((prev) => (cursor ? [...prev, ...page] : page));
+        setStoreCommentsCursor(response.hasMore ? response.nextCursor : null);
+        // تعداد کل از آمار store_comment_stats (نه تعداد نظرات دریافت‌شده)
+        setStoreCommentsTotal(response.stats?.commentCount ?? response.totalCount ?? null);
+      } else {
+        setStoreCommentsError(response.error || response.detail || 'خطا در دریافت نظرات');
       }
-    } catch (error) {
-      // Silent error
+    } catch (error: any) {
+      setStoreCommentsError(error?.message || 'خطا در دریافت نظرات');
     } finally {
       setLoadingComments(false);
+      setLoadingMoreComments(false);
     }
   };
 
@@ -2909,10 +2928,13 @@ export default function AssignedStores() {
 
           {/* Comments List */}
           <div style={{ marginTop: '20px', borderTop: '1px solid #ddd', paddingTop: '15px' }}>
-            <h4 style={{ margin: '0 0 10px 0', fontSize: '16px' }}>نظرات ({storeComments.length})</h4>
+            <h4 style={{ margin: '0 0 10px 0', fontSize: '16px' }}>نظرات ({storeCommentsTotal ?? storeComments.length})</h4>
+            {storeCommentsError && (
+              <p style={{ textAlign: 'center', color: '#d32f2f', fontSize: '13px' }}>{storeCommentsError}</p>
+            )}
             {loadingComments ? (
               <p style={{ textAlign: 'center', color: '#666' }}>در حال بارگذاری...</p>
-            ) : storeComments.length === 0 ? (
+            ) : storeComments.length === 0 && !storeCommentsError ? (
               <p style={{ textAlign: 'center', color: '#666' }}>هنوز نظری ثبت نشده است</p>
             ) : (
               <div style={{ maxHeight: '200px', overflowY: 'auto' }}>
@@ -2946,6 +2968,24 @@ export default function AssignedStores() {
                     )}
                   </div>
                 ))}
+                {storeCommentsCursor && (
+                  <button
+                    onClick={() => loadStoreComments(selectedStoreForPanel.id, storeCommentsCursor)}
+                    disabled={loadingMoreComments}
+                    style={{
+                      width: '100%',
+                      padding: '8px',
+                      backgroundColor: loadingMoreComments ? '#ccc' : '#eeeeee',
+                      color: '#424242',
+                      border: 'none',
+                      borderRadius: '4px',
+                      cursor: loadingMoreComments ? 'not-allowed' : 'pointer',
+                      fontSize: '13px'
+                    }}
+                  >
+                    {loadingMoreComments ? 'در حال بارگذاری...' : 'نظرات بیشتر'}
+                  </button>
+                )}
               </div>
             )}
           </div>
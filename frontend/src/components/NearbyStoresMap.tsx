@@ -80,6 +80,10 @@ export default function NearbyStoresMap() {
   const [showGroupModal, setShowGroupModal] = useState(false);
   const [selectedStoresForGroup, setSelectedStoresForGroup] = useState<number[]>([]);
   const [comments, setComments] = useState<Comment[]>([]);
+  const [commentsCursor, setCommentsCursor] = useState<string | null>(null);
+  const [commentsTotal, setCommentsTotal] = useState<number | null>(null);
+  const [commentsError, setCommentsError] = useState<string | null>(null);
+  const [loadingMoreComments, setLoadingMoreComments] = useState(false);
   const [commentText, setCommentText] = useState('');
   const [commentRating, setCommentRating] = useState<number>(5);
   const [groupName, setGroupName] = useState('');
@@ -285,14 +289,31 @@ export default function NearbyStoresMap() {
     }
   };
 
-  // Fetch comments for a store
-  const fetchComments = async (storeId: number) => {
+  // Fetch comments for a store (صفحه اول؛ صفحه‌های بعد با cursor از دکمه "نظرات بیشتر")
+  const fetchComments = async (storeId: number, cursor?: string | null) => {
+    if (cursor) {
+      setLoadingMoreComments(true);
+    } else {
+      setComments([]);
+      setCommentsCursor(null);
+      setCommentsTotal(null);
+    }
+    setCommentsError(null);
     try {
-      const data = await storeCommentsAPI.getComments(storeId);
+      const data = await storeCommentsAPI.getComments(storeId, cursor ? { cursor } : undefined);
       if (data.success) {
-        setComments(data.comments);
+        const page = data.comments || [];
+        setComments((prev) => (cursor ? [...prev, ...page] : page));
+        setCommentsCursor(data.hasMore ? data.nextCursor : null);
+        // تعداد کل از آمار store_comment_stats (نه تعداد نظرات دریافت‌شده)
+        setCommentsTotal(data.stats?.commentCount ?? data.totalCount ?? null);
+      } else {
+        setCommentsError(data.error || data.detail || 'خطا در دریافت نظرات');
       }
     } catch (err: any) {
+      setCommentsError(err?.message || 'خطا در دریافت نظرات');
+    } finally {
+      setLoadingMoreComments(false);
     }
   };
 
@@ -1008,8 +1029,11 @@ export default function NearbyStoresMap() {
 
             {/* Comments List */}
             <div>
-              <h3>نظرات قبلی:</h3>
-              {comments.length === 0 ? (
+              <h3>نظرات قبلی{commentsTotal !== null ? ` (${commentsTotal})` : ''}:</h3>
+              {commentsError && (
+                <p style={{ color: '#d32f2f' }}>{commentsError}</p>
+              )}
+              {comments.length === 0 && !commentsError ? (
                 <p style={{ color: '#666' }}>هنوز نظری ثبت نشده</p>
               ) : (
                 comments.map((comment) => (
@@ -1032,6 +1056,22 @@ export default function NearbyStoresMap() {
                   </div>
                 ))
               )}
+              {commentsCursor && (
+                <button
+                  onClick={() => fetchComments(selectedStore.id, commentsCursor)}
+                  disabled={loadingMoreComments}
+                  style={{
+                    width: '100%',
+                    padding: '8px',
+                    backgroundColor: loadingMoreComments ? '#ccc' : '#eeeeee',
+                    border: 'none',
+                    borderRadius: '4px',
+                    cursor: loadingMoreComments ? 'not-allowed' : 'pointer'
+                  }}
+                >
+                  {loadingMoreComments ? 'در حال بارگذاری...' : 'نظرات بیشتر'}
+                </button>
+              )}
             </div>
 
             <button
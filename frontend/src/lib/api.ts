@@ -318,17 +318,58 @@ export const storeCommentsAPI = {
     });
   },
 
-  getComments: async (storeId: number) => {
-    return apiCall(`/api/store-comments?storeId=${storeId}`, {
+  getComments: async (storeId: number, params?: { limit?: number; cursor?: string }) => {
+    const queryParams = new URLSearchParams();
+    queryParams.append('storeId', storeId.toString());
+    if (params?.limit) queryParams.append('limit', params.limit.toString());
+    if (params?.cursor) queryParams.append('cursor', params.cursor);
+
+    return apiCall(`/api/store-comments?${queryParams.toString()}`, {
       method: 'GET',
     });
   },
 
   uploadImage: async (file: File) => {
+    const baseURL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+    // آپلود مستقیم به storage با URL امضاشده؛ اگر همین عکس قبلاً آپلود شده، از URL موجود استفاده می‌شود
+    if (globalThis.crypto?.subtle) {
+      try {
+        const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        const sha256 = Array.from(new Uint8Array(digest))
+          .map((b) => b.toString(16).padStart(2, '0'))
+          .join('');
+        const presign = await apiCall('/api/uploads/presign', {
+          method: 'POST',
+          body: JSON.stringify({ sha256, size: file.size, contentType: file.type }),
+          credentials: 'include',
+        });
+        if (presign.exists) {
+          return { success: true, url: presign.url, variants: presign.variants, deduplicated: true };
+        }
+
+        const uploadForm = new FormData();
+        Object.entries(presign.upload.fields as Record<string, string>).forEach(([name, value]) => {
+          uploadForm.append(name, value);
+        });
+        uploadForm.append('file', file);
+        const uploadURL = presign.upload.url.startsWith('/') ? `${baseURL}${presign.upload.url}` : presign.upload.url;
+        const uploadResponse = await fetch(uploadURL, { method: 'POST', body: uploadForm });
+        if (uploadResponse.ok) {
+          return apiCall('/api/uploads/complete', {
+            method: 'POST',
+            body: JSON.stringify({ sha256 }),
+            credentials: 'include',
+          });
+        }
+      } catch {
+        // در صورت خطا، آپلود از طریق API انجام می‌شود
+      }
+    }
+
     const formData = new FormData();
     formData.append('file', file);
-    
-    const baseURL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
     const response = await fetch(`${baseURL}/api/upload-comment-image`, {
       method: 'POST',
       body: formData,
@@ -341,6 +382,27 @@ export const storeCommentsAPI = {
     
     return response.json();
   },
+
+  // آپلود چند عکس در یک درخواست (اختیاری: اضافه کردن مستقیم به یک نظر یا ویزیت)
+  uploadImages: async (files: File[], attachTo?: { commentId?: number; visitId?: number }) => {
+    const formData = new FormData();
+    files.forEach((file) => formData.append('files', file));
+    if (attachTo?.commentId) formData.append('commentId', attachTo.commentId.toString());
+    if (attachTo?.visitId) formData.append('visitId', attachTo.visitId.toString());
+
+    const baseURL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+    const response = await fetch(`${baseURL}/api/upload-images`, {
+      method: 'POST',
+      body: formData,
+      credentials: 'include',
+    });
+
+    if (!response.ok) {
+      throw new Error('خطا در آپلود عکس‌ها');
+    }
+
+    return response.json();
+  },
 };
 
 // User Location API
@@ -440,6 +502,24 @@ export const visitDataAPI = {
     });
   },
 
+  // همگام‌سازی دسته‌ای ویزیت‌های ثبت‌شده در حالت آفلاین (clientKey از ثبت تکراری جلوگیری می‌کند)
+  syncVisits: async (visits: Array<{
+    clientKey: string;
+    assignmentId: number;
+    visitDate: string;
+    visitTime?: string;
+    imageUrls?: string[];
+    additionalInfo?: Record<string, any>;
+    latitude?: number;
+    longitude?: number;
+  }>) => {
+    return apiCall('/api/store-visit-data/batch', {
+      method: 'POST',
+      body: JSON.stringify({ visits }),
+      credentials: 'include',
+    });
+  },
+
   getVisitData: async (params?: {
     assignmentId?: number;
     storeId?: number;
@@ -588,15 +668,48 @@ export const storeDeactivationAPI = {
     });
   },
 
-  getRequests: async (status?: string) => {
+  // تایید/رد دسته‌ای درخواست‌ها (نتیجه برای هر id جداگانه برگردانده می‌شود)
+  reviewRequestsBulk: async (data: {
+    requestIds: number[];
+    action: 'approve' | 'reject';
+    notes?: string;
+  }) => {
+    return apiCall('/api/review-deactivation-requests/bulk', {
+      method: 'POST',
+      body: JSON.stringify(data),
+      credentials: 'include',
+    });
+  },
+
+  getRequests: async (status?: string, filters?: {
+    requestedBy?: number;
+    city?: string;
+    fromDate?: string; // YYYY-MM-DD
+    toDate?: string; // YYYY-MM-DD
+    limit?: number;
+    cursor?: string;
+  }) => {
     const queryParams = new URLSearchParams();
     if (status) queryParams.append('status', status);
+    if (filters?.requestedBy !== undefined) queryParams.append('requestedBy', filters.requestedBy.toString());
+    if (filters?.city) queryParams.append('city', filters.city);
+    if (filters?.fromDate) queryParams.append('fromDate', filters.fromDate);
+    if (filters?.toDate) queryParams.append('toDate', filters.toDate);
+    if (filters?.limit) queryParams.append('limit', filters.limit.toString());
+    if (filters?.cursor) queryParams.append('cursor', filters.cursor);
 
     return apiCall(`/api/deactivation-requests?${queryParams.toString()}`, {
       method: 'GET',
       credentials: 'include',
     });
   },
+
+  getPendingCount: async () => {
+    return apiCall('/api/deactivation-requests/pending-count', {
+      method: 'GET',
+      credentials: 'include',
+    });
+  },
 };
 
 // Store Workshop API
@@ -613,3 +726,31 @@ export const storeWorkshopAPI = {
   },
 };
 
+// Bulk Store Patch API
+export const storesBulkPatchAPI = {
+  // ویرایش دسته‌ای ویژگی‌های مغازه‌ها (فقط فیلدهای ارسال‌شده تغییر می‌کنند)
+  patchStores: async (updates: Array<{
+    storeId: number;
+    hasWorkshop?: boolean;
+    isActive?: boolean;
+    plateNumber?: string | null;
+    postalCode?: string | null;
+  }>) => {
+    return apiCall('/api/stores/bulk', {
+      method: 'PATCH',
+      body: JSON.stringify({ updates }),
+      credentials: 'include',
+    });
+  },
+};
+
+// Batch Store Lookup API
+export const storesBatchAPI = {
+  // دریافت اطلاعات چند مغازه با یک درخواست (بر اساس place_token یا id)
+  getStores: async (params: { tokens?: string[]; ids?: number[]; fields?: string[] }) => {
+    return apiCall('/api/stores/batch', {
+      method: 'POST',
+      body: JSON.stringify(params),
+    });
+  },
+};